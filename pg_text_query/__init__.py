@@ -1,4 +1,89 @@
-from pg_text_query.gen_query import generate_query, generate_query_chat, is_valid_query
-from pg_text_query.prompt import get_default_prompt, concat_prompt, describe_database, get_custom_prompt
-from pg_text_query.db_schema import get_db_schema
-from pg_text_query.errors import QueryGenError, EnvVarError
+"""Utilities for generating Postgres queries from natural text.
+
+Public names are imported lazily from their submodules on first access, so
+importing pg_text_query (e.g. only for prompt.py or db_schema.py) does not pay
+for openai, yaml or pglast until they are actually needed.
+"""
+
+import importlib
+import typing as t
+
+if t.TYPE_CHECKING:
+    from pg_text_query.gen_query import generate_query, agenerate_query, generate_query_chat, is_valid_query, QueryGenerator, stream_query
+    from pg_text_query.backends import Backend, OpenAICompletionBackend, OpenAIChatBackend, LlamaCppBackend
+    from pg_text_query.session import ChatSession
+    from pg_text_query.prompt import get_default_prompt, concat_prompt, describe_database, get_custom_prompt, get_canonical_prompt
+    from pg_text_query.db_schema import get_db_schema, get_db_schema_snapshot, refresh_db_schema, SchemaFilter
+    from pg_text_query.schema_file import SchemaFile, write_schema_file
+    from pg_text_query.schema_store import SchemaStore
+    from pg_text_query.skeleton import SkeletonCache
+    from pg_text_query.dependencies import DependencyIndex
+    from pg_text_query.extract import extract_query
+    from pg_text_query.execute import limit_query, iter_query_rows, pooled_cursor
+    from pg_text_query.result_cache import ResultCache
+    from pg_text_query.explain import explain_query, check_query_cost, generate_explained_query
+    from pg_text_query.config import get_config, reload_config
+    from pg_text_query.trace import RequestTrace, set_tracer, use_tracer
+    from pg_text_query.errors import QueryGenError, EnvVarError, QueryExecError, QueryCostError
+
+
+_LAZY_IMPORTS = {
+    "generate_query": "gen_query",
+    "agenerate_query": "gen_query",
+    "generate_query_chat": "gen_query",
+    "is_valid_query": "gen_query",
+    "QueryGenerator": "gen_query",
+    "stream_query": "gen_query",
+    "Backend": "backends",
+    "OpenAICompletionBackend": "backends",
+    "OpenAIChatBackend": "backends",
+    "LlamaCppBackend": "backends",
+    "ChatSession": "session",
+    "get_default_prompt": "prompt",
+    "concat_prompt": "prompt",
+    "describe_database": "prompt",
+    "get_custom_prompt": "prompt",
+    "get_canonical_prompt": "prompt",
+    "get_db_schema": "db_schema",
+    "get_db_schema_snapshot": "db_schema",
+    "refresh_db_schema": "db_schema",
+    "SchemaFilter": "db_schema",
+    "SchemaFile": "schema_file",
+    "write_schema_file": "schema_file",
+    "SchemaStore": "schema_store",
+    "SkeletonCache": "skeleton",
+    "DependencyIndex": "dependencies",
+    "extract_query": "extract",
+    "limit_query": "execute",
+    "iter_query_rows": "execute",
+    "pooled_cursor": "execute",
+    "ResultCache": "result_cache",
+    "explain_query": "explain",
+    "check_query_cost": "explain",
+    "generate_explained_query": "explain",
+    "get_config": "config",
+    "reload_config": "config",
+    "RequestTrace": "trace",
+    "set_tracer": "trace",
+    "use_tracer": "trace",
+    "QueryGenError": "errors",
+    "EnvVarError": "errors",
+    "QueryExecError": "errors",
+    "QueryCostError": "errors",
+}
+
+__all__ = list(_LAZY_IMPORTS)
+
+
+def __getattr__(name: str) -> t.Any:
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = importlib.import_module(f"{__name__}.{_LAZY_IMPORTS[name]}")
+    value = getattr(module, name)
+    # Cache on the package so later lookups skip __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> t.List[str]:
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,245 @@
+"""Translates a stream of questions to SQL in bulk.
+
+Questions are read from a JSONL or CSV file (or stdin) one record at a time,
+generated with bounded concurrency, and written as JSONL in input order as
+soon as each is ready, so memory use does not depend on input size. Each
+output record holds the input record's id, the question, the generated query,
+whether it passes validation and any error.
+
+With --checkpoint (and --output to a file), progress is recorded every
+--checkpoint-every records; rerunning the same command after an interruption
+skips the records already written and appends the rest.
+
+Example:
+    python -m pg_text_query questions.csv --dsn "dbname=penguins" \\
+        --output queries.jsonl --checkpoint queries.ckpt --concurrency 16
+"""
+
+import argparse
+import collections
+import contextlib
+import csv
+import itertools
+import json
+import os
+import sys
+import typing as t
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from pg_text_query.gen_query import QueryGenerator, is_valid_query
+from pg_text_query.prompt import get_custom_prompt, get_default_prompt
+
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_CHECKPOINT_EVERY = 100
+
+
+class InvalidRecord(t.NamedTuple):
+    # Why the input line is not a record
+    error: str
+
+
+class Checkpoint(t.NamedTuple):
+    # Input records whose results have been written
+    records: int
+    # Size of the output file after writing them
+    output_bytes: int
+
+
+def read_checkpoint(path: str) -> Checkpoint:
+    if not os.path.exists(path):
+        return Checkpoint(0, 0)
+    with open(path) as f:
+        data = json.load(f)
+    return Checkpoint(data["records"], data["output_bytes"])
+
+
+def write_checkpoint(path: str, checkpoint: Checkpoint) -> None:
+    """Write checkpoint atomically, so an interruption never leaves it partial."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint._asdict(), f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_records(f: t.TextIO, input_format: str) -> t.Iterator[t.Union[t.Dict[str, t.Any], InvalidRecord]]:
+    """Yield input records one at a time from JSONL or CSV.
+
+    A JSONL line that is not a JSON object is yielded as an InvalidRecord, so
+    that it gets an error result rather than ending the run.
+    """
+    if input_format == "csv":
+        yield from csv.DictReader(f)
+        return
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield InvalidRecord(f"Invalid JSON: {e}")
+            continue
+        yield record if isinstance(record, dict) else InvalidRecord("Record is not a JSON object")
+
+
+def load_schema(args: argparse.Namespace) -> t.Dict[str, t.Any]:
+    """Load the schema from --schema-file, or fetch it once from --dsn."""
+    if args.schema_file:
+        with open(args.schema_file) as f:
+            return json.load(f)
+
+    import psycopg2
+
+    from pg_text_query.db_schema import get_db_schema
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        with conn.cursor() as cur:
+            return get_db_schema(cur, conn.info.dbname)
+    finally:
+        conn.close()
+
+
+def make_generator(args: argparse.Namespace) -> QueryGenerator:
+    if args.local_model:
+        return QueryGenerator.from_local(args.local_model)
+    if args.requests_per_minute or args.tokens_per_minute:
+        from pg_text_query.ratelimit import RateLimitedTransport, RateLimiter
+        from pg_text_query.transport import OpenAITransport
+
+        limiter = RateLimiter(args.requests_per_minute, args.tokens_per_minute)
+        return QueryGenerator(RateLimitedTransport(OpenAITransport(pool_maxsize=args.concurrency), limiter))
+    return QueryGenerator.from_openai(pool_maxsize=args.concurrency)
+
+
+def translate(
+    generator: QueryGenerator,
+    schema: t.Dict[str, t.Any],
+    record: t.Union[t.Dict[str, t.Any], InvalidRecord],
+    record_id: t.Any,
+    args: argparse.Namespace,
+) -> t.Dict[str, t.Any]:
+    """Generate and validate the query for one record; errors are recorded, not raised."""
+    if isinstance(record, InvalidRecord):
+        return {"id": record_id, "question": None, "query": None, "valid": False, "error": record.error}
+    question = record.get(args.question_field)
+    result = {"id": record_id, "question": question, "query": None, "valid": False, "error": None}
+    if not isinstance(question, str) or not question.strip():
+        result["error"] = f"Missing {args.question_field!r} field"
+        return result
+    if args.task_prompt is not None:
+        prompt = get_custom_prompt(args.task_prompt, question, schema)
+    else:
+        prompt = get_default_prompt(question, schema)
+    try:
+        query = generator.generate(prompt, completion_type=args.completion_type)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        return result
+    result["query"] = query
+    result["valid"] = bool(is_valid_query(query))
+    return result
+
+
+def run(
+    generator: QueryGenerator,
+    schema: t.Dict[str, t.Any],
+    records: t.Iterable[t.Union[t.Dict[str, t.Any], InvalidRecord]],
+    output: t.BinaryIO,
+    args: argparse.Namespace,
+    start: int = 0,
+    on_progress: t.Optional[t.Callable[[Checkpoint], None]] = None,
+) -> int:
+    """Translate records (numbered from start) and write results to output.
+
+    At most 2 * concurrency records are read ahead of the last one written.
+    on_progress is called with a checkpoint after every checkpoint_every
+    records and after the last one. Returns the number of records written.
+    """
+    window: t.Deque[Future] = collections.deque()
+    written = start
+
+    def write_next() -> None:
+        nonlocal written
+        output.write(json.dumps(window.popleft().result()).encode() + b"\n")
+        written += 1
+        if on_progress is not None and (written - start) % args.checkpoint_every == 0:
+            output.flush()
+            on_progress(Checkpoint(written, output.tell()))
+
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        for index, record in enumerate(records, start):
+            record_id = record.get(args.id_field, index) if args.id_field and isinstance(record, dict) else index
+            window.append(executor.submit(translate, generator, schema, record, record_id, args))
+            if len(window) >= 2 * args.concurrency:
+                write_next()
+        while window:
+            write_next()
+
+    output.flush()
+    if on_progress is not None:
+        on_progress(Checkpoint(written, output.tell()))
+    return written - start
+
+
+def parse_args(argv: t.Optional[t.Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m pg_text_query", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("input", nargs="?", default="-", help="JSONL or CSV file of questions (default: stdin)")
+    parser.add_argument("--format", dest="input_format", choices=["jsonl", "csv"], default=None,
+                        help="input format (default: from the file extension, else jsonl)")
+    parser.add_argument("--question-field", default="question", help="field holding each question")
+    parser.add_argument("--id-field", default="id", help="field holding each record's id (default: line number)")
+    parser.add_argument("--output", "-o", default="-", help="JSONL output file (default: stdout)")
+    schema = parser.add_mutually_exclusive_group(required=True)
+    schema.add_argument("--dsn", help="Postgres DSN to fetch the schema from")
+    schema.add_argument("--schema-file", help="JSON schema, as returned by get_db_schema")
+    parser.add_argument("--task-prompt", default=None,
+                        help="render prompts with get_custom_prompt and this task prompt")
+    parser.add_argument("--completion-type", choices=["single", "chat"], default=None,
+                        help="OpenAI model type (default: completion, or the local model)")
+    parser.add_argument("--local-model", default=None, help="GGUF model file to generate with locally")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--requests-per-minute", type=float, default=None)
+    parser.add_argument("--tokens-per-minute", type=float, default=None)
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file for resuming interrupted runs")
+    parser.add_argument("--checkpoint-every", type=int, default=DEFAULT_CHECKPOINT_EVERY)
+    args = parser.parse_args(argv)
+    if args.checkpoint and args.output == "-":
+        parser.error("--checkpoint requires --output to a file")
+    if args.input_format is None:
+        args.input_format = "csv" if args.input.lower().endswith(".csv") else "jsonl"
+    return args
+
+
+def main(argv: t.Optional[t.Sequence[str]] = None) -> None:
+    args = parse_args(argv)
+    checkpoint = read_checkpoint(args.checkpoint) if args.checkpoint else Checkpoint(0, 0)
+
+    with contextlib.ExitStack() as stack:
+        if args.input == "-":
+            input_file = sys.stdin
+        else:
+            input_file = stack.enter_context(open(args.input, newline="" if args.input_format == "csv" else None))
+        if args.output == "-":
+            output = sys.stdout.buffer
+        else:
+            output = stack.enter_context(open(args.output, "ab" if checkpoint.records else "wb"))
+            # Drop anything written after the checkpoint
+            output.truncate(checkpoint.output_bytes)
+            output.seek(checkpoint.output_bytes)
+
+        generator = stack.enter_context(make_generator(args))
+        schema = load_schema(args)
+        records = itertools.islice(read_records(input_file, args.input_format), checkpoint.records, None)
+        on_progress = (lambda c: write_checkpoint(args.checkpoint, c)) if args.checkpoint else None
+        written = run(generator, schema, records, output, args, checkpoint.records, on_progress)
+
+    print(f"Translated {written} questions ({checkpoint.records} done previously)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""Generation backends: the models that turn a prompt into query text.
+
+Every backend splits generation into two steps, so the layers above it can be
+shared: build_request merges a prompt, an optional system message, earlier
+messages of a conversation and any parameter overrides into a complete request (whose request_key identifies it
+for caching and de-duplication), and complete/stream run that request.
+QueryGenerator in gen_query.py adds validation on top of any backend.
+
+Backends:
+    - OpenAICompletionBackend: OpenAI completion models (e.g. Codex)
+    - OpenAIChatBackend: OpenAI chat models (e.g. ChatGPT)
+    - LlamaCppBackend: a local GGUF model run on CPU with llama-cpp-python,
+      for air-gapped or latency-sensitive use with no network hop
+"""
+
+import abc
+import threading
+import typing as t
+
+from pg_text_query.config import Config, get_config
+from pg_text_query.transport import Transport, get_transport, request_key, response_text
+
+
+DEFAULT_SYSTEM_PROMPT = "you are a text-to-SQL translator. You write PostgreSQL code based on plain-language prompts."
+
+
+class Message(t.TypedDict):
+    # "user" or "assistant"
+    role: str
+    content: str
+
+
+class Completion(t.TypedDict):
+    text: str
+    # Token usage as reported by the backend, if it reports any
+    usage: t.Optional[t.Dict[str, int]]
+
+
+def render_history(history: t.Sequence[Message], prompt: str) -> str:
+    """Render a conversation as one prompt for models without chat messages.
+
+    Earlier messages precede the prompt, each on its own line(s), with
+    generated queries terminated by ";" to separate them.
+    """
+    lines = [
+        message["content"].rstrip().rstrip(";") + ";" if message["role"] == "assistant" else message["content"]
+        for message in history
+    ]
+    return "\n".join(lines + [prompt])
+
+
+class Backend(abc.ABC):
+    """Base class for generation backends.
+
+    Subclasses implement build_request and complete; stream defaults to
+    yielding the whole completion at once.
+    """
+
+    # Identifies the backend in request keys
+    name = "backend"
+    # Whether responses may wrap the SQL in prose or fences (see extract.py)
+    extract_sql = False
+
+    @abc.abstractmethod
+    def build_request(
+        self,
+        prompt: str,
+        system: t.Optional[str] = None,
+        history: t.Sequence[Message] = (),
+        **overrides: t.Any,
+    ) -> t.Dict[str, t.Any]:
+        """Merge prompt, system message, history and overrides into a complete request."""
+
+    def request_key(self, request: t.Dict[str, t.Any]) -> str:
+        """Return a stable key for a request built by this backend."""
+        return request_key(self.name, request)
+
+    @abc.abstractmethod
+    def complete(self, request: t.Dict[str, t.Any]) -> Completion:
+        """Run request and return its generated text and token usage."""
+
+    def stream(self, request: t.Dict[str, t.Any]) -> t.Iterator[str]:
+        """Yield generated text in pieces; defaults to one piece via complete."""
+        yield self.complete(request)["text"]
+
+    def close(self) -> None:
+        """Release resources held by the backend."""
+
+
+class OpenAIBackend(Backend):
+    """Base class for backends sending requests through a transport.
+
+    If transport or config is None, the package-wide default (see
+    pg_text_query.transport.set_transport and pg_text_query.config) is used.
+    """
+
+    endpoint = ""
+
+    def __init__(self, transport: t.Optional[Transport] = None, config: t.Optional[Config] = None) -> None:
+        self._transport = transport
+        self._config = config
+
+    @property
+    def transport(self) -> Transport:
+        return self._transport if self._transport is not None else get_transport()
+
+    @property
+    def config(self) -> Config:
+        return self._config if self._config is not None else get_config()
+
+    def request_key(self, request: t.Dict[str, t.Any]) -> str:
+        return request_key(self.endpoint, request)
+
+    def complete(self, request: t.Dict[str, t.Any]) -> Completion:
+        response = self.transport.create(self.endpoint, request)
+        return {"text": response_text(self.endpoint, response), "usage": response.get("usage")}
+
+    def stream(self, request: t.Dict[str, t.Any]) -> t.Iterator[str]:
+        return self.transport.stream(self.endpoint, request)
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+
+
+class OpenAICompletionBackend(OpenAIBackend):
+    """OpenAI completion models, configured by the completion config.
+
+    Completion models take no system message, so system (if given) precedes
+    any history and the prompt in the prompt text.
+    """
+
+    name = endpoint = "completion"
+
+    def build_request(
+        self,
+        prompt: str,
+        system: t.Optional[str] = None,
+        history: t.Sequence[Message] = (),
+        **overrides: t.Any,
+    ) -> t.Dict[str, t.Any]:
+        full_prompt = render_history(history, prompt)
+        if system:
+            full_prompt = f"{system}\n\n{full_prompt}"
+        return {"prompt": full_prompt, **self.config.completion, **overrides}
+
+
+class OpenAIChatBackend(OpenAIBackend):
+    """OpenAI chat models, configured by the chat config.
+
+    The request is a system message (system, or a default text-to-SQL
+    instruction), then any history, then the prompt as the user message.
+    """
+
+    name = endpoint = "chat_completion"
+    extract_sql = True
+
+    def build_request(
+        self,
+        prompt: str,
+        system: t.Optional[str] = None,
+        history: t.Sequence[Message] = (),
+        **overrides: t.Any,
+    ) -> t.Dict[str, t.Any]:
+        messages = [
+            {"role": "system", "content": system or DEFAULT_SYSTEM_PROMPT},
+            *({"role": m["role"], "content": m["content"]} for m in history),
+            {"role": "user", "content": prompt},
+        ]
+        return {"messages": messages, **self.config.chat, **overrides}
+
+
+# Loaded llama.cpp models by (model path, load options), shared by backends
+_llama_models: t.Dict[t.Tuple[str, t.Tuple[t.Tuple[str, t.Any], ...]], t.Tuple[t.Any, threading.Lock]] = {}
+_llama_models_lock = threading.Lock()
+
+
+class LlamaCppBackend(Backend):
+    """A local model in GGUF format, run on CPU with llama-cpp-python.
+
+    The model is loaded on first use (or by calling load) and kept in memory,
+    shared by every backend created with the same model_path and load_kwargs
+    (passed to llama_cpp.Llama, e.g. n_ctx or n_threads). A model instance is
+    not thread-safe, so generations on the same model run one at a time.
+
+    params are default create_completion parameters, overridable per request.
+    Requires the optional llama-cpp-python package.
+    """
+
+    name = "llama_cpp"
+    extract_sql = True
+    DEFAULT_PARAMS = {"max_tokens": 200, "temperature": 0.0, "stop": [";"]}
+
+    def __init__(
+        self,
+        model_path: str,
+        params: t.Optional[t.Dict[str, t.Any]] = None,
+        **load_kwargs: t.Any,
+    ) -> None:
+        self.model_path = model_path
+        self.params = {**self.DEFAULT_PARAMS, **(params or {})}
+        self.load_kwargs = {"verbose": False, **load_kwargs}
+
+    def load(self) -> t.Tuple[t.Any, threading.Lock]:
+        """Load the model (once per process) and return it with its lock."""
+        key = (self.model_path, tuple(sorted(self.load_kwargs.items())))
+        with _llama_models_lock:
+            if key not in _llama_models:
+                try:
+                    from llama_cpp import Llama
+                except ImportError as e:
+                    raise ImportError(
+                        "LlamaCppBackend requires llama-cpp-python: pip install llama-cpp-python"
+                    ) from e
+                _llama_models[key] = (Llama(model_path=self.model_path, **self.load_kwargs), threading.Lock())
+            return _llama_models[key]
+
+    def build_request(
+        self,
+        prompt: str,
+        system: t.Optional[str] = None,
+        history: t.Sequence[Message] = (),
+        **overrides: t.Any,
+    ) -> t.Dict[str, t.Any]:
+        full_prompt = render_history(history, prompt)
+        if system:
+            full_prompt = f"{system}\n\n{full_prompt}"
+        return {"prompt": full_prompt, **self.params, **overrides}
+
+    def request_key(self, request: t.Dict[str, t.Any]) -> str:
+        return request_key(f"{self.name}:{self.model_path}", request)
+
+    def complete(self, request: t.Dict[str, t.Any]) -> Completion:
+        model, lock = self.load()
+        with lock:
+            response = model.create_completion(**request)
+        return {"text": response["choices"][0]["text"], "usage": response.get("usage")}
+
+    def stream(self, request: t.Dict[str, t.Any]) -> t.Iterator[str]:
+        model, lock = self.load()
+        with lock:
+            chunks = model.create_completion(**request, stream=True)
+            try:
+                for chunk in chunks:
+                    text = chunk["choices"][0]["text"]
+                    if text:
+                        yield text
+            finally:
+                chunks.close()
@@ -0,0 +1,94 @@
+"""Lazily loaded OpenAI completion configs.
+
+The YAML config files are only read the first time a completion config is
+needed, not when pg_text_query is imported. Config file paths come from the
+env vars PGTQ_OPENAI_CONFIG and CHAT_OPENAI_CONFIG, falling back to the files
+shipped with the package, and are resolved when the Config is constructed.
+Call reload_config to pick up changed files or env vars.
+"""
+
+import os
+import threading
+import typing as t
+
+
+DEFAULT_OPENAI_CONFIG_PATH = os.path.join(os.path.dirname(__file__), "default_openai_config.yaml")
+DEFAULT_CHAT_CONFIG_PATH = os.path.join(os.path.dirname(__file__), "openai_chat_config.yaml")
+
+
+def _load_completion_config(path: str) -> t.Dict[str, t.Any]:
+    import yaml
+
+    with open(path, "rb") as f:
+        return yaml.safe_load(f)["completion_create"]
+
+
+class Config:
+    """Completion configs for the single-prompt and chat completion types."""
+
+    def __init__(
+        self,
+        completion_config_path: t.Optional[str] = None,
+        chat_config_path: t.Optional[str] = None,
+    ) -> None:
+        self.completion_config_path = completion_config_path or os.getenv(
+            "PGTQ_OPENAI_CONFIG", DEFAULT_OPENAI_CONFIG_PATH
+        )
+        self.chat_config_path = chat_config_path or os.getenv(
+            "CHAT_OPENAI_CONFIG", DEFAULT_CHAT_CONFIG_PATH
+        )
+        self._lock = threading.Lock()
+        self._completion: t.Optional[t.Dict[str, t.Any]] = None
+        self._chat: t.Optional[t.Dict[str, t.Any]] = None
+
+    @property
+    def completion(self) -> t.Dict[str, t.Any]:
+        """Default Completion.create kwargs, loaded on first access."""
+        if self._completion is None:
+            with self._lock:
+                if self._completion is None:
+                    self._completion = _load_completion_config(self.completion_config_path)
+        return self._completion
+
+    @property
+    def chat(self) -> t.Dict[str, t.Any]:
+        """Default ChatCompletion.create kwargs, loaded on first access."""
+        if self._chat is None:
+            with self._lock:
+                if self._chat is None:
+                    self._chat = _load_completion_config(self.chat_config_path)
+        return self._chat
+
+    def reload(self) -> None:
+        """Discard loaded configs so the files are re-read on next access."""
+        with self._lock:
+            self._completion = None
+            self._chat = None
+
+
+_config: t.Optional[Config] = None
+_config_lock = threading.Lock()
+
+
+def get_config() -> Config:
+    """Return the package-wide Config, constructing it on first use."""
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                _config = Config()
+    return _config
+
+
+def set_config(config: Config) -> None:
+    """Replace the package-wide Config."""
+    global _config
+    with _config_lock:
+        _config = config
+
+
+def reload_config() -> Config:
+    """Re-resolve config paths from the environment and reload on next use."""
+    config = Config()
+    set_config(config)
+    return config
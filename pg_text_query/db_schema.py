@@ -1,13 +1,16 @@
 """Provides utilities for extracting structured schema data from a Postgres db."""
 
+import bisect
 import itertools
 import typing as t
 
 import psycopg2
 
+from pg_text_query import trace
 
-# Query includes schemas, tables, columns, and associated comments
-GET_DB_SCHEMA_SQL = """
+# Schemas, relations, columns and their comments. Relations are joined with their pg_class rows, which
+# relation_conditions (starting with AND, if any) can filter on as "c"; conditions is the WHERE clause.
+_DB_SCHEMA_SQL_TEMPLATE = """
 SELECT
     (SELECT pg_catalog.shobj_description(d.oid, 'pg_database')
     FROM   pg_catalog.pg_database d
@@ -26,25 +29,179 @@ SELECT
         quote_ident("information_schema"."schemata"."schema_name")::regnamespace::oid,
         'pg_namespace'
     ) AS "schemata.description",
-    -- NOTE: it is important to use the concat operator || and not the concat function below, as the former returns
-    -- NULL if any component is NULL and avoids breaking obj_description with queries for the non-existent relation "."
-    obj_description(
-        (quote_ident("information_schema"."schemata"."schema_name") || '.' || quote_ident("information_schema"."tables"."table_name"))::regclass::oid,
-        'pg_class'
-    )  AS "schemata.tables.description",
-    col_description(
-        (quote_ident("information_schema"."schemata"."schema_name")  || '.' || quote_ident("information_schema"."tables"."table_name"))::regclass::oid,
-        "information_schema"."columns"."ordinal_position"
-    ) AS "schemata.tables.columns.description"
+    obj_description(c.oid, 'pg_class') AS "schemata.tables.description",
+    col_description(c.oid, "information_schema"."columns"."ordinal_position") AS "schemata.tables.columns.description"
 FROM "information_schema"."schemata"
-LEFT JOIN "information_schema"."tables" ON "information_schema"."schemata"."schema_name" = "information_schema"."tables"."table_schema"
+LEFT JOIN (
+    "information_schema"."tables"
+    JOIN pg_catalog.pg_namespace n ON n.nspname = "information_schema"."tables"."table_schema"
+    JOIN pg_catalog.pg_class c ON c.relnamespace = n.oid AND c.relname = "information_schema"."tables"."table_name"
+) ON "information_schema"."schemata"."schema_name" = "information_schema"."tables"."table_schema"{relation_conditions}
 LEFT JOIN "information_schema"."columns" ON "information_schema"."tables"."table_name" = "information_schema"."columns"."table_name" AND "information_schema"."tables"."table_schema" = "information_schema"."columns"."table_schema"
-WHERE "information_schema"."schemata"."schema_name" != 'pg_catalog'
-AND "information_schema"."schemata"."schema_name" != 'information_schema'
-AND "information_schema"."schemata"."schema_name" != 'pg_toast'
+WHERE {conditions}
 ORDER BY "schemata.name", "schemata.tables.name";
 """
 
+_SYSTEM_SCHEMAS_CONDITION = """"information_schema"."schemata"."schema_name" != 'pg_catalog'
+AND "information_schema"."schemata"."schema_name" != 'information_schema'
+AND "information_schema"."schemata"."schema_name" != 'pg_toast'"""
+
+# Query includes schemas, tables, columns, and associated comments
+GET_DB_SCHEMA_SQL = _DB_SCHEMA_SQL_TEMPLATE.format(relation_conditions="", conditions=_SYSTEM_SCHEMAS_CONDITION)
+
+# Same as GET_DB_SCHEMA_SQL, for the relations named by parallel arrays of schema and relation names
+GET_RELATIONS_SQL = _DB_SCHEMA_SQL_TEMPLATE.format(
+    relation_conditions="",
+    conditions="""("information_schema"."tables"."table_schema", "information_schema"."tables"."table_name")
+    IN (SELECT * FROM unnest(%s::name[], %s::name[]))""",
+)
+
+GET_SCHEMA_DESCRIPTIONS_SQL = """
+SELECT nspname, obj_description(oid, 'pg_namespace')
+FROM pg_catalog.pg_namespace
+WHERE nspname = ANY(%s::name[]);
+"""
+
+# One row per schema (with a NULL relation name) and per relation visible to GET_DB_SCHEMA_SQL, with markers that
+# change whenever its part of the extracted schema does: xmin and relfilenode of its catalog row, its column count,
+# and a digest of its kind, comments and column names, types, nullability and defaults (which comments and some
+# column changes leave pg_class untouched), along with its relkind. The visibility filters mirror
+# information_schema's own; schema_conditions and relation_conditions take the same filters as GET_DB_SCHEMA_SQL.
+_SCHEMA_MARKERS_SQL_TEMPLATE = """
+SELECT
+    n.nspname AS schema_name,
+    NULL::name AS relation_name,
+    n.xmin::text::bigint AS xmin,
+    0::bigint AS relfilenode,
+    0::bigint AS columns,
+    md5(coalesce(obj_description(n.oid, 'pg_namespace'), '')) AS digest,
+    NULL::text AS kind
+FROM pg_catalog.pg_namespace n
+WHERE n.nspname NOT IN ('pg_catalog', 'information_schema', 'pg_toast')
+AND (pg_has_role(n.nspowner, 'USAGE') OR has_schema_privilege(n.oid, 'CREATE, USAGE')){schema_conditions}
+UNION ALL
+SELECT
+    n.nspname,
+    c.relname,
+    c.xmin::text::bigint,
+    c.relfilenode::bigint,
+    a.columns,
+    md5(c.relkind || coalesce(obj_description(c.oid, 'pg_class'), '') || coalesce(a.signature, '')),
+    c.relkind::text
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+CROSS JOIN LATERAL (
+    SELECT
+        count(*) AS columns,
+        string_agg(
+            concat_ws(
+                ' ', a.attname, a.atttypid, a.atttypmod, a.attnotnull,
+                pg_get_expr(d.adbin, d.adrelid), col_description(c.oid, a.attnum)
+            ),
+            ',' ORDER BY a.attnum
+        ) AS signature
+    FROM pg_catalog.pg_attribute a
+    LEFT JOIN pg_catalog.pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+    WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+) a
+WHERE c.relkind IN ('r', 'v', 'f', 'p')
+AND n.nspname NOT IN ('pg_catalog', 'information_schema', 'pg_toast')
+AND (
+    pg_has_role(c.relowner, 'USAGE')
+    OR has_table_privilege(c.oid, 'SELECT, INSERT, UPDATE, DELETE, TRUNCATE, REFERENCES, TRIGGER')
+    OR has_any_column_privilege(c.oid, 'SELECT, INSERT, UPDATE, REFERENCES')
+){schema_conditions}{relation_conditions};
+"""
+
+GET_SCHEMA_MARKERS_SQL = _SCHEMA_MARKERS_SQL_TEMPLATE.format(schema_conditions="", relation_conditions="")
+
+# The relkinds information_schema.tables lists: tables, views, foreign tables and partitioned tables
+RELKINDS = ("r", "v", "f", "p")
+
+
+class SchemaFilter(t.NamedTuple):
+    """Which schemata and relations to extract, applied in the extraction queries.
+
+    Patterns are SQL LIKE patterns (e.g. "pg_temp%"). A schema is extracted
+    if it matches any include_schemas pattern (or there are none) and no
+    exclude_schemas pattern; table patterns likewise select relations,
+    matching either their name or their "schema.name". Only relations of
+    the given relkinds are extracted, and with collapse_partitions,
+    partitions are left out in favor of their partitioned table.
+    """
+
+    include_schemas: t.Sequence[str] = ()
+    exclude_schemas: t.Sequence[str] = ()
+    include_tables: t.Sequence[str] = ()
+    exclude_tables: t.Sequence[str] = ()
+    relkinds: t.Sequence[str] = RELKINDS
+    collapse_partitions: bool = False
+
+
+def _filter_conditions(
+    schema_filter: SchemaFilter, schema: str, relation: str, relkind: str, is_partition: str
+) -> t.Tuple[str, t.List[t.Any], str, t.List[t.Any]]:
+    """Return SQL conditions on the schema and on the relation (each "AND ..." or empty) and their parameters.
+
+    The other arguments are the SQL expressions for a row's schema name,
+    relation name, relkind and whether it is a partition.
+    """
+    invalid = set(schema_filter.relkinds) - set(RELKINDS)
+    if invalid:
+        raise ValueError(f"Unsupported relkinds {sorted(invalid)}, expected some of {list(RELKINDS)}")
+
+    schema_sql, schema_params = "", []
+    if schema_filter.include_schemas:
+        schema_sql += f"\nAND {schema} LIKE ANY(%s::text[])"
+        schema_params.append(list(schema_filter.include_schemas))
+    if schema_filter.exclude_schemas:
+        schema_sql += f"\nAND NOT {schema} LIKE ANY(%s::text[])"
+        schema_params.append(list(schema_filter.exclude_schemas))
+
+    relation_sql, relation_params = "", []
+    matches = f"({relation} LIKE ANY(%s::text[]) OR ({schema} || '.' || {relation}) LIKE ANY(%s::text[]))"
+    if schema_filter.include_tables:
+        relation_sql += f"\nAND {matches}"
+        relation_params += [list(schema_filter.include_tables)] * 2
+    if schema_filter.exclude_tables:
+        relation_sql += f"\nAND NOT {matches}"
+        relation_params += [list(schema_filter.exclude_tables)] * 2
+    if set(schema_filter.relkinds) != set(RELKINDS):
+        relation_sql += f"\nAND {relkind}::text = ANY(%s::text[])"
+        relation_params.append(list(schema_filter.relkinds))
+    if schema_filter.collapse_partitions:
+        relation_sql += f"\nAND NOT {is_partition}"
+    return schema_sql, schema_params, relation_sql, relation_params
+
+
+def db_schema_sql(schema_filter: t.Optional[SchemaFilter] = None) -> t.Tuple[str, t.List[t.Any]]:
+    """Return GET_DB_SCHEMA_SQL with schema_filter applied, and its parameters after the database name."""
+    if schema_filter is None:
+        return GET_DB_SCHEMA_SQL, []
+    schema_sql, schema_params, relation_sql, relation_params = _filter_conditions(
+        schema_filter,
+        '"information_schema"."schemata"."schema_name"',
+        '"information_schema"."tables"."table_name"',
+        "c.relkind",
+        "c.relispartition",
+    )
+    # Relation conditions go in the relations' join, so that schemata left without relations are still extracted
+    sql = _DB_SCHEMA_SQL_TEMPLATE.format(
+        relation_conditions=relation_sql, conditions=_SYSTEM_SCHEMAS_CONDITION + schema_sql
+    )
+    return sql, relation_params + schema_params
+
+
+def schema_markers_sql(schema_filter: t.Optional[SchemaFilter] = None) -> t.Tuple[str, t.List[t.Any]]:
+    """Return GET_SCHEMA_MARKERS_SQL with schema_filter applied, and its parameters."""
+    if schema_filter is None:
+        return GET_SCHEMA_MARKERS_SQL, []
+    schema_sql, schema_params, relation_sql, relation_params = _filter_conditions(
+        schema_filter, "n.nspname", "c.relname", "c.relkind", "c.relispartition"
+    )
+    sql = _SCHEMA_MARKERS_SQL_TEMPLATE.format(schema_conditions=schema_sql, relation_conditions=relation_sql)
+    return sql, schema_params + schema_params + relation_params
+
 
 def _get_column_index(cur: psycopg2._psycopg.cursor, column_name: str) -> int:
     for i, column in enumerate(cur.description):
@@ -73,18 +230,35 @@ class InfoSchemaCache(t.TypedDict):
     schemata: t.List[Schema]
 
 
-def get_db_schema(cur: psycopg2._psycopg.cursor, db_name: str) -> InfoSchemaCache:
+def get_db_schema(
+    cur: psycopg2._psycopg.cursor,
+    db_name: str,
+    schema_filter: t.Optional[SchemaFilter] = None,
+) -> InfoSchemaCache:
     """Extract structured schema data from an existing Postgres database.
 
     cur is a cursor from an open psycopg2 connection to the target database.
+    If schema_filter is given, only the schemata and relations it selects
+    are queried.
+    """
+    sql, params = db_schema_sql(schema_filter)
+    with trace.span("schema_fetch", db_name=db_name) as fetch_span:
+        cur.execute(sql, (db_name, *params))
+        rows = cur.fetchall()
+        fetch_span.set(rows=len(rows))
+    return _build_db_schema(cur, rows)
+
+
+def _build_db_schema(cur: psycopg2._psycopg.cursor, rows: t.List[tuple]) -> InfoSchemaCache:
+    """Build an InfoSchemaCache from the rows of GET_DB_SCHEMA_SQL (or GET_RELATIONS_SQL) just run on cur.
+
+    A schema is foreign if all its extracted relations are foreign tables.
     """
     info_schema_dict: InfoSchemaCache = {
         "name": "",
         "description": None,
         "schemata": [],
     }
-    cur.execute(GET_DB_SCHEMA_SQL, (db_name,))
-
     db_idx = _get_column_index(cur, "name")
     db_description_idx = _get_column_index(cur, "description")
     table_type_idx = _get_column_index(cur, "schemata.tables.type")
@@ -94,7 +268,7 @@ def get_db_schema(cur: psycopg2._psycopg.cursor, db_name: str) -> InfoSchemaCach
     rel_idx = _get_column_index(cur, "schemata.tables.name")
 
     for i, (schema_name, schema_rows) in enumerate(
-        itertools.groupby(cur.fetchall(), key=lambda row: row[schema_idx])
+        itertools.groupby(rows, key=lambda row: row[schema_idx])
     ):
         schema: Schema = {
             "name": schema_name,
@@ -103,6 +277,7 @@ def get_db_schema(cur: psycopg2._psycopg.cursor, db_name: str) -> InfoSchemaCach
             "tables": [],
             "views": [],
         }
+        rel_types = set()
         for j, (rel_name, rel_rows) in enumerate(
             itertools.groupby(schema_rows, key=lambda row: row[rel_idx])
         ):
@@ -129,7 +304,173 @@ def get_db_schema(cur: psycopg2._psycopg.cursor, db_name: str) -> InfoSchemaCach
 
             if rel["name"] and table_type:
                 schema[table_type].append(rel)
+                rel_types.add(row[table_type_idx])
+
+        schema["is_foreign"] = rel_types == {"FOREIGN"}
 
         info_schema_dict["schemata"].append(schema)
 
     return info_schema_dict
+
+
+class RelationMarker(t.NamedTuple):
+    xmin: int
+    relfilenode: int
+    columns: int
+    digest: str
+    # The relation's relkind, None for a schema
+    kind: t.Optional[str] = None
+
+
+# Keyed by (schema name, relation name), with a relation name of None for the schema itself
+MarkerKey = t.Tuple[str, t.Optional[str]]
+SchemaMarkers = t.Dict[MarkerKey, RelationMarker]
+
+
+class SchemaSnapshot(t.NamedTuple):
+    schema: InfoSchemaCache
+    markers: SchemaMarkers
+    schema_filter: t.Optional[SchemaFilter] = None
+
+
+class SchemaChanges(t.NamedTuple):
+    # Added or modified schemata and relations
+    changed: t.List[MarkerKey]
+    dropped: t.List[MarkerKey]
+
+
+def get_schema_markers(
+    cur: psycopg2._psycopg.cursor,
+    schema_filter: t.Optional[SchemaFilter] = None,
+) -> SchemaMarkers:
+    """Fetch the change markers of every schema and relation in the database (that schema_filter selects)."""
+    sql, params = schema_markers_sql(schema_filter)
+    if params:
+        cur.execute(sql, params)
+    else:
+        cur.execute(sql)
+    return {(row[0], row[1]): RelationMarker(*row[2:]) for row in cur.fetchall()}
+
+
+def diff_schema_markers(old: SchemaMarkers, new: SchemaMarkers) -> SchemaChanges:
+    changed = [key for key, marker in new.items() if old.get(key) != marker]
+    dropped = [key for key in old if key not in new]
+    return SchemaChanges(changed, dropped)
+
+
+def get_db_schema_snapshot(
+    cur: psycopg2._psycopg.cursor,
+    db_name: str,
+    schema_filter: t.Optional[SchemaFilter] = None,
+) -> SchemaSnapshot:
+    """Extract the database's schema along with the markers refresh_db_schema needs.
+
+    Markers are fetched first, so DDL committed in between is picked up by
+    the next refresh rather than missed. Refreshes apply the same
+    schema_filter as the snapshot.
+    """
+    markers = get_schema_markers(cur, schema_filter)
+    return SchemaSnapshot(get_db_schema(cur, db_name, schema_filter), markers, schema_filter)
+
+
+def refresh_db_schema(
+    cur: psycopg2._psycopg.cursor,
+    snapshot: SchemaSnapshot,
+) -> t.Tuple[SchemaSnapshot, SchemaChanges]:
+    """Bring a snapshot up to date, re-querying only schemata and relations that changed.
+
+    The markers query reads the catalogs once; only changed relations are
+    then fetched with GET_RELATIONS_SQL and patched into a copy of the
+    snapshot's schema. The snapshot itself is not modified and unchanged
+    schemata and relations are shared with it, so readers of the old schema
+    are unaffected. When nothing changed the snapshot is returned as is.
+    """
+    db_name = snapshot.schema["name"]
+    with trace.span("schema_fetch", db_name=db_name, incremental=True) as fetch_span:
+        markers = get_schema_markers(cur, snapshot.schema_filter)
+        changes = diff_schema_markers(snapshot.markers, markers)
+        if not changes.changed and not changes.dropped:
+            fetch_span.set(rows=0)
+            return snapshot, changes
+
+        changed_schemata = [schema for schema, rel in changes.changed if rel is None]
+        changed_relations = [key for key in changes.changed if key[1] is not None]
+        descriptions: t.Dict[str, t.Optional[str]] = {}
+        if changed_schemata:
+            cur.execute(GET_SCHEMA_DESCRIPTIONS_SQL, (changed_schemata,))
+            descriptions = dict(cur.fetchall())
+        fetched: InfoSchemaCache = {"name": db_name, "description": snapshot.schema["description"], "schemata": []}
+        if changed_relations:
+            cur.execute(
+                GET_RELATIONS_SQL,
+                (db_name, [schema for schema, _ in changed_relations], [rel for _, rel in changed_relations]),
+            )
+            rows = cur.fetchall()
+            fetch_span.set(rows=len(rows))
+            if rows:
+                fetched = _build_db_schema(cur, rows)
+
+    schema = _patch_db_schema(snapshot.schema, fetched, changes, descriptions, _foreign_schemata(markers))
+    return SchemaSnapshot(schema, markers, snapshot.schema_filter), changes
+
+
+def _foreign_schemata(markers: SchemaMarkers) -> t.Set[str]:
+    """Return the schemata whose relations are all foreign tables, as _build_db_schema decides."""
+    kinds: t.Dict[str, t.Set[t.Optional[str]]] = {}
+    for (schema_name, rel_name), marker in markers.items():
+        if rel_name is not None:
+            kinds.setdefault(schema_name, set()).add(marker.kind)
+    return {schema_name for schema_name, schema_kinds in kinds.items() if schema_kinds == {"f"}}
+
+
+def _insert_sorted(items: t.List[t.Any], item: t.Any) -> None:
+    """Insert item into items, kept sorted by name."""
+    items.insert(bisect.bisect([i["name"] for i in items], item["name"]), item)
+
+
+def _patch_db_schema(
+    db_schema: InfoSchemaCache,
+    fetched: InfoSchemaCache,
+    changes: SchemaChanges,
+    descriptions: t.Dict[str, t.Optional[str]],
+    foreign: t.Set[str],
+) -> InfoSchemaCache:
+    """Return a copy of db_schema with changed relations replaced by those in fetched."""
+    dropped_schemata = {schema for schema, rel in changes.dropped if rel is None}
+    # Relations to take out: dropped ones, and changed ones (possibly now a different kind)
+    removed: t.Dict[str, t.Set[str]] = {}
+    for schema_name, rel_name in itertools.chain(changes.changed, changes.dropped):
+        if rel_name is not None:
+            removed.setdefault(schema_name, set()).add(rel_name)
+    fetched_schemata = {schema["name"]: schema for schema in fetched["schemata"]}
+
+    schemata: t.List[Schema] = []
+    for schema in db_schema["schemata"]:
+        name = schema["name"]
+        if name in dropped_schemata:
+            continue
+        if name not in removed and name not in descriptions and name not in fetched_schemata:
+            schemata.append(schema)
+            continue
+        patched: Schema = {**schema, "is_foreign": name in foreign}  # type: ignore[misc]
+        if name in descriptions:
+            patched["description"] = descriptions.pop(name)
+        for kind in ("tables", "views"):
+            patched[kind] = [rel for rel in schema[kind] if rel["name"] not in removed.get(name, ())]
+            for rel in fetched_schemata.get(name, {}).get(kind, []):
+                _insert_sorted(patched[kind], rel)
+        schemata.append(patched)
+
+    # Schemata created since the snapshot
+    for name, description in descriptions.items():
+        new_schema = fetched_schemata.get(name)
+        schema = {
+            "name": name,
+            "description": description,
+            "is_foreign": name in foreign,
+            "tables": new_schema["tables"] if new_schema else [],
+            "views": new_schema["views"] if new_schema else [],
+        }
+        _insert_sorted(schemata, schema)
+
+    return {**db_schema, "schemata": schemata}  # type: ignore[misc]
@@ -0,0 +1,235 @@
+"""Tracking of the schema objects that cached generated queries depend on.
+
+A cached query goes stale when a relation or column it uses changes, but
+flushing a whole cache on every DDL throws away entries the change could not
+affect. DependencyIndex maps the schema objects each cached entry uses to the
+entry, and checks them against a new schema to invalidate only the entries
+whose objects changed.
+
+Objects are found in the query's pglast AST: its relations (skipping CTEs),
+resolved against the schema (unqualified names in public first, then
+wherever they are unique), and its columns, resolved against those
+relations (or only the one a qualifier names). A * depends on every column.
+Each object is stored with a signature taken from the schema when the entry
+was added: the relation's kind, the column's type, or every column's name and
+type for a *. An entry is invalidated when any of its objects' signatures
+differ in a later schema, so objects are only checked (and only cost memory)
+while some cached entry uses them.
+"""
+
+import threading
+import typing as t
+
+if t.TYPE_CHECKING:
+    from pg_text_query.db_schema import InfoSchemaCache
+    from pg_text_query.schema_file import SchemaFile
+
+
+# (database, schema, relation, column), the column being None for the relation itself and "*" for all its columns
+SchemaObject = t.Tuple[str, str, str, t.Optional[str]]
+
+
+class _SchemaLookup:
+    """Finds relations in an InfoSchemaCache dict or a SchemaFile."""
+
+    def __init__(self, db_schema: t.Union["InfoSchemaCache", "SchemaFile"], database: t.Optional[str] = None) -> None:
+        self.db_schema = db_schema
+        self.is_dict = isinstance(db_schema, dict)
+        self.name = database or (db_schema["name"] if self.is_dict else db_schema.name)
+        self._relations: t.Dict[t.Tuple[str, str], t.Optional[t.Tuple[str, t.Dict[str, t.Any]]]] = {}
+        self._by_name: t.Optional[t.Dict[str, t.List[t.Tuple[str, str]]]] = None
+
+    def _index(self) -> None:
+        self._by_name = {}
+        for schema in self.db_schema["schemata"]:
+            for kind in ("tables", "views"):
+                for rel in schema[kind]:
+                    self._relations[schema["name"], rel["name"]] = (kind, rel)
+                    self._by_name.setdefault(rel["name"], []).append((schema["name"], rel["name"]))
+
+    def relation(self, schema: str, name: str) -> t.Optional[t.Tuple[str, t.Dict[str, t.Any]]]:
+        """Return (kind, relation) for schema.name, or None if there is no such relation."""
+        if self.is_dict:
+            if self._by_name is None:
+                self._index()
+            return self._relations.get((schema, name))
+        if (schema, name) not in self._relations:
+            self._relations[schema, name] = self.db_schema.relation(schema, name)
+        return self._relations[schema, name]
+
+    def resolve(self, schema: t.Optional[str], name: str) -> t.Tuple[str, str]:
+        """Return the (schema, relation) a possibly unqualified name refers to."""
+        if schema is not None or self.relation("public", name) is not None:
+            return schema or "public", name
+        if self.is_dict:
+            candidates = self._by_name.get(name, [])
+        else:
+            candidates = [
+                (match.schema, match.relation) for match in self.db_schema.find(name)
+                if match.column is None and match.relation == name
+            ]
+        return candidates[0] if len(candidates) == 1 else ("public", name)
+
+    def signature(self, obj: SchemaObject) -> t.Any:
+        found = self.relation(obj[1], obj[2])
+        if found is None:
+            return None
+        kind, rel = found
+        if obj[3] is None:
+            return kind
+        if obj[3] == "*":
+            return tuple((col["name"], col["data_type"]) for col in rel["columns"])
+        return next((col["data_type"] for col in rel["columns"] if col["name"] == obj[3]), None)
+
+
+def query_dependencies(
+    query: str, db_schema: t.Union["InfoSchemaCache", "SchemaFile"], database: t.Optional[str] = None
+) -> t.Dict[SchemaObject, t.Any]:
+    """Return the schema objects query uses, with their signatures in db_schema.
+
+    database names the objects' database, defaulting to db_schema's name.
+    Raises pglast.parser.ParseError if query cannot be parsed.
+    """
+    from pglast import ast, parse_sql
+    from pglast.visitors import Visitor
+
+    range_vars: t.List[ast.RangeVar] = []
+    column_refs: t.List[ast.ColumnRef] = []
+    ctes: t.Set[str] = set()
+
+    class _Collector(Visitor):
+        def visit_RangeVar(self, ancestors: t.Any, node: ast.RangeVar) -> None:
+            range_vars.append(node)
+
+        def visit_ColumnRef(self, ancestors: t.Any, node: ast.ColumnRef) -> None:
+            column_refs.append(node)
+
+        def visit_CommonTableExpr(self, ancestors: t.Any, node: ast.CommonTableExpr) -> None:
+            ctes.add(node.ctename)
+
+    _Collector()(parse_sql(query))
+
+    lookup = _SchemaLookup(db_schema, database)
+    objects: t.Set[SchemaObject] = set()
+    # Relations by the names they can be qualified with: alias, or name (and schema.name)
+    by_qualifier: t.Dict[t.Tuple[str, ...], t.List[t.Tuple[str, str]]] = {}
+    relations: t.List[t.Tuple[str, str]] = []
+    for range_var in range_vars:
+        if range_var.schemaname is None and range_var.relname in ctes:
+            continue
+        schema, name = lookup.resolve(range_var.schemaname, range_var.relname)
+        objects.add((lookup.name, schema, name, None))
+        relations.append((schema, name))
+        if range_var.alias is not None:
+            by_qualifier.setdefault((range_var.alias.aliasname,), []).append((schema, name))
+        else:
+            by_qualifier.setdefault((name,), []).append((schema, name))
+            by_qualifier.setdefault((schema, name), []).append((schema, name))
+
+    for column_ref in column_refs:
+        fields = column_ref.fields
+        column = "*" if isinstance(fields[-1], ast.A_Star) else fields[-1].sval
+        qualifier = tuple(field.sval for field in fields[-3:-1])
+        candidates = by_qualifier.get(qualifier, []) if qualifier else relations
+        for schema, name in candidates:
+            found = lookup.relation(schema, name)
+            if found is not None and (column == "*" or any(col["name"] == column for col in found[1]["columns"])):
+                objects.add((lookup.name, schema, name, column))
+
+    return {obj: lookup.signature(obj) for obj in objects}
+
+
+class DependencyIndex:
+    """A reverse index from schema objects to the cache entries using them."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # Each object's signature and the entries using it
+        self._objects: t.Dict[SchemaObject, t.Tuple[t.Any, t.Set[t.Hashable]]] = {}
+        self._entries: t.Dict[t.Hashable, t.FrozenSet[SchemaObject]] = {}
+        self._by_database: t.Dict[str, t.Set[SchemaObject]] = {}
+
+    def add(
+        self,
+        key: t.Hashable,
+        query: str,
+        db_schema: t.Union["InfoSchemaCache", "SchemaFile"],
+        database: t.Optional[str] = None,
+    ) -> None:
+        """Record that the entry key holds query, generated against db_schema.
+
+        database identifies db_schema's database, when its name alone may not
+        (e.g. same-named databases on different servers).
+        """
+        dependencies = query_dependencies(query, db_schema, database)
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = frozenset(dependencies)
+            for obj, signature in dependencies.items():
+                # An object already indexed keeps its older signature, so a change is still seen
+                _, keys = self._objects.setdefault(obj, (signature, set()))
+                keys.add(key)
+                self._by_database.setdefault(obj[0], set()).add(obj)
+
+    def discard(self, key: t.Hashable) -> None:
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key: t.Hashable) -> None:
+        for obj in self._entries.pop(key, ()):
+            _, keys = self._objects[obj]
+            keys.discard(key)
+            if not keys:
+                del self._objects[obj]
+                database_objects = self._by_database[obj[0]]
+                database_objects.discard(obj)
+                if not database_objects:
+                    del self._by_database[obj[0]]
+
+    def check(
+        self, db_schema: t.Union["InfoSchemaCache", "SchemaFile"], database: t.Optional[str] = None
+    ) -> t.Set[t.Hashable]:
+        """Remove and return the entries using objects that changed in db_schema."""
+        lookup = _SchemaLookup(db_schema, database)
+        with self._lock:
+            objects = list(self._by_database.get(lookup.name, ()))
+            signatures = [self._objects[obj][0] for obj in objects]
+        # Compare outside the lock: reading a large schema may take a while
+        changed = [obj for obj, signature in zip(objects, signatures) if lookup.signature(obj) != signature]
+        return self.invalidate(changed)
+
+    def invalidate(self, objects: t.Iterable[SchemaObject]) -> t.Set[t.Hashable]:
+        """Remove and return the entries using any of objects."""
+        with self._lock:
+            keys = set()
+            for obj in objects:
+                if obj in self._objects:
+                    keys.update(self._objects[obj][1])
+            for key in keys:
+                self._discard(key)
+        return keys
+
+    def invalidate_relations(
+        self, database: str, relations: t.Iterable[t.Tuple[str, t.Optional[str]]]
+    ) -> t.Set[t.Hashable]:
+        """Remove and return the entries using any column of the (schema, relation) pairs.
+
+        A relation of None stands for a whole schema, as in SchemaChanges.
+        """
+        relations = set(relations)
+        with self._lock:
+            objects = [
+                obj for obj in self._by_database.get(database, ())
+                if (obj[1], obj[2]) in relations or (obj[1], None) in relations
+            ]
+        return self.invalidate(objects)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def objects(self) -> int:
+        """The number of schema objects indexed."""
+        with self._lock:
+            return len(self._objects)
@@ -3,4 +3,12 @@ class EnvVarError(Exception):
 
 
 class QueryGenError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+class QueryExecError(Exception):
+    pass
+
+
+class QueryCostError(QueryExecError):
+    pass
@@ -0,0 +1,163 @@
+"""Helpers for safely executing generated queries against a Postgres db.
+
+Generated SQL has not been reviewed by anyone, so a request like "show me all
+orders" can easily ask the server to compute and ship an enormous result. The
+helpers here bound that work in two places: the query is rewritten to carry a
+LIMIT the planner can see, and rows are streamed through a server-side cursor
+in batches so the client never holds more than it asked for. Results can
+also be kept in a ResultCache (see result_cache.py) and served again until
+the tables they were read from change.
+"""
+
+import contextlib
+import typing as t
+import uuid
+
+from pglast import ast, enums
+from pglast.parser import parse_sql, ParseError
+from pglast.stream import RawStream
+
+from pg_text_query.errors import QueryExecError
+from pg_text_query.result_cache import ResultCache, row_bytes
+
+
+DEFAULT_MAX_ROWS = 1000
+DEFAULT_BATCH_SIZE = 100
+
+
+def _limit_const(max_rows: int) -> ast.A_Const:
+    return ast.A_Const(isnull=False, val=ast.Integer(max_rows))
+
+
+def _wrap_with_limit(select: ast.SelectStmt, max_rows: int) -> str:
+    return f"SELECT * FROM ({RawStream()(select)}) AS limited LIMIT {max_rows}"
+
+
+def limit_query(query: str, max_rows: int = DEFAULT_MAX_ROWS) -> str:
+    """Rewrite a single SELECT statement so it returns at most max_rows rows.
+
+    A LIMIT is added when the statement has none (alongside any existing ORDER
+    BY, so the first max_rows rows are still the "top" rows), and a constant
+    LIMIT larger than max_rows is tightened. Limits that cannot be safely
+    tightened in place (non-constant expressions or FETCH ... WITH TIES) are
+    preserved by wrapping the statement in an outer, limited SELECT.
+
+    Statements other than SELECT are returned unchanged. Raises QueryExecError
+    if the query is not exactly one parseable statement.
+    """
+    if max_rows < 0:
+        raise ValueError("max_rows must be non-negative")
+    try:
+        stmts = parse_sql(query)
+    except ParseError as e:
+        raise QueryExecError(f"Query could not be parsed: {e}") from e
+    if len(stmts) != 1:
+        raise QueryExecError(f"Expected exactly one statement, found {len(stmts)}")
+
+    select = stmts[0].stmt
+    if not isinstance(select, ast.SelectStmt) or select.intoClause is not None:
+        return query
+
+    limit = select.limitCount
+    if limit is None:
+        select.limitCount = _limit_const(max_rows)
+        select.limitOption = enums.LimitOption.LIMIT_OPTION_COUNT
+    elif select.limitOption == enums.LimitOption.LIMIT_OPTION_WITH_TIES:
+        return _wrap_with_limit(select, max_rows)
+    elif isinstance(limit, ast.A_Const) and limit.isnull:
+        # LIMIT ALL / LIMIT NULL
+        select.limitCount = _limit_const(max_rows)
+    elif isinstance(limit, ast.A_Const) and isinstance(limit.val, ast.Integer):
+        if limit.val.ival <= max_rows:
+            return query
+        select.limitCount = _limit_const(max_rows)
+    else:
+        return _wrap_with_limit(select, max_rows)
+
+    return RawStream()(select)
+
+
+@contextlib.contextmanager
+def pooled_cursor(pool: t.Any) -> t.Iterator[t.Any]:
+    """Borrow a connection from pool and yield a cursor on it.
+
+    pool may be a psycopg2.pool connection pool or a psycopg_pool
+    ConnectionPool (as created by the playground's db_connect module); both
+    expose getconn/putconn. The transaction is rolled back before the
+    connection is returned, so nothing done through the cursor persists.
+    """
+    conn = pool.getconn()
+    try:
+        cur = conn.cursor()
+        try:
+            yield cur
+        finally:
+            cur.close()
+    finally:
+        conn.rollback()
+        pool.putconn(conn)
+
+
+def iter_query_rows(
+    conn: t.Any,
+    query: str,
+    max_rows: int = DEFAULT_MAX_ROWS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    cache: t.Optional[ResultCache] = None,
+) -> t.Iterator[t.Tuple[t.Any, ...]]:
+    """Execute a generated query and stream up to max_rows result rows.
+
+    conn is an open psycopg2 (or psycopg 3) connection. The query is first
+    passed through limit_query, then fetched through a server-side (named)
+    cursor batch_size rows at a time, so at most one batch is held client-side.
+    Iteration stops as soon as max_rows rows have been yielded, and closing the
+    generator early (e.g. breaking out of a loop) closes the server-side cursor.
+
+    Named cursors are only valid inside a transaction; on an autocommit
+    connection the cursor is declared WITH HOLD instead.
+
+    If cache is given, rows it holds for the (limited) query at the current
+    data version are yielded instead, and a result read to the end is stored
+    in it while it stays within the cache's max_result_bytes.
+    """
+    if batch_size <= 0:
+        raise ValueError("batch_size must be positive")
+    limited_query = limit_query(query, max_rows)
+
+    cached = None
+    if cache is not None:
+        with conn.cursor() as version_cur:
+            cached = cache.key(version_cur, limited_query)
+    if cached is not None:
+        rows = cache.lookup(*cached)
+        if rows is not None:
+            yield from rows
+            return
+    # Rows read so far, while they may still fit in the cache
+    result: t.Optional[t.List[t.Any]] = [] if cached is not None else None
+    result_bytes = 0
+
+    cur = conn.cursor(
+        name=f"pgtq_{uuid.uuid4().hex}",
+        withhold=bool(getattr(conn, "autocommit", False)),
+    )
+    try:
+        cur.itersize = batch_size
+        cur.execute(limited_query)
+        fetched = 0
+        while fetched < max_rows:
+            rows = cur.fetchmany(min(batch_size, max_rows - fetched))
+            if not rows:
+                break
+            if result is not None:
+                result.extend(rows)
+                result_bytes += sum(row_bytes(row) for row in rows)
+                if result_bytes > cache.max_result_bytes:
+                    result = None
+            for row in rows:
+                yield row
+            fetched += len(rows)
+        if result is not None:
+            cache.store(*cached, result, result_bytes)
+    finally:
+        cur.close()
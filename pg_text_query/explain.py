@@ -0,0 +1,111 @@
+"""Planner-based cost pre-checks for generated queries.
+
+Before running model output, EXPLAIN (without ANALYZE) asks the planner what a
+query would cost without executing it. Plans whose estimated cost or row count
+exceed configured thresholds can then be rejected or flagged before an
+expensive sequential scan on a huge table ever starts.
+"""
+
+import json
+import typing as t
+
+from pglast.parser import parse_sql, ParseError
+
+from pg_text_query.errors import QueryCostError, QueryExecError
+from pg_text_query.execute import pooled_cursor
+from pg_text_query.gen_query import generate_query
+
+
+class PlanEstimate(t.TypedDict):
+    node_type: str
+    startup_cost: float
+    total_cost: float
+    plan_rows: int
+    plan_width: int
+
+
+class CostCheck(t.TypedDict):
+    plan: PlanEstimate
+    exceeds_limits: bool
+    reasons: t.List[str]
+
+
+class ExplainedQuery(CostCheck):
+    query: str
+
+
+def explain_query(cur: t.Any, query: str) -> PlanEstimate:
+    """Return the planner's top-level estimates for query without running it.
+
+    The query must be exactly one statement: EXPLAIN is prepended as text, so
+    a trailing second statement would otherwise be executed for real.
+    """
+    try:
+        stmts = parse_sql(query)
+    except ParseError as e:
+        raise QueryExecError(f"Query could not be parsed: {e}") from e
+    if len(stmts) != 1:
+        raise QueryExecError(f"Expected exactly one statement, found {len(stmts)}")
+
+    cur.execute(f"EXPLAIN (FORMAT JSON) {query}")
+    result = cur.fetchone()[0]
+    # psycopg2 decodes json columns itself; other drivers may return text
+    if isinstance(result, str):
+        result = json.loads(result)
+    plan = result[0]["Plan"]
+
+    return {
+        "node_type": plan["Node Type"],
+        "startup_cost": plan["Startup Cost"],
+        "total_cost": plan["Total Cost"],
+        "plan_rows": plan["Plan Rows"],
+        "plan_width": plan["Plan Width"],
+    }
+
+
+def check_query_cost(
+    cur: t.Any,
+    query: str,
+    max_cost: t.Optional[float] = None,
+    max_rows: t.Optional[int] = None,
+    raise_on_exceed: bool = True,
+) -> CostCheck:
+    """EXPLAIN query and compare its estimates against the given thresholds.
+
+    If raise_on_exceed is True, raises QueryCostError when the estimated total
+    cost exceeds max_cost or the estimated row count exceeds max_rows.
+    Otherwise the plan is returned flagged with exceeds_limits and the reasons.
+    A threshold of None is not checked.
+    """
+    plan = explain_query(cur, query)
+
+    reasons = []
+    if max_cost is not None and plan["total_cost"] > max_cost:
+        reasons.append(f"estimated cost {plan['total_cost']} exceeds {max_cost}")
+    if max_rows is not None and plan["plan_rows"] > max_rows:
+        reasons.append(f"estimated rows {plan['plan_rows']} exceeds {max_rows}")
+
+    if reasons and raise_on_exceed:
+        raise QueryCostError("Query plan rejected: " + "; ".join(reasons))
+
+    return {"plan": plan, "exceeds_limits": bool(reasons), "reasons": reasons}
+
+
+def generate_explained_query(
+    prompt: str,
+    pool: t.Any,
+    max_cost: t.Optional[float] = None,
+    max_rows: t.Optional[int] = None,
+    raise_on_exceed: bool = True,
+    **kwargs: t.Any,
+) -> ExplainedQuery:
+    """Generate a query from prompt and return it with its planner estimates.
+
+    The generated query is validated (see generate_query) and then checked
+    with check_query_cost on a connection borrowed from pool. Any kwargs are
+    passed through to generate_query.
+    """
+    query = generate_query(prompt, validate_sql=True, **kwargs)
+    with pooled_cursor(pool) as cur:
+        check = check_query_cost(cur, query, max_cost, max_rows, raise_on_exceed)
+    return {"query": query, **check}
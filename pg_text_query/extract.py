@@ -0,0 +1,142 @@
+"""Extracts a SQL statement from free-form model output.
+
+Chat models frequently wrap SQL in markdown code fences, introduce it with a
+sentence, or follow it with an explanation, none of which parse as SQL. Rather
+than failing validation and paying for another generation, extract_query picks
+out the SQL statement and returns its parse alongside it, so that
+validation does not need to parse it again.
+"""
+
+import re
+import typing as t
+
+from pglast.ast import Node
+from pglast.parser import parse_sql, ParseError
+
+
+_FENCE_RE = re.compile(r"```[ \t]*([\w+-]*)[^\n]*\n(.*?)(?:```|\Z)", re.DOTALL)
+_SQL_FENCE_LANGUAGES = {"sql", "pgsql", "postgres", "postgresql", "psql", "plpgsql"}
+# Keywords that can start a statement the model was asked for: in upper case
+# anywhere, or in any case at the start of a line (lower-case ones mid-line are
+# usually prose, e.g. "the table penguins")
+_STATEMENT_KEYWORDS = "SELECT|WITH|VALUES|TABLE|INSERT|UPDATE|DELETE|CREATE|ALTER|DROP|EXPLAIN"
+_STATEMENT_START_RE = re.compile(
+    rf"(?m:^[ \t]*)(?i:(?:{_STATEMENT_KEYWORDS}))\b|\b(?:{_STATEMENT_KEYWORDS})\b"
+)
+# A response beginning with a statement, possibly inside a code fence
+_LEADING_STATEMENT_RE = re.compile(rf"\s*(?:```[^\n]*\n\s*)?(?P<keyword>(?i:{_STATEMENT_KEYWORDS}))\b")
+
+
+class ExtractedQuery(t.NamedTuple):
+    # The extracted statement (or the stripped input, if none was found)
+    query: str
+    # The statement's parse tree, or None if no statement was found
+    statement: t.Optional[Node]
+
+
+def _first_statement(text: str) -> t.Optional[t.Tuple[str, Node]]:
+    """Parse text and return its first statement, if it parses to any."""
+    try:
+        raw_stmts = parse_sql(text)
+    except ParseError:
+        return None
+    if not raw_stmts:
+        return None
+    raw = raw_stmts[0]
+    end = raw.stmt_location + raw.stmt_len if raw.stmt_len else len(text)
+    return text[raw.stmt_location:end].strip(), raw.stmt
+
+
+def _statement_at(rest: str) -> t.Optional[t.Tuple[str, Node]]:
+    """Parse the statement rest starts with, dropping any trailing commentary."""
+    # Prefer an explicit terminator, which also drops trailing commentary
+    pos = rest.find(";")
+    while pos != -1:
+        found = _first_statement(rest[: pos + 1])
+        if found:
+            return found
+        pos = rest.find(";", pos + 1)
+    # Otherwise drop trailing lines (commentary) until the rest parses
+    lines = rest.splitlines()
+    for end in range(len(lines), 0, -1):
+        found = _first_statement("\n".join(lines[:end]))
+        if found:
+            return found
+    return None
+
+
+def _find_statement(text: str) -> t.Optional[t.Tuple[str, Node]]:
+    """Find the longest parseable statement in text that may contain prose.
+
+    A keyword in prose can start a short statement that parses by accident
+    (e.g. "TABLE penguins"), so a later candidate is preferred if it parses
+    as a longer statement; of equally long ones, the first is taken.
+    """
+    found = _first_statement(text)
+    if found:
+        return found
+
+    best = None
+    for match in _STATEMENT_START_RE.finditer(text):
+        found = _statement_at(text[match.start():])
+        if found and (best is None or len(found[0]) > len(best[0])):
+            best = found
+    return best
+
+
+def statement_start(text: str) -> t.Optional[int]:
+    """Return where the statement begins in a response that begins with one.
+
+    The statement may follow whitespace and an opening code fence line.
+    Returns None if text does not (or, for a partial response, does not yet)
+    begin with a statement keyword, e.g. if it begins with prose.
+    """
+    match = _LEADING_STATEMENT_RE.match(text)
+    return match.start("keyword") if match else None
+
+
+def find_terminated_statement(text: str) -> t.Optional[t.Tuple[int, int]]:
+    """Return the span of the first ";"-terminated statement in text that may contain prose.
+
+    Candidates start at statement keywords, as for extract_query; None is
+    returned if none is followed by a complete statement yet.
+    """
+    from pg_text_query.gen_query import find_statement_end
+
+    for match in _STATEMENT_START_RE.finditer(text):
+        start = match.end() - len(match.group().lstrip())
+        end = find_statement_end(text[start:])
+        if end is not None:
+            return start, start + end
+    return None
+
+
+def _candidates(text: str) -> t.Iterator[str]:
+    fences = [(m.group(1).lower(), m.group(2)) for m in _FENCE_RE.finditer(text)]
+    for language, body in fences:
+        if language in _SQL_FENCE_LANGUAGES:
+            yield body
+    for language, body in fences:
+        if language not in _SQL_FENCE_LANGUAGES:
+            yield body
+    yield _FENCE_RE.sub(lambda m: m.group(2), text) if fences else text
+
+
+def extract_query(text: str) -> ExtractedQuery:
+    """Extract the first parseable SQL statement from model output.
+
+    Code fences labelled as SQL are searched first, then other fences, then
+    the text as a whole. Within each, prose before the statement and any
+    trailing commentary (after a ";" terminator, or on the lines following an
+    unterminated statement) are dropped; if several statements are found in
+    prose, the longest is taken. A response that is already plain SQL yields
+    its first statement unchanged.
+
+    If no statement is found, the stripped text is returned with a None
+    statement, which is_valid_query-style checks treat as invalid.
+    """
+    for candidate in _candidates(text):
+        found = _find_statement(candidate)
+        if found:
+            return ExtractedQuery(*found)
+    return ExtractedQuery(text.strip(), None)
@@ -1,163 +1,400 @@
-"""A trivial wrapper of openai.Completion.create (for now).
+"""Generates Postgres queries from prompts with OpenAI or local models.
 
 Handles initialization of a default request config with optional override by
-config file and/or arbitrary kwargs to generate_query.py.
+config file and/or arbitrary kwargs to generate_query.py. Models are run by a
+backend (see pg_text_query.backends); OpenAI requests are sent through a
+transport (see pg_text_query.transport), which QueryGenerator owns for its
+lifetime, while the module-level functions use the package-wide default.
 """
 
-import os
+import contextvars
+import threading
 import typing as t
+import weakref
 
-import openai
-import yaml
-from pglast.parser import parse_sql, ParseError
-
-from pg_text_query.errors import EnvVarError, QueryGenError
-
-
-# Initialize default OpenAI completion config w/ optional user config file path
-# from env var PGTQ_OPENAI_CONFIG
-PGTQ_OPENAI_CONFIG = os.getenv(
-    "PGTQ_OPENAI_CONFIG",
-    os.path.join(os.path.dirname(__file__), "default_openai_config.yaml"),
+from pg_text_query import trace
+from pg_text_query.backends import (
+    DEFAULT_SYSTEM_PROMPT, Backend, Completion, LlamaCppBackend, Message, OpenAIChatBackend,
+    OpenAICompletionBackend
 )
-with open(PGTQ_OPENAI_CONFIG, "rb") as f:
-    DEFAULT_COMPLETION_CONFIG = yaml.safe_load(f)["completion_create"]
+from pg_text_query.config import Config, get_config
+from pg_text_query.errors import QueryGenError
+from pg_text_query.singleflight import AsyncSingleFlight, SingleFlight
+from pg_text_query.transport import OpenAITransport, Transport, get_transport
+
+
+# Completion configs are loaded lazily by pg_text_query.config; these names
+# remain importable from this module for backwards compatibility.
+_LAZY_CONFIG_ATTRS = {
+    "DEFAULT_COMPLETION_CONFIG": lambda: get_config().completion,
+    "CHAT_COMPLETION_CONFIG": lambda: get_config().chat,
+    "PGTQ_OPENAI_CONFIG": lambda: get_config().completion_config_path,
+    "CHAT_OPENAI_CONFIG": lambda: get_config().chat_config_path,
+}
+
+
+def __getattr__(name: str) -> t.Any:
+    if name in _LAZY_CONFIG_ATTRS:
+        return _LAZY_CONFIG_ATTRS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class QueryGenerator:
+    """Generates raw Postgres query strings from prompts.
+
+    Generation runs on a backend (see pg_text_query.backends); validation and
+    SQL extraction are shared by all backends. The default backend is an OpenAI
+    completion model, and completion_type="single" or "chat" selects an OpenAI
+    completion or chat model per call regardless of the generator's backend.
+
+    A QueryGenerator sends its OpenAI requests through one transport for its
+    whole lifetime, so an OpenAITransport's pooled keep-alive connections are
+    reused across calls. It keeps no per-call state and can be shared between
+    threads.
+
+    With coalesce (the default), concurrent identical requests (the same
+    backend, final prompt and merged config) share one in-flight call, whose
+    result or error every caller receives; see pg_text_query.singleflight.
+    Its token usage is recorded on the request span of the caller that made
+    it only, the others being marked by a "coalesced" event, so summing
+    usage across traces counts the tokens actually spent.
+
+    If transport or config is None, the package-wide default (see
+    pg_text_query.transport.set_transport and pg_text_query.config) is used.
+    """
 
-CHAT_OPENAI_CONFIG = os.getenv(
-    "CHAT_OPENAI_CONFIG",
-    os.path.join(os.path.dirname(__file__), "openai_chat_config.yaml"),
-    )
+    def __init__(
+        self,
+        transport: t.Optional[Transport] = None,
+        config: t.Optional[Config] = None,
+        backend: t.Optional[Backend] = None,
+        coalesce: bool = True,
+    ) -> None:
+        self._transport = transport
+        self._config = config
+        self._backend = backend
+        self.coalesce = coalesce
+        self._flight = SingleFlight()
+        # One AsyncSingleFlight per event loop the generator is used from
+        self._async_flights: "weakref.WeakKeyDictionary[t.Any, AsyncSingleFlight]" = weakref.WeakKeyDictionary()
+        self._async_flights_lock = threading.Lock()
+
+    @classmethod
+    def from_openai(
+        cls,
+        api_key: t.Optional[str] = None,
+        config: t.Optional[Config] = None,
+        **transport_kwargs: t.Any,
+    ) -> "QueryGenerator":
+        """Create a generator with its own OpenAITransport.
+
+        transport_kwargs (e.g. timeout, pool_maxsize) are passed through to
+        OpenAITransport.
+        """
+        return cls(OpenAITransport(api_key=api_key, **transport_kwargs), config)
+
+    @classmethod
+    def from_local(
+        cls,
+        model_path: str,
+        params: t.Optional[t.Dict[str, t.Any]] = None,
+        **load_kwargs: t.Any,
+    ) -> "QueryGenerator":
+        """Create a generator running a local GGUF model (see LlamaCppBackend)."""
+        return cls(backend=LlamaCppBackend(model_path, params, **load_kwargs))
+
+    @property
+    def transport(self) -> Transport:
+        return self._transport if self._transport is not None else get_transport()
+
+    @property
+    def config(self) -> Config:
+        return self._config if self._config is not None else get_config()
+
+    def backend(self, completion_type: t.Optional[str] = None) -> Backend:
+        """Return the backend for a completion type.
+
+        None selects the generator's own backend, "single" and "chat" an
+        OpenAI completion or chat model using the generator's transport.
+        """
+        if completion_type is None:
+            if self._backend is not None:
+                return self._backend
+            completion_type = "single"
+        if completion_type == "single":
+            return OpenAICompletionBackend(self.transport, self.config)
+        elif completion_type == "chat":
+            return OpenAIChatBackend(self.transport, self.config)
+        raise ValueError("Must specify 'single' or 'chat' completion type")
 
-with open(CHAT_OPENAI_CONFIG, "rb") as f:
-    CHAT_COMPLETION_CONFIG = yaml.safe_load(f)["completion_create"]
+    def generate(self, prompt: str, validate_sql: bool = False,
+                 completion_type: t.Optional[str] = None,
+                 history: t.Sequence[Message] = (), **kwargs: t.Any) -> str:
+        """Generate a raw Postgres query string from a prompt.
+
+        If validate_sql is True, raises QueryGenError when the backend returns
+        a completion that fails validation using the Postgres parser. This
+        ensures a non-empty and syntactically valid query but NOT necessarily
+        a correct one.
+
+        The request is built by the backend selected by completion_type (see
+        backend) from its default config, with any provided kwargs serving as
+        parameter overrides. A task_prompt kwarg of the form {"system": ...}
+        sets the system message for backends that take one, and history holds
+        earlier messages of a conversation (see ChatSession). For chat and
+        local models, the first SQL statement is extracted from the response
+        (see extract_query) and validated from that same parse.
+        """
+        backend = self.backend(completion_type)
+        with trace.span("generate", backend=backend.name):
+            request = self._build_request(backend, prompt, history, kwargs)
+            with trace.span("request", backend=backend.name) as request_span:
+                completion, made = self._complete(backend, request)
+                if made:
+                    request_span.set(**(completion["usage"] or {}))
+            return self._validate(backend, completion["text"], validate_sql)
+
+    async def agenerate(self, prompt: str, validate_sql: bool = False,
+                        completion_type: t.Optional[str] = None,
+                        history: t.Sequence[Message] = (), **kwargs: t.Any) -> str:
+        """Generate a raw Postgres query string from a prompt, for asyncio.
+
+        See generate. The backend call runs in the event loop's default
+        executor, so the loop is not blocked while waiting for the model.
+        """
+        import asyncio
+
+        backend = self.backend(completion_type)
+        with trace.span("generate", backend=backend.name):
+            request = self._build_request(backend, prompt, history, kwargs)
+            with trace.span("request", backend=backend.name) as request_span:
+                loop = asyncio.get_running_loop()
+                leader = []
+
+                def call() -> "asyncio.Future[t.Tuple[Completion, bool]]":
+                    leader.append(True)
+                    # Executor threads do not inherit context (tracers, rate limit tenant)
+                    return loop.run_in_executor(None, contextvars.copy_context().run, self._complete, backend, request)
+
+                if self.coalesce:
+                    completion, made = await self._async_flight(loop).do(backend.request_key(request), call)
+                else:
+                    completion, made = await call()
+                if made and leader:
+                    request_span.set(**(completion["usage"] or {}))
+            return self._validate(backend, completion["text"], validate_sql)
+
+    @staticmethod
+    def _build_request(backend: Backend, prompt: str, history: t.Sequence[Message],
+                       kwargs: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+        system = (kwargs.pop("task_prompt", None) or {}).get("system")
+        return backend.build_request(prompt, system, history, **kwargs)
+
+    def _complete(self, backend: Backend, request: t.Dict[str, t.Any]) -> t.Tuple[Completion, bool]:
+        """Return the completion of request, and whether this call made it.
+
+        The call does not make it if it shares a concurrent identical call.
+        """
+        if not self.coalesce:
+            return backend.complete(request), True
+        made = []
+
+        def complete() -> Completion:
+            made.append(True)
+            return backend.complete(request)
+
+        return self._flight.do(backend.request_key(request), complete), bool(made)
+
+    def _async_flight(self, loop: t.Any) -> AsyncSingleFlight:
+        with self._async_flights_lock:
+            if loop not in self._async_flights:
+                self._async_flights[loop] = AsyncSingleFlight()
+            return self._async_flights[loop]
+
+    @staticmethod
+    def _validate(backend: Backend, generated_query: str, validate_sql: bool) -> str:
+        with trace.span("validation") as validation_span:
+            if backend.extract_sql:
+                from pg_text_query.extract import extract_query
+
+                # Chat models often add markdown fences or prose around the SQL
+                generated_query, statement = extract_query(generated_query)
+                valid = statement is not None
+            elif validate_sql:
+                valid = is_valid_query(generated_query)
+
+            if validate_sql:
+                validation_span.set(valid=bool(valid))
+                if not valid:
+                    raise QueryGenError("Generated query is empty, only a comment, or invalid.")
+
+        return generated_query
+
+    def generate_chat(self, prompt: str, validate_sql: bool = False,
+                      system: t.Optional[str] = None, **kwargs: t.Any) -> str:
+        """Generate a raw Postgres query string from a prompt using ChatGPT.
+
+        See generate; the request is a system message (system, or a default
+        text-to-SQL instruction) followed by prompt as the user message.
+        """
+        return self.generate(prompt, validate_sql, "chat", task_prompt={"system": system}, **kwargs)
+
+    def stream(self, prompt: str, completion_type: t.Optional[str] = None,
+               system: t.Optional[str] = None, stop_at_statement: bool = True,
+               **kwargs: t.Any) -> t.Iterator[str]:
+        """Stream a generated query as pieces of text, as they arrive.
+
+        With stop_at_statement (the default), the text so far is checked for a
+        complete statement every time a ";" arrives, and the stream is cut as
+        soon as one parses: the last piece yielded ends with its terminator,
+        and the underlying request is closed. This enforces the ";" stop
+        sequence for chat models, which ignore it. When the iterator is
+        exhausted, the concatenated pieces are the complete query, ready for
+        validation or EXPLAIN.
+
+        Chat and local models may wrap the statement in a code fence or lead
+        into it with prose; only the statement is yielded. A fenced statement
+        (or one the response begins with) is streamed as it arrives and also
+        ends at a closing fence, while one following prose is yielded whole
+        once its terminator arrives, or, if none does, as extract_query finds
+        it when the response ends.
+
+        Completion models stop at ";" themselves, so their streams simply end
+        without a terminator. Without stop_at_statement, the response is
+        streamed as is.
+        """
+        from pg_text_query.extract import extract_query, find_terminated_statement, statement_start
+
+        backend = self.backend(completion_type)
+        pieces = backend.stream(backend.build_request(prompt, system, **kwargs))
+        try:
+            if not stop_at_statement:
+                yield from pieces
+                return
+            text = ""
+            # Where the statement begins in text, once known
+            start = None if backend.extract_sql else 0
+            fenced = False
+            # text[start:sent] has been yielded and text[:checked] checked for a terminator
+            sent = checked = 0
+            for piece in pieces:
+                text += piece
+                if start is None:
+                    start = statement_start(text)
+                    if start is None:
+                        # Prose so far: wait for a terminated statement within it
+                        if ";" in piece:
+                            found = find_terminated_statement(text)
+                            if found is not None:
+                                yield text[found[0]:found[1]]
+                                return
+                        continue
+                    fenced = "```" in text[:start]
+                    sent = checked = start
+                end = find_statement_end(text[start:], checked - start)
+                checked = len(text)
+                if end is not None:
+                    cut = start + end
+                elif fenced and text.find("```", start) != -1:
+                    cut = start + len(text[start:text.find("```", start)].rstrip())
+                else:
+                    # Hold back what may lead up to a closing fence
+                    upto = len(text.rstrip("` \t\n")) if fenced else len(text)
+                    if upto > sent:
+                        yield text[sent:upto]
+                        sent = upto
+                    continue
+                if cut > sent:
+                    yield text[sent:cut]
+                return
+            if start is None:
+                query = extract_query(text).query
+                if query:
+                    yield query
+        finally:
+            close = getattr(pieces, "close", None)
+            if close is not None:
+                close()
+
+    def close(self) -> None:
+        """Close the generator's own transport and backend (not shared defaults)."""
+        if self._transport is not None:
+            self._transport.close()
+        if self._backend is not None:
+            self._backend.close()
+
+    def __enter__(self) -> "QueryGenerator":
+        return self
+
+    def __exit__(self, *exc_info: t.Any) -> None:
+        self.close()
+
+
+# Module-level functions use a generator bound to the package-wide defaults
+_default_generator = QueryGenerator()
 
 
 def generate_query(prompt: str, validate_sql: bool = False,
                    completion_type: str = "single", **kwargs: t.Any) -> str:
     """Generate a raw Postgres query string from a prompt.
 
-    If validate_sql is True, raises QueryGenError when OpenAI returns a 
-    completion that fails validation using the Postgres parser. This ensures a
-    non-empty and syntactically valid query but NOT necessarily a correct one.
-    
-    Completion.create is called with default config from PGTQ_OPENAI_CONFIG
-    with any provided kwargs serving as parameter overrides. 
-
-    TODO: Later, add error handling.
+    See QueryGenerator.generate. Uses the default transport and config.
     """
-    # 
-    if getattr(openai, "api_key") is None:
-        # Initialize OpenAI API Key
-        openai.api_key = os.getenv("OPENAI_API_KEY")
-        if openai.api_key is None:
-            raise EnvVarError("OPENAI_API_KEY not found in environment")
-
-    if completion_type=="single":
-        response = openai.Completion.create(
-            prompt=prompt,
-            **{**DEFAULT_COMPLETION_CONFIG, **kwargs},
-        )
-
-        generated_query = response["choices"][0]["text"]
-        
-    elif completion_type=="chat":
-        system = kwargs.get("task_prompt", {}).get("system", None)
-        if not system:
-            system = "you are a text-to-SQL translator. You write PostgreSQL code based on plain-language prompts."
-
-        query = [{"role":"system", "content": system}, {"role":"user", "content": prompt}]
-
-        response = openai.ChatCompletion.create(
-            messages=query,
-            **{**CHAT_COMPLETION_CONFIG, **kwargs},
-        )
-
-        generated_query = response["choices"][0]["message"]["content"]
-    else:
-        raise ValueError("Must specify 'single' or 'chat' completion type")
-
-    if validate_sql:
-        if not is_valid_query(generated_query):
-            raise QueryGenError("Generated query is empty, only a comment, or invalid.")
-    
-    return generated_query
+    return _default_generator.generate(prompt, validate_sql, completion_type, **kwargs)
 
 
-def generate_query_chat(prompt: str, validate_sql: bool = False, system: t.Optional[str] = None, **kwargs: t.Any) -> str:
-    """Generate a raw Postgres query string from a prompt using ChatGTP.
-
-    If validate_sql is True, raises QueryGenError when OpenAI returns a 
-    completion that fails validation using the Postgres parser. This ensures a
-    non-empty and syntactically valid query but NOT necessarily a correct one.
-    
-    Completion.create is called with default config from PGTQ_OPENAI_CONFIG
-    with any provided kwargs serving as parameter overrides. 
+async def agenerate_query(prompt: str, validate_sql: bool = False,
+                          completion_type: str = "single", **kwargs: t.Any) -> str:
+    """Generate a raw Postgres query string from a prompt, for asyncio.
 
-    TODO: Later, add error handling.
+    See QueryGenerator.agenerate. Uses the default transport and config.
     """
-    # 
-    if getattr(openai, "api_key") is None:
-        # Initialize OpenAI API Key
-        openai.api_key = os.getenv("OPENAI_API_KEY")
-        if openai.api_key is None:
-            raise EnvVarError("OPENAI_API_KEY not found in environment")
-
-    if not system:
-        system = "you are a text-to-SQL translator. You write PostgreSQL code based on plain-language prompts."
-
-    query = [{"role":"system", "content": system}, {"role":"user", "content": prompt}]
-
-    response = openai.ChatCompletion.create(
-        messages=query,
-        **{**CHAT_COMPLETION_CONFIG, **kwargs},
-    )
-    generated_query = response["choices"][0]["message"]["content"]
-
-
-    if validate_sql:
-        if not is_valid_query(generated_query):
-            raise QueryGenError("Generated query is empty, only a comment, or invalid.")
-    
-    return generated_query
+    return await _default_generator.agenerate(prompt, validate_sql, completion_type, **kwargs)
 
 
 def generate_query_chat(prompt: str, validate_sql: bool = False, system: t.Optional[str] = None, **kwargs: t.Any) -> str:
-    """Generate a raw Postgres query string from a prompt using ChatGTP.
+    """Generate a raw Postgres query string from a prompt using ChatGPT.
 
-    If validate_sql is True, raises QueryGenError when OpenAI returns a 
-    completion that fails validation using the Postgres parser. This ensures a
-    non-empty and syntactically valid query but NOT necessarily a correct one.
-    
-    Completion.create is called with default config from PGTQ_OPENAI_CONFIG
-    with any provided kwargs serving as parameter overrides. 
-
-    TODO: Later, add error handling.
+    See QueryGenerator.generate_chat. Uses the default transport and config.
     """
-    # 
-    if getattr(openai, "api_key") is None:
-        # Initialize OpenAI API Key
-        openai.api_key = os.getenv("OPENAI_API_KEY")
-        if openai.api_key is None:
-            raise EnvVarError("OPENAI_API_KEY not found in environment")
+    return _default_generator.generate_chat(prompt, validate_sql, system, **kwargs)
 
-    if not system:
-        system = "you are a text-to-SQL translator. You write PostgreSQL code based on plain-language prompts."
 
-    query = [{"role":"system", "content": system}, {"role":"user", "content": prompt}]
+def stream_query(prompt: str, completion_type: str = "single", system: t.Optional[str] = None,
+                 stop_at_statement: bool = True, **kwargs: t.Any) -> t.Iterator[str]:
+    """Stream a generated query as pieces of text, as they arrive.
 
-    response = openai.ChatCompletion.create(
-        messages=query,
-        **{**CHAT_COMPLETION_CONFIG, **kwargs},
-    )
+    See QueryGenerator.stream. Uses the default transport and config.
+    """
+    return _default_generator.stream(prompt, completion_type, system, stop_at_statement, **kwargs)
 
-    generated_query = response["choices"][0]["message"]["content"]
 
+def find_statement_end(text: str, start: int = 0) -> t.Optional[int]:
+    """Return the index just past the first complete, ";"-terminated statement.
 
-    if validate_sql:
-        if not is_valid_query(generated_query):
-            raise QueryGenError("Generated query is empty, only a comment, or invalid.")
-    
-    return generated_query
+    Only ";" characters at or after start are considered, so callers feeding
+    text incrementally can skip the part already searched. The text up to
+    each ";" is tokenized with the pglast scanner, so a ";" inside a string
+    literal or comment is never taken for a terminator (and whatever follows
+    it, e.g. prose, does not matter); a terminator only ends a statement if
+    the text up to it parses. Returns None if text holds no complete
+    statement yet.
+    """
+    from pglast.parser import parse_sql, scan, ParseError
+
+    pos = text.find(";", start)
+    while pos != -1:
+        head = text[: pos + 1]
+        try:
+            # The ";" is a terminator only if it is a token of its own
+            tokens = scan(head)
+            if tokens and tokens[-1].start == pos and parse_sql(head):
+                return pos + 1
+        except ParseError:
+            # E.g. an unterminated string literal, which may still be completed
+            pass
+        pos = text.find(";", pos + 1)
+    return None
 
 
 def is_valid_query(query: str) -> bool:
@@ -166,6 +403,8 @@ def is_valid_query(query: str) -> bool:
     Note: in this context, "invalid" includes a query that is empty or only a
     SQL comment, which is different from the typical sense of "valid Postgres".
     """
+    from pglast.parser import parse_sql, ParseError
+
     parse_result = None
     valid = True
     try:
@@ -0,0 +1,53 @@
+"""In-process normalization and comparison of Postgres queries.
+
+Two queries that differ only in whitespace, keyword case, unquoted identifier
+case, redundant parentheses or a trailing semicolon parse to the same tree, so
+comparing parse trees (which ignore source locations) is both faster and more
+precise than formatting both queries and matching the text.
+"""
+
+import typing as t
+
+from pglast import prettify
+from pglast.ast import Node
+from pglast.parser import parse_sql, ParseError
+
+
+def parse_statements(query: str) -> t.Optional[t.Tuple[Node, ...]]:
+    """Parse query into a tuple of statement nodes, or None if it is invalid."""
+    try:
+        return tuple(raw.stmt for raw in parse_sql(query))
+    except ParseError:
+        return None
+
+
+def normalize_query(query: str) -> str:
+    """Return a canonical, pretty-printed rendering of query.
+
+    Raises pglast.parser.ParseError if query cannot be parsed.
+    """
+    return prettify(query)
+
+
+def statements_match(
+    statements: t.Optional[t.Sequence[Node]],
+    expected: t.Optional[t.Sequence[Node]],
+) -> bool:
+    """Return True if statements starts with the expected statement trees.
+
+    Trailing statements are ignored so that a completion which continues past
+    the requested query still matches. Unparseable input (None) never matches.
+    """
+    if not statements or not expected or len(statements) < len(expected):
+        return False
+    return tuple(statements[: len(expected)]) == tuple(expected)
+
+
+def queries_equivalent(query: str, expected: str) -> bool:
+    """Return True if query is syntactically equivalent to expected.
+
+    See statements_match; both queries are parsed from scratch, so prefer
+    statements_match with pre-parsed trees when comparing against the same
+    expected query repeatedly.
+    """
+    return statements_match(parse_statements(query), parse_statements(expected))
@@ -1,7 +1,10 @@
 """prompt.py provides helpers for preparing Postgres query prompts."""
 
+import hashlib
 import typing as t
 
+from pg_text_query import trace
+
 
 def get_default_prompt(
     text: str,
@@ -22,12 +25,15 @@ def get_default_prompt(
     This default prompt is provided for convenience, use concat_prompt and 
     describe_database to build custom prompts.
     """
-    return concat_prompt(
-        f"-- Language PostgreSQL",
-        describe_database(db_schema, include_types),
-        f"-- A PostgreSQL query to return 1 and a PostgreSQL query for {text}",
-        "SELECT 1;",
-    )
+    with trace.span("prompt_render") as render_span:
+        prompt = concat_prompt(
+            f"-- Language PostgreSQL",
+            describe_database(db_schema, include_types),
+            f"-- A PostgreSQL query to return 1 and a PostgreSQL query for {text}",
+            "SELECT 1;",
+        )
+        render_span.set(prompt_chars=len(prompt))
+    return prompt
 
 def get_custom_prompt(
         task_prompt: str,
@@ -51,18 +57,64 @@ def get_custom_prompt(
     """
     task_user_prompt = task_prompt + user_prompt
     
-    prompt_components = ["-- Language PostgreSQL\n",
-                         describe_database(db_schema, include_types) if include_schema else '',
-                         task_user_prompt,
-                         ]
-    if add_select_1:
-        prompt_components.append("SELECT 1;")
-    
-    return concat_prompt(*prompt_components)
+    with trace.span("prompt_render") as render_span:
+        prompt_components = ["-- Language PostgreSQL\n",
+                             describe_database(db_schema, include_types) if include_schema else '',
+                             task_user_prompt,
+                             ]
+        if add_select_1:
+            prompt_components.append("SELECT 1;")
+
+        prompt = concat_prompt(*prompt_components)
+        render_span.set(prompt_chars=len(prompt))
+    return prompt
 
         
 
 
+class CanonicalPrompt(t.NamedTuple):
+    # The full prompt: prefix followed by the per-request text
+    prompt: str
+    # The part of the prompt that depends only on the schema (not on the task
+    # or user prompt)
+    prefix: str
+    # sha256 hex digest of prefix, identifying it for prompt cache hit rates
+    prefix_hash: str
+
+
+def get_canonical_prompt(
+    user_prompt: str,
+    db_schema: t.Dict[t.Any, t.Any],
+    task_prompt: str = "-- A PostgreSQL query to return 1 and a PostgreSQL query for ",
+    include_types: bool = True,
+    add_select_1: bool = True,
+) -> CanonicalPrompt:
+    """Construct a prompt whose schema prefix is byte-stable per schema snapshot.
+
+    Providers cache and discount long prompt prefixes shared between requests.
+    The prefix here is the language line and the schema described canonically
+    (see describe_database), so any two prompts for the same schema share it
+    byte for byte no matter how its relations were ordered when extracted. All
+    per-request content (task_prompt + user_prompt, then "SELECT 1;") follows
+    the prefix.
+
+    The default task_prompt matches get_default_prompt's wording.
+    """
+    with trace.span("prompt_render") as render_span:
+        prefix = concat_prompt(
+            "-- Language PostgreSQL",
+            describe_database(db_schema, include_types, canonical=True),
+            "",
+        )
+        suffix_components = [task_prompt + user_prompt]
+        if add_select_1:
+            suffix_components.append("SELECT 1;")
+        prompt = prefix + concat_prompt(*suffix_components)
+        prefix_hash = hashlib.sha256(prefix.encode()).hexdigest()
+        render_span.set(prompt_chars=len(prompt), prefix_chars=len(prefix), prefix_hash=prefix_hash)
+    return CanonicalPrompt(prompt, prefix, prefix_hash)
+
+
 def concat_prompt(*args: str) -> str:
     return "\n".join(args)
 
@@ -86,16 +138,46 @@ def _describe_schema(schema: t.Dict[t.Any, t.Any], include_types: bool = True) -
     )
 
 
+def _canonical_schemata(db_schema: t.Dict[t.Any, t.Any]) -> t.List[t.Dict[t.Any, t.Any]]:
+    """Return the schemata with tables, sorted by name, and sorted tables and columns."""
+    return [
+        {
+            "name": s["name"],
+            "tables": [
+                {
+                    "name": table["name"],
+                    "columns": sorted(
+                        table["columns"], key=lambda c: (c.get("ordinal_position") or 0, c["name"])
+                    ),
+                }
+                for table in sorted(s["tables"], key=lambda table: table["name"])
+            ],
+        }
+        for s in sorted(db_schema["schemata"], key=lambda s: s["name"])
+        if s["tables"]
+    ]
+
+
 def describe_database(
-    db_schema: t.Dict[t.Any, t.Any], include_types: bool = True
+    db_schema: t.Dict[t.Any, t.Any], include_types: bool = True, canonical: bool = False
 ) -> str:
     """Describes a database schema with SQL comments per Codex docs example.
+
+    If canonical is True, schemata and their tables are described sorted by
+    name, columns in ordinal position order, and schemata without tables are
+    skipped, so that the description depends only on the schema's contents.
     
+    db_schema may also be a SchemaFile, whose descriptions are precomputed.
+
     Ref: https://platform.openai.com/docs/guides/code/best-practices
     """
-    return "\n".join(
-        [
-            _describe_schema(s, include_types=include_types)
-            for s in db_schema["schemata"]
-        ]
-    )
+    with trace.span("schema_describe"):
+        if not isinstance(db_schema, dict):
+            return db_schema.describe(include_types, canonical)
+        schemata = _canonical_schemata(db_schema) if canonical else db_schema["schemata"]
+        return "\n".join(
+            [
+                _describe_schema(s, include_types=include_types)
+                for s in schemata
+            ]
+        )
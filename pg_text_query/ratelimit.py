@@ -0,0 +1,296 @@
+"""Client-side rate limiting and retries for generation requests.
+
+Providers limit both requests per minute (RPM) and tokens per minute (TPM).
+RateLimiter tracks both with token buckets and admits waiting requests fairly:
+tenants take turns round-robin, and each tenant's requests are served in order,
+so one tenant's burst cannot starve the others. RateLimitedTransport wraps any
+transport with a limiter and retries 429 and 5xx responses with jittered
+exponential backoff.
+
+Example:
+    limiter = RateLimiter(requests_per_minute=3000, tokens_per_minute=250000)
+    generator = QueryGenerator(RateLimitedTransport(OpenAITransport(), limiter))
+    with rate_limit_tenant("acme"):
+        query = generator.generate(prompt)
+"""
+
+import collections
+import contextlib
+import contextvars
+import random
+import threading
+import time
+import typing as t
+
+from pg_text_query import trace
+from pg_text_query.transport import Transport
+
+
+DEFAULT_TENANT = "default"
+# Rough average for English text and SQL with OpenAI tokenizers
+CHARS_PER_TOKEN = 4
+
+_current_tenant: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "pgtq_rate_limit_tenant", default=DEFAULT_TENANT
+)
+
+
+@contextlib.contextmanager
+def rate_limit_tenant(tenant: str) -> t.Iterator[None]:
+    """Attribute requests made in this context to tenant for fair queueing."""
+    token = _current_tenant.set(tenant)
+    try:
+        yield
+    finally:
+        _current_tenant.reset(token)
+
+
+def estimate_tokens(request: t.Dict[str, t.Any]) -> int:
+    """Estimate the tokens a completion request counts against a TPM limit.
+
+    Providers count prompt tokens plus max_tokens (per choice) up front, so the
+    estimate is prompt (or message) length / CHARS_PER_TOKEN plus
+    max_tokens * n, with max_tokens and n coming from the merged request config.
+    """
+    if "messages" in request:
+        text_length = sum(len(m.get("content") or "") for m in request["messages"])
+    else:
+        prompt = request.get("prompt") or ""
+        text_length = len(prompt) if isinstance(prompt, str) else sum(len(p) for p in prompt)
+    prompt_tokens = -(-text_length // CHARS_PER_TOKEN)
+    return prompt_tokens + (request.get("max_tokens") or 0) * (request.get("n") or 1)
+
+
+class TokenBucket:
+    """A continuously refilling bucket holding up to capacity units.
+
+    A caller may take more units than are available once the bucket holds at
+    least min(amount, capacity), leaving the bucket in debt; this lets requests
+    larger than the burst capacity through without exceeding the long-run rate.
+    """
+
+    def __init__(self, rate_per_second: float, capacity: float, clock: t.Callable[[], float]) -> None:
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self._clock = clock
+        self._level = capacity
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount may be taken (0.0 if it may be taken now)."""
+        self._refill()
+        needed = min(amount, self.capacity) - self._level
+        return max(0.0, needed / self.rate_per_second)
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self._level -= amount
+
+    def give_back(self, amount: float) -> None:
+        self._refill()
+        self._level = min(self.capacity, self._level + amount)
+
+
+class RateLimiter:
+    """Admits requests under RPM and TPM limits, queueing tenants fairly.
+
+    A limit of None is not enforced. burst_seconds sets bucket capacity as
+    that many seconds' worth of the per-minute rate; the default of one second
+    matches providers that enforce per-minute limits over shorter windows.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: t.Optional[float] = None,
+        tokens_per_minute: t.Optional[float] = None,
+        burst_seconds: float = 1.0,
+        clock: t.Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._request_bucket = self._token_bucket = None
+        if requests_per_minute is not None:
+            self._request_bucket = self._make_bucket(requests_per_minute, burst_seconds, clock)
+        if tokens_per_minute is not None:
+            self._token_bucket = self._make_bucket(tokens_per_minute, burst_seconds, clock)
+        self._cond = threading.Condition()
+        # Tenants with waiting requests, in round-robin order
+        self._queues: "collections.OrderedDict[str, collections.deque]" = collections.OrderedDict()
+
+    @staticmethod
+    def _make_bucket(per_minute: float, burst_seconds: float, clock: t.Callable[[], float]) -> TokenBucket:
+        rate = per_minute / 60.0
+        return TokenBucket(rate, max(1.0, rate * burst_seconds), clock)
+
+    def _wait_time(self, tokens: int) -> float:
+        wait = 0.0
+        if self._request_bucket is not None:
+            wait = max(wait, self._request_bucket.wait_time(1))
+        if self._token_bucket is not None:
+            wait = max(wait, self._token_bucket.wait_time(tokens))
+        return wait
+
+    def _is_next(self, tenant: str, ticket: object) -> bool:
+        head_tenant, queue = next(iter(self._queues.items()))
+        return head_tenant == tenant and queue[0] is ticket
+
+    def _dequeue(self, tenant: str, ticket: object) -> None:
+        queue = self._queues[tenant]
+        queue.remove(ticket)
+        if queue:
+            # Give the other tenants a turn before this one's next request
+            self._queues.move_to_end(tenant)
+        else:
+            del self._queues[tenant]
+        self._cond.notify_all()
+
+    def acquire(self, tokens: int = 0, tenant: t.Optional[str] = None) -> None:
+        """Block until a request estimated at tokens tokens may be sent.
+
+        tenant defaults to the one set with rate_limit_tenant.
+        """
+        tenant = tenant or _current_tenant.get()
+        ticket = object()
+        with trace.span("queue_wait", tenant=tenant), self._cond:
+            self._queues.setdefault(tenant, collections.deque()).append(ticket)
+            try:
+                while True:
+                    if not self._is_next(tenant, ticket):
+                        self._cond.wait()
+                        continue
+                    wait = self._wait_time(tokens)
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                if self._request_bucket is not None:
+                    self._request_bucket.take(1)
+                if self._token_bucket is not None:
+                    self._token_bucket.take(tokens)
+            finally:
+                self._dequeue(tenant, ticket)
+
+    def adjust(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Correct the token bucket once a response reports actual usage."""
+        if self._token_bucket is None or actual_tokens == estimated_tokens:
+            return
+        with self._cond:
+            if actual_tokens < estimated_tokens:
+                self._token_bucket.give_back(estimated_tokens - actual_tokens)
+            else:
+                self._token_bucket.take(actual_tokens - estimated_tokens)
+            self._cond.notify_all()
+
+
+def is_retryable(error: BaseException) -> bool:
+    """True for rate limit (429) and server (5xx) errors from the provider."""
+    import openai.error
+
+    if isinstance(error, (openai.error.RateLimitError, openai.error.ServiceUnavailableError)):
+        return True
+    status = getattr(error, "http_status", None)
+    return isinstance(error, openai.error.OpenAIError) and status is not None and status >= 500
+
+
+class RetryPolicy:
+    """Jittered exponential backoff ("full jitter") for retryable errors.
+
+    The delay before retry number attempt (starting at 0) is drawn uniformly
+    from [0, min(max_delay, base_delay * 2 ** attempt)], but is never shorter
+    than a Retry-After header sent with the error.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        seed: t.Optional[int] = None,
+    ) -> None:
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self, attempt: int, error: t.Optional[BaseException] = None) -> float:
+        with self._lock:
+            delay = self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        headers = getattr(error, "headers", None) or {}
+        try:
+            delay = max(delay, float(headers.get("retry-after", 0)))
+        except (TypeError, ValueError):
+            pass
+        return delay
+
+
+class RateLimitedTransport(Transport):
+    """Wraps a transport with a RateLimiter and retries on 429 and 5xx.
+
+    Every attempt, including retries, is admitted by the limiter. Reported
+    token usage is fed back to the limiter to correct its estimate.
+    """
+
+    def __init__(
+        self,
+        transport: Transport,
+        limiter: t.Optional[RateLimiter] = None,
+        retry_policy: t.Optional[RetryPolicy] = None,
+        sleep: t.Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.transport = transport
+        self.limiter = limiter or RateLimiter()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._sleep = sleep
+
+    def _retry(self, attempt: int, error: BaseException) -> None:
+        delay = self.retry_policy.delay(attempt, error)
+        trace.event("retry", attempt=attempt, delay=delay, error=type(error).__name__)
+        self._sleep(delay)
+
+    def create(self, endpoint: str, request: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+        tokens = estimate_tokens(request)
+        attempt = 0
+        while True:
+            self.limiter.acquire(tokens)
+            try:
+                response = self.transport.create(endpoint, request)
+            except Exception as e:
+                if attempt >= self.retry_policy.max_retries or not is_retryable(e):
+                    raise
+                self._retry(attempt, e)
+                attempt += 1
+                continue
+            usage = response.get("usage") or {}
+            if usage.get("total_tokens") is not None:
+                self.limiter.adjust(tokens, usage["total_tokens"])
+            return response
+
+    def stream(self, endpoint: str, request: t.Dict[str, t.Any]) -> t.Iterator[str]:
+        """Stream through the wrapped transport, retrying until the first piece.
+
+        Once any text has been yielded, errors are raised rather than retried.
+        """
+        tokens = estimate_tokens(request)
+        attempt = 0
+        while True:
+            self.limiter.acquire(tokens)
+            pieces = self.transport.stream(endpoint, request)
+            try:
+                first = next(pieces)
+            except StopIteration:
+                return
+            except Exception as e:
+                if attempt >= self.retry_policy.max_retries or not is_retryable(e):
+                    raise
+                self._retry(attempt, e)
+                attempt += 1
+                continue
+            break
+        yield first
+        yield from pieces
+
+    def close(self) -> None:
+        self.transport.close()
@@ -0,0 +1,294 @@
+"""Caching of executed query results until the tables they read change.
+
+Users often rerun the same question, and with it the same (possibly
+expensive) generated query. ResultCache keeps recent result sets, keyed on
+the pglast-normalized query and the database it ran against, and serves them
+again for as long as the tables the query reads are unchanged.
+
+Whether they changed is told by a data version read before each execution:
+for every table the query reads (and every inheritance child or partition of
+it), the xmin of its pg_class row (which changes when e.g. ALTER TABLE adds a
+column), its relfilenode (which TRUNCATE and rewriting ALTERs change) and its
+insert, update and delete counters from pg_stat_all_tables. A cached result
+is only served while the data version matches the one it was stored with.
+
+Statistics are reported shortly after a writer commits (typically within a
+second), so a result may be served for that long after a change; ttl bounds
+how long any result is served regardless. Queries are not cached when the
+data version cannot vouch for their result: queries reading views or foreign
+tables, calling volatile functions, non-builtin functions that are not
+immutable or the time functions (now(), CURRENT_DATE, 'today' ...), or run
+outside READ COMMITTED, after writes in the same transaction, or with
+track_counts off.
+
+Example:
+    cache = ResultCache(max_bytes=64 << 20, ttl=300)
+    rows = list(iter_query_rows(conn, query, cache=cache))
+"""
+
+import collections
+import sys
+import threading
+import time
+import typing as t
+
+from pg_text_query import trace
+from pg_text_query.normalize import normalize_query
+
+
+DEFAULT_MAX_BYTES = 64 << 20
+DEFAULT_MAX_RESULT_BYTES = 1 << 20
+
+# Functions whose results depend on the time, without being volatile
+_TIME_FUNCTIONS = {"now", "transaction_timestamp", "statement_timestamp", "age"}
+# Special date/time input values
+_TIME_STRINGS = {"now", "today", "tomorrow", "yesterday"}
+
+DATA_VERSION_SQL = """
+WITH RECURSIVE named AS (
+    SELECT to_regclass(
+        CASE WHEN r.schema IS NULL THEN quote_ident(r.name) ELSE quote_ident(r.schema) || '.' || quote_ident(r.name) END
+    ) AS oid
+    FROM unnest(%s::text[], %s::text[]) AS r(schema, name)
+),
+relations AS (
+    SELECT oid FROM named WHERE oid IS NOT NULL
+    UNION
+    SELECT i.inhrelid FROM pg_inherits i JOIN relations r ON i.inhparent = r.oid
+)
+SELECT
+    current_setting('track_counts')::bool
+    AND current_setting('transaction_isolation') = 'read committed'
+    AND NOT EXISTS (SELECT FROM named WHERE oid IS NULL)
+    AND NOT EXISTS (
+        SELECT FROM relations r JOIN pg_class c ON c.oid = r.oid WHERE c.relkind NOT IN ('r', 'p', 'm')
+    )
+    AND NOT EXISTS (
+        SELECT FROM relations r JOIN pg_stat_xact_all_tables x ON x.relid = r.oid
+        WHERE x.n_tup_ins + x.n_tup_upd + x.n_tup_del > 0
+    )
+    AND NOT EXISTS (
+        SELECT FROM pg_proc p
+        WHERE p.proname = ANY(%s::name[])
+        AND (p.provolatile = 'v' OR (p.provolatile = 's' AND p.pronamespace <> 'pg_catalog'::regnamespace))
+    ) AS cacheable,
+    current_database(),
+    current_user,
+    inet_server_addr()::text,
+    inet_server_port(),
+    (
+        SELECT string_agg(
+            concat_ws(':', c.oid, c.xmin, c.relfilenode, s.n_tup_ins, s.n_tup_upd, s.n_tup_del), ',' ORDER BY c.oid
+        )
+        FROM relations r
+        JOIN pg_class c ON c.oid = r.oid
+        LEFT JOIN pg_stat_all_tables s ON s.relid = c.oid
+    ) AS data_version
+"""
+
+
+class QuerySources(t.NamedTuple):
+    # (schema, name) of each relation read, schema being None if unqualified
+    relations: t.List[t.Tuple[t.Optional[str], str]]
+    # Names of the functions called
+    functions: t.List[str]
+
+
+class ResultCacheStats(t.NamedTuple):
+    entries: int
+    bytes: int
+    max_bytes: int
+    hits: int
+    misses: int
+    stored: int
+    evictions: int
+
+
+class _Entry(t.NamedTuple):
+    version: str
+    rows: t.Tuple[t.Any, ...]
+    nbytes: int
+    stored_at: float
+
+
+def query_sources(query: str) -> t.Optional[QuerySources]:
+    """Return the relations and functions a SELECT query uses.
+
+    Returns None if query is not a single plain SELECT (e.g. SELECT INTO or
+    SELECT ... FOR UPDATE), or if its result depends on the time.
+    """
+    from pglast import ast, parse_sql
+    from pglast.parser import ParseError
+    from pglast.visitors import Visitor
+
+    try:
+        stmts = parse_sql(query)
+    except ParseError:
+        return None
+    if len(stmts) != 1 or not isinstance(stmts[0].stmt, ast.SelectStmt) or stmts[0].stmt.intoClause is not None:
+        return None
+
+    range_vars: t.List[ast.RangeVar] = []
+    functions: t.Set[str] = set()
+    ctes: t.Set[str] = set()
+    cacheable = True
+
+    class _Collector(Visitor):
+        def visit_RangeVar(self, ancestors: t.Any, node: ast.RangeVar) -> None:
+            range_vars.append(node)
+
+        def visit_CommonTableExpr(self, ancestors: t.Any, node: ast.CommonTableExpr) -> None:
+            ctes.add(node.ctename)
+
+        def visit_FuncCall(self, ancestors: t.Any, node: ast.FuncCall) -> None:
+            nonlocal cacheable
+            name = node.funcname[-1].sval
+            functions.add(name)
+            cacheable = cacheable and name not in _TIME_FUNCTIONS
+
+        def visit_SQLValueFunction(self, ancestors: t.Any, node: ast.SQLValueFunction) -> None:
+            nonlocal cacheable
+            cacheable = False
+
+        def visit_LockingClause(self, ancestors: t.Any, node: ast.LockingClause) -> None:
+            nonlocal cacheable
+            cacheable = False
+
+        def visit_String(self, ancestors: t.Any, node: ast.String) -> None:
+            nonlocal cacheable
+            cacheable = cacheable and node.sval.strip().lower() not in _TIME_STRINGS
+
+    _Collector()(stmts)
+    if not cacheable:
+        return None
+    relations = [
+        (range_var.schemaname, range_var.relname)
+        for range_var in range_vars
+        if range_var.schemaname is not None or range_var.relname not in ctes
+    ]
+    return QuerySources(sorted(set(relations), key=str), sorted(functions))
+
+
+def get_data_version(cur: t.Any, sources: QuerySources) -> t.Optional[t.Tuple[t.Tuple[t.Any, ...], str]]:
+    """Return (database, data version) for sources, or None if they can't be versioned.
+
+    database identifies the server, database and role the query runs as.
+    Queries reading no tables (e.g. SELECT 1) can't be versioned.
+    """
+    if not sources.relations:
+        return None
+    # Statistics read in a transaction are otherwise cached until it ends
+    cur.execute("SELECT pg_stat_clear_snapshot()")
+    schemas, names = zip(*sources.relations)
+    cur.execute(DATA_VERSION_SQL, (list(schemas), list(names), sources.functions))
+    cacheable, *database, version = cur.fetchone()
+    if not cacheable or version is None:
+        return None
+    return tuple(database), version
+
+
+def row_bytes(row: t.Any) -> int:
+    """Estimate the memory a result row (a tuple or dict) holds."""
+    values = row.values() if isinstance(row, dict) else row
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in values)
+
+
+class ResultCache:
+    """An LRU cache of query results within a byte budget.
+
+    Results larger than max_result_bytes are not stored. Entries older than
+    ttl seconds (if given) are not served.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_result_bytes: int = DEFAULT_MAX_RESULT_BYTES,
+        ttl: t.Optional[float] = None,
+        clock: t.Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.max_result_bytes = min(max_result_bytes, max_bytes)
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Least recently used first
+        self._entries: "collections.OrderedDict[t.Hashable, _Entry]" = collections.OrderedDict()
+        self._bytes = 0
+        self._hits = self._misses = self._stored = self._evictions = 0
+
+    def key(self, cur: t.Any, query: str) -> t.Optional[t.Tuple[t.Hashable, str]]:
+        """Return (key, data version) for running query on cur's connection, or None if not cacheable.
+
+        Must be called before query is executed, so that a change made while
+        it runs makes its stored result stale rather than hiding the change.
+        """
+        sources = query_sources(query)
+        if sources is None:
+            return None
+        versioned = get_data_version(cur, sources)
+        if versioned is None:
+            return None
+        database, version = versioned
+        return (database, normalize_query(query)), version
+
+    def lookup(self, key: t.Hashable, version: str) -> t.Optional[t.Tuple[t.Any, ...]]:
+        """Return the rows stored for key at version, if fresh, else None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (
+                entry.version != version or (self.ttl is not None and self._clock() - entry.stored_at >= self.ttl)
+            ):
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+            else:
+                self._misses += 1
+        trace.event("cache_miss" if entry is None else "cache_hit", cache="result")
+        return entry.rows if entry is not None else None
+
+    def store(self, key: t.Hashable, version: str, rows: t.Sequence[t.Any], nbytes: t.Optional[int] = None) -> bool:
+        """Store rows for key at version; return whether they fit.
+
+        nbytes is the rows' size, estimated if not given.
+        """
+        if nbytes is None:
+            nbytes = sum(row_bytes(row) for row in rows)
+        if nbytes > self.max_result_bytes:
+            return False
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = _Entry(version, tuple(rows), nbytes, self._clock())
+            self._bytes += nbytes
+            self._stored += 1
+            evicted = 0
+            while self._bytes > self.max_bytes:
+                evicted_key = next(iter(self._entries))
+                self._remove(evicted_key)
+                evicted += 1
+            self._evictions += evicted
+        for _ in range(evicted):
+            trace.event("eviction", cache="result")
+        return True
+
+    def _remove(self, key: t.Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> ResultCacheStats:
+        with self._lock:
+            return ResultCacheStats(
+                len(self._entries), self._bytes, self.max_bytes, self._hits, self._misses, self._stored, self._evictions,
+            )
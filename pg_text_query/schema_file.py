@@ -0,0 +1,402 @@
+"""A compact binary file format for db schemas, readable in place via mmap.
+
+Loading a big schema from JSON means parsing it and building nested dicts in
+every worker process. A schema file instead holds the get_db_schema output as
+fixed-size records over a deduplicated string pool, together with artifacts
+derived from it: the schema described as by describe_database (with and
+without types, canonical or not), a description line per table, and a sorted
+index of schema, relation and column names. SchemaFile.open maps the file
+read-only, so opening it costs no parsing and forked workers share its pages
+through the page cache; strings are decoded only when read.
+
+Layout (little-endian):
+    header       magic, version, flags, section counts and offsets, and the
+                 string ids of the db name, description and descriptions
+    strings      (offset, length) per string id, into the string data
+    string data  UTF-8 bytes of every distinct string
+    schemata     _SCHEMA records
+    relations    _RELATION records, each schema's tables then its views
+    columns      _COLUMN records, each relation's columns in order
+    identifiers  _IDENTIFIER records sorted by casefolded name
+
+Missing strings and integers (None) are stored as NULL_ID and NULL_INT.
+
+Example:
+    write_schema_file(get_db_schema(cur, db_name), "penguins.pgtqs")
+    with SchemaFile.open("penguins.pgtqs") as schema:
+        prompt = get_default_prompt("how many penguins?", schema)
+"""
+
+import json
+import mmap
+import os
+import struct
+import typing as t
+
+from pg_text_query.prompt import _describe_cols, _describe_table, describe_database
+
+if t.TYPE_CHECKING:
+    from pg_text_query.db_schema import InfoSchemaCache
+
+
+MAGIC = b"PGTQSCHM"
+VERSION = 1
+NULL_ID = 0xFFFFFFFF
+NULL_INT = -1
+
+# Header flag: the db schema has a top-level description key
+_HAS_DESCRIPTION = 1
+
+_HEADER = struct.Struct("<8sHH17I")
+_STRING = struct.Struct("<II")
+# name, description, is_foreign, first relation, tables, views
+_SCHEMA = struct.Struct("<IIB3xIII")
+# name, description, schema, first column, columns, typed fragment, untyped fragment
+_RELATION = struct.Struct("<IIIIIII")
+# name, relation, ordinal_position, column_default, is_nullable, data_type, character_maximum_length, description
+_COLUMN = struct.Struct("<IIiIIIiI")
+# casefolded name, kind, index into the kind's records
+_IDENTIFIER = struct.Struct("<III")
+
+SCHEMA, RELATION, COLUMN = 0, 1, 2
+
+
+class Identifier(t.NamedTuple):
+    kind: int
+    schema: str
+    relation: t.Optional[str]
+    column: t.Optional[str]
+
+
+class _Builder:
+    """Lays out a db schema dict as a schema file."""
+
+    def __init__(self) -> None:
+        self.string_ids: t.Dict[str, int] = {}
+        self.strings: t.List[bytes] = []
+
+    def string(self, value: t.Optional[str]) -> int:
+        if value is None:
+            return NULL_ID
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            string_id = self.string_ids[value] = len(self.strings)
+            self.strings.append(value.encode())
+        return string_id
+
+    def build(self, db_schema: t.Dict[str, t.Any]) -> bytes:
+        schemata, relations, columns = bytearray(), bytearray(), bytearray()
+        identifiers: t.List[t.Tuple[bytes, int, int, int]] = []
+        n_relations = n_columns = 0
+
+        def identify(name: str, kind: int, index: int) -> None:
+            key = name.casefold()
+            identifiers.append((key.encode(), kind, index, self.string(key)))
+
+        for schema_index, schema in enumerate(db_schema["schemata"]):
+            identify(schema["name"], SCHEMA, schema_index)
+            schemata += _SCHEMA.pack(
+                self.string(schema["name"]),
+                self.string(schema.get("description")),
+                bool(schema.get("is_foreign")),
+                n_relations,
+                len(schema["tables"]),
+                len(schema["views"]),
+            )
+            for kind in ("tables", "views"):
+                for rel in schema[kind]:
+                    identify(rel["name"], RELATION, n_relations)
+                    typed = untyped = NULL_ID
+                    if kind == "tables":
+                        table = _describe_table(schema["name"], rel["name"])
+                        typed = self.string(f"-- Table = {table}, columns = [{_describe_cols(rel['columns'], True)}]")
+                        untyped = self.string(f"-- Table = {table}, columns = [{_describe_cols(rel['columns'], False)}]")
+                    relations += _RELATION.pack(
+                        self.string(rel["name"]),
+                        self.string(rel.get("description")),
+                        schema_index,
+                        n_columns,
+                        len(rel["columns"]),
+                        typed,
+                        untyped,
+                    )
+                    for col in rel["columns"]:
+                        identify(col["name"], COLUMN, n_columns)
+                        columns += _COLUMN.pack(
+                            self.string(col["name"]),
+                            n_relations,
+                            _int(col.get("ordinal_position")),
+                            self.string(col.get("column_default")),
+                            self.string(col.get("is_nullable")),
+                            self.string(col.get("data_type")),
+                            _int(col.get("character_maximum_length")),
+                            self.string(col.get("description")),
+                        )
+                        n_columns += 1
+                    n_relations += 1
+
+        identifiers.sort()
+        identifier_records = b"".join(_IDENTIFIER.pack(key_id, kind, index) for _, kind, index, key_id in identifiers)
+        descriptions = [
+            self.string(describe_database(db_schema, include_types, canonical))
+            for canonical in (False, True)
+            for include_types in (True, False)
+        ]
+        db_ids = [self.string(db_schema["name"]), self.string(db_schema.get("description"))]
+
+        string_table = bytearray()
+        offset = 0
+        for value in self.strings:
+            string_table += _STRING.pack(offset, len(value))
+            offset += len(value)
+        sections = [bytes(string_table), b"".join(self.strings), schemata, relations, columns, identifier_records]
+        offsets = []
+        position = _HEADER.size
+        for section in sections:
+            offsets.append(position)
+            position += len(section)
+
+        header = _HEADER.pack(
+            MAGIC,
+            VERSION,
+            _HAS_DESCRIPTION if "description" in db_schema else 0,
+            len(self.strings),
+            len(db_schema["schemata"]),
+            n_relations,
+            n_columns,
+            len(identifiers),
+            *db_ids,
+            *descriptions,
+            *offsets,
+        )
+        return header + b"".join(sections)
+
+
+def _int(value: t.Optional[int]) -> int:
+    return NULL_INT if value is None else value
+
+
+def dump_schema(db_schema: t.Dict[str, t.Any]) -> bytes:
+    """Return db_schema (as returned by get_db_schema) in the schema file format."""
+    return _Builder().build(db_schema)
+
+
+def write_schema_file(db_schema: t.Dict[str, t.Any], path: str) -> None:
+    """Write db_schema to path, replacing it atomically so readers never see a partial file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(dump_schema(db_schema))
+    os.replace(tmp_path, path)
+
+
+class SchemaFile:
+    """A db schema read in place from the schema file format.
+
+    buffer is anything supporting the buffer protocol (bytes, mmap), and is
+    only read from. Use SchemaFile.open to map a file.
+    """
+
+    def __init__(self, buffer: t.Union[bytes, bytearray, memoryview, mmap.mmap]) -> None:
+        self._view = memoryview(buffer)
+        self._mmap = buffer if isinstance(buffer, mmap.mmap) else None
+        if len(self._view) < _HEADER.size or bytes(self._view[:len(MAGIC)]) != MAGIC:
+            raise ValueError("Not a schema file")
+        header = _HEADER.unpack_from(self._view)
+        version, self._flags = header[1:3]
+        if version != VERSION:
+            raise ValueError(f"Unsupported schema file version {version}")
+        self._n_strings, self._n_schemata, self._n_relations, self._n_columns, self._n_identifiers = header[3:8]
+        self._name, self._description = header[8:10]
+        self._descriptions = header[10:14]
+        (
+            self._strings_at, self._data_at, self._schemata_at,
+            self._relations_at, self._columns_at, self._identifiers_at,
+        ) = header[14:]
+
+    @classmethod
+    def open(cls, path: str) -> "SchemaFile":
+        """Map the schema file at path read-only."""
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def close(self) -> None:
+        self._view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+
+    def __enter__(self) -> "SchemaFile":
+        return self
+
+    def __exit__(self, *exc_info: t.Any) -> None:
+        self.close()
+
+    @property
+    def nbytes(self) -> int:
+        return self._view.nbytes
+
+    def _string(self, string_id: int) -> t.Optional[str]:
+        if string_id == NULL_ID:
+            return None
+        offset, length = _STRING.unpack_from(self._view, self._strings_at + string_id * _STRING.size)
+        start = self._data_at + offset
+        return str(self._view[start:start + length], "utf-8")
+
+    def _schema(self, index: int) -> t.Tuple[int, ...]:
+        return _SCHEMA.unpack_from(self._view, self._schemata_at + index * _SCHEMA.size)
+
+    def _relation(self, index: int) -> t.Tuple[int, ...]:
+        return _RELATION.unpack_from(self._view, self._relations_at + index * _RELATION.size)
+
+    def _column(self, index: int) -> t.Tuple[int, ...]:
+        return _COLUMN.unpack_from(self._view, self._columns_at + index * _COLUMN.size)
+
+    @property
+    def name(self) -> str:
+        return self._string(self._name)
+
+    @property
+    def description(self) -> t.Optional[str]:
+        return self._string(self._description)
+
+    def describe(self, include_types: bool = True, canonical: bool = False) -> str:
+        """Return describe_database(schema, include_types, canonical), precomputed."""
+        return self._string(self._descriptions[2 * canonical + (not include_types)])
+
+    def describe_relations(
+        self, relations: t.Iterable[t.Tuple[str, str]], include_types: bool = True
+    ) -> str:
+        """Describe only the given (schema, table) pairs, in the given order.
+
+        Unknown names and views are skipped.
+        """
+        lines = []
+        for schema_name, table_name in relations:
+            for index in self._find_relations(schema_name, table_name):
+                fragment = self._relation(index)[5 if include_types else 6]
+                if fragment != NULL_ID:
+                    lines.append(self._string(fragment))
+        return "\n".join(lines)
+
+    def _identifier_key(self, position: int) -> bytes:
+        key_id = _IDENTIFIER.unpack_from(self._view, self._identifiers_at + position * _IDENTIFIER.size)[0]
+        offset, length = _STRING.unpack_from(self._view, self._strings_at + key_id * _STRING.size)
+        start = self._data_at + offset
+        return bytes(self._view[start:start + length])
+
+    def _find(self, name: str) -> t.Iterator[t.Tuple[int, int]]:
+        """Yield (kind, index) of every identifier matching name case-insensitively."""
+        key = name.casefold().encode()
+        low, high = 0, self._n_identifiers
+        while low < high:
+            middle = (low + high) // 2
+            if self._identifier_key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        while low < self._n_identifiers and self._identifier_key(low) == key:
+            yield _IDENTIFIER.unpack_from(self._view, self._identifiers_at + low * _IDENTIFIER.size)[1:]
+            low += 1
+
+    def _find_relations(self, schema_name: str, table_name: str) -> t.Iterator[int]:
+        for kind, index in self._find(table_name):
+            if kind == RELATION:
+                rel = self._relation(index)
+                if self._string(rel[0]) == table_name and self._string(self._schema(rel[2])[0]) == schema_name:
+                    yield index
+
+    def relation(self, schema_name: str, name: str) -> t.Optional[t.Tuple[str, t.Dict[str, t.Any]]]:
+        """Return ("tables" or "views", relation dict) for schema_name.name, or None."""
+        for index in self._find_relations(schema_name, name):
+            rel_name, description, schema_index, first, n_columns, _, _ = self._relation(index)
+            _, _, _, first_relation, n_tables, _ = self._schema(schema_index)
+            columns = [self._column_dict(self._column(i)) for i in range(first, first + n_columns)]
+            kind = "tables" if index < first_relation + n_tables else "views"
+            return kind, {"name": name, "description": self._string(description), "columns": columns}
+        return None
+
+    def _column_dict(self, record: t.Tuple[int, ...], string: t.Optional[t.Callable] = None) -> t.Dict[str, t.Any]:
+        s = string or self._string
+        name, _, position, default, nullable, data_type, max_length, description = record
+        return {
+            "name": s(name),
+            "ordinal_position": None if position == NULL_INT else position,
+            "column_default": s(default),
+            "is_nullable": s(nullable),
+            "data_type": s(data_type),
+            "character_maximum_length": None if max_length == NULL_INT else max_length,
+            "description": s(description),
+        }
+
+    def find(self, name: str) -> t.List[Identifier]:
+        """Return every schema, relation and column named name, ignoring case."""
+        matches = []
+        for kind, index in self._find(name):
+            schema_index = index
+            relation = column = None
+            if kind == COLUMN:
+                column_record = self._column(index)
+                column = self._string(column_record[0])
+                index = column_record[1]
+            if kind in (RELATION, COLUMN):
+                relation_record = self._relation(index)
+                relation = self._string(relation_record[0])
+                schema_index = relation_record[2]
+            matches.append(Identifier(kind, self._string(self._schema(schema_index)[0]), relation, column))
+        return matches
+
+    def _section(self, start: int, record: struct.Struct, count: int) -> t.Iterator[t.Tuple[t.Any, ...]]:
+        return record.iter_unpack(self._view[start:start + count * record.size])
+
+    def to_dict(self) -> "InfoSchemaCache":
+        """Convert back to the dict shape returned by get_db_schema.
+
+        This decodes and builds everything in one pass over each section, and
+        is meant for conversion rather than for serving.
+        """
+        data = self._view[self._data_at:self._schemata_at]
+        strings = [
+            str(data[offset:offset + length], "utf-8")
+            for offset, length in self._section(self._strings_at, _STRING, self._n_strings)
+        ]
+
+        def s(string_id: int) -> t.Optional[str]:
+            return None if string_id == NULL_ID else strings[string_id]
+
+        columns = [
+            self._column_dict(record, s) for record in self._section(self._columns_at, _COLUMN, self._n_columns)
+        ]
+        relations = [
+            {"name": s(name), "description": s(description), "columns": columns[first:first + n_columns]}
+            for name, description, _, first, n_columns, _, _
+            in self._section(self._relations_at, _RELATION, self._n_relations)
+        ]
+
+        db_schema: t.Dict[str, t.Any] = {"name": self.name}
+        if self._flags & _HAS_DESCRIPTION:
+            db_schema["description"] = self.description
+        db_schema["schemata"] = [
+            {
+                "name": s(name),
+                "description": s(description),
+                "is_foreign": bool(is_foreign),
+                "tables": relations[first:first + n_tables],
+                "views": relations[first + n_tables:first + n_tables + n_views],
+            }
+            for name, description, is_foreign, first, n_tables, n_views
+            in self._section(self._schemata_at, _SCHEMA, self._n_schemata)
+        ]
+        return t.cast("InfoSchemaCache", db_schema)
+
+
+def json_to_schema_file(json_path: str, path: str) -> None:
+    """Convert a db schema JSON file (e.g. test/test_prompts/test_schemas/*) to a schema file."""
+    with open(json_path) as f:
+        write_schema_file(json.load(f), path)
+
+
+def schema_file_to_json(path: str, json_path: str) -> None:
+    """Convert a schema file back to a db schema JSON file."""
+    with SchemaFile.open(path) as schema:
+        db_schema = schema.to_dict()
+    with open(json_path, "w") as f:
+        json.dump(db_schema, f, indent=4)
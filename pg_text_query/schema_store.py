@@ -0,0 +1,147 @@
+"""A bounded in-memory store of many tenants' schemas.
+
+A process serving thousands of tenant databases cannot hold every schema and
+its rendered description forever. SchemaStore keeps each tenant's schema as
+a SchemaFile (see schema_file.py), which holds the schema and its
+precomputed descriptions in one buffer of known size, and evicts the least
+recently used tenants once the total size exceeds max_bytes. Evicted or
+expired tenants are reloaded with loader on their next request, once however
+many threads ask for them at the same time.
+
+Example:
+    def load(tenant: str) -> InfoSchemaCache:
+        with pooled_cursor(pools[tenant]) as cur:
+            return get_db_schema(cur, tenant)
+
+    store = SchemaStore(load, max_bytes=64 << 20, ttl=600)
+    prompt = get_canonical_prompt(question, store.get(tenant))
+"""
+
+import collections
+import threading
+import time
+import typing as t
+
+from pg_text_query import trace
+from pg_text_query.schema_file import SchemaFile, dump_schema
+from pg_text_query.singleflight import SingleFlight
+
+if t.TYPE_CHECKING:
+    from pg_text_query.db_schema import InfoSchemaCache
+
+
+DEFAULT_MAX_BYTES = 256 << 20
+
+
+class SchemaStoreStats(t.NamedTuple):
+    entries: int
+    bytes: int
+    max_bytes: int
+    hits: int
+    misses: int
+    loads: int
+    evictions: int
+
+
+class _Entry(t.NamedTuple):
+    schema: SchemaFile
+    loaded_at: float
+
+
+class SchemaStore:
+    """Caches tenants' schemas as SchemaFiles within a byte budget.
+
+    loader(tenant) returns the tenant's schema as returned by get_db_schema.
+    Entries older than ttl seconds (if given) are reloaded on their next use.
+    A single schema larger than max_bytes is still stored, evicting all
+    others, so that its own requests can be served.
+    """
+
+    def __init__(
+        self,
+        loader: t.Callable[[str], "InfoSchemaCache"],
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttl: t.Optional[float] = None,
+        clock: t.Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Least recently used first
+        self._entries: "collections.OrderedDict[str, _Entry]" = collections.OrderedDict()
+        self._bytes = 0
+        self._hits = self._misses = self._loads = self._evictions = 0
+        self._flight = SingleFlight()
+
+    def lookup(self, tenant: str) -> t.Optional[SchemaFile]:
+        """Return tenant's schema if stored and fresh, else None."""
+        with self._lock:
+            entry = self._entries.get(tenant)
+            if entry is not None and (self.ttl is None or self._clock() - entry.loaded_at < self.ttl):
+                self._entries.move_to_end(tenant)
+                self._hits += 1
+                hit = True
+            else:
+                self._misses += 1
+                hit = False
+        trace.event("cache_hit" if hit else "cache_miss", cache="schema")
+        return entry.schema if hit else None
+
+    def get(self, tenant: str) -> SchemaFile:
+        """Return tenant's schema, loading it if not stored or expired."""
+        schema = self.lookup(tenant)
+        if schema is None:
+            schema = self.load(tenant)
+        return schema
+
+    def load(self, tenant: str) -> SchemaFile:
+        """Load and store tenant's schema, sharing the load with concurrent callers."""
+        return self._flight.do(tenant, lambda: self._load(tenant))
+
+    def _load(self, tenant: str) -> SchemaFile:
+        schema = SchemaFile(dump_schema(self.loader(tenant)))
+        with self._lock:
+            self._loads += 1
+            old = self._entries.pop(tenant, None)
+            if old is not None:
+                self._bytes -= old.schema.nbytes
+            self._entries[tenant] = _Entry(schema, self._clock())
+            self._bytes += schema.nbytes
+            evicted = 0
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, entry = self._entries.popitem(last=False)
+                # Not closed: requests may still be reading it
+                self._bytes -= entry.schema.nbytes
+                evicted += 1
+            self._evictions += evicted
+        for _ in range(evicted):
+            trace.event("eviction", cache="schema")
+        return schema
+
+    def describe(self, tenant: str, include_types: bool = True, canonical: bool = False) -> str:
+        """Return describe_database of tenant's schema."""
+        return self.get(tenant).describe(include_types, canonical)
+
+    def invalidate(self, tenant: str) -> None:
+        """Drop tenant's schema, so that its next request reloads it."""
+        with self._lock:
+            entry = self._entries.pop(tenant, None)
+            if entry is not None:
+                self._bytes -= entry.schema.nbytes
+
+    def __contains__(self, tenant: str) -> bool:
+        with self._lock:
+            return tenant in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> SchemaStoreStats:
+        with self._lock:
+            return SchemaStoreStats(
+                len(self._entries), self._bytes, self.max_bytes,
+                self._hits, self._misses, self._loads, self._evictions,
+            )
@@ -0,0 +1,509 @@
+"""An ASGI text-to-SQL service.
+
+Endpoints (JSON in and out):
+    POST /generate  {"database", "question", "validate"?, "explain"?,
+                     "completion_type"?, "params"?}
+                    -> {"query", "prefix_hash", "cost"?}
+    POST /validate  {"query"} -> {"valid", "normalized"}
+    POST /explain   {"database", "query", "max_cost"?, "max_rows"?} -> CostCheck
+    GET  /health    -> {"status": "ok", "in_flight", "pending"}
+    GET  /metrics   -> Prometheus text format
+
+Each database is reached through its own bounded connection pool, created on
+first use, and its schema is kept in a SchemaStore (and fetched once, however
+many requests miss at the same time) for schema_ttl seconds. The store holds
+at most schema_cache_bytes of schemas, evicting the least recently used
+databases, so memory stays flat however many databases are served. Databases
+may also be given a fixed schema, which needs no connection for /generate.
+Prompts are rendered with get_canonical_prompt, so requests for one database
+share a prompt prefix. Identical concurrent generations (the same prompt and
+parameters) share one call before admission, so duplicates take no generation
+slot. At most max_concurrency generations run at once, each on a thread of the
+service's own pool, and past max_pending admitted requests the service answers
+503 with Retry-After rather than queueing without bound.
+
+With skeleton_cache_entries, questions differing from an earlier one only in
+literals are answered from its query's skeleton (see skeleton.py) without a
+generation. Skeletons are kept per database, and when a database's schema is
+reloaded only those using relations or columns that changed are dropped.
+
+The app needs no web framework; run it with any ASGI server, e.g.:
+    PGTQ_SERVICE_DATABASES='{"penguins": "dbname=penguins"}' \\
+        uvicorn --factory pg_text_query.service:create_app
+
+create_app reads its configuration from the environment:
+    PGTQ_SERVICE_DATABASES: JSON object of database name to DSN
+    PGTQ_SERVICE_SCHEMAS: JSON object of database name to a schema JSON file
+    PGTQ_SERVICE_MAX_CONCURRENCY, PGTQ_SERVICE_MAX_PENDING: admission limits
+    PGTQ_SERVICE_SCHEMA_CACHE_BYTES: the schema store's byte budget
+    PGTQ_SERVICE_SKELETON_CACHE_ENTRIES: the skeleton cache's size (0 disables it)
+    PGTQ_REPLAY_FILE, PGTQ_REPLAY_LATENCY: serve generations recorded with
+        RecordingTransport instead of calling OpenAI, e.g. for load tests
+"""
+
+import asyncio
+import collections
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+
+from pg_text_query import trace
+from pg_text_query.db_schema import InfoSchemaCache, get_db_schema
+from pg_text_query.errors import QueryExecError, QueryGenError
+from pg_text_query.execute import pooled_cursor
+from pg_text_query.explain import check_query_cost
+from pg_text_query.gen_query import QueryGenerator, is_valid_query
+from pg_text_query.prompt import get_canonical_prompt
+from pg_text_query.schema_file import SchemaFile
+from pg_text_query.schema_store import DEFAULT_MAX_BYTES, SchemaStore
+from pg_text_query.singleflight import AsyncSingleFlight
+from pg_text_query.skeleton import SkeletonCache
+
+
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_MAX_PENDING = 64
+DEFAULT_SCHEMA_TTL = 600.0
+DEFAULT_SCHEMA_CACHE_BYTES = DEFAULT_MAX_BYTES
+DEFAULT_POOL_MAXCONN = 8
+MAX_BODY_BYTES = 1 << 20
+# Request parameters passed through to the model
+ALLOWED_PARAMS = {"temperature", "max_tokens", "top_p", "stop"}
+COMPLETION_TYPES = {None, "single", "chat"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers: t.Sequence[t.Tuple[str, str]] = ()) -> None:
+        super().__init__(message)
+        self.status = status
+        self.headers = list(headers)
+
+
+class BlockingPool:
+    """A psycopg2 ThreadedConnectionPool that waits for a free connection.
+
+    psycopg2's pools raise PoolError when exhausted; this one blocks instead,
+    so that maxconn bounds concurrent use of a database.
+    """
+
+    def __init__(self, dsn: str, maxconn: int) -> None:
+        from psycopg2.pool import ThreadedConnectionPool
+
+        self._pool = ThreadedConnectionPool(1, maxconn, dsn)
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self) -> t.Any:
+        self._slots.acquire()
+        try:
+            return self._pool.getconn()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn: t.Any) -> None:
+        try:
+            self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    def closeall(self) -> None:
+        self._pool.closeall()
+
+
+class ServiceMetrics(trace.Tracer):
+    """Counts requests and collects trace spans for the /metrics endpoint."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests: t.Dict[t.Tuple[str, int], int] = collections.Counter()
+        self.request_seconds: t.Dict[str, float] = collections.defaultdict(float)
+        self.stage_seconds: t.Dict[str, float] = collections.defaultdict(float)
+        self.stage_count: t.Dict[str, int] = collections.Counter()
+        self.events: t.Dict[str, int] = collections.Counter()
+        self.tokens: t.Dict[str, int] = collections.Counter()
+
+    def on_end(self, span: trace.Span) -> None:
+        with self._lock:
+            self.stage_seconds[span.name] += span.duration or 0.0
+            self.stage_count[span.name] += 1
+            for kind in ("prompt", "completion"):
+                self.tokens[kind] += span.attributes.get(f"{kind}_tokens") or 0
+
+    def on_event(self, name: str, attributes: t.Dict[str, t.Any], span: t.Optional[trace.Span]) -> None:
+        with self._lock:
+            self.events[name] += 1
+
+    def record_request(self, path: str, status: int, seconds: float) -> None:
+        with self._lock:
+            self.requests[path, status] += 1
+            self.request_seconds[path] += seconds
+
+    def render(self, gauges: t.Dict[str, float]) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            lines.append("# TYPE pgtq_requests_total counter")
+            for (path, status), count in sorted(self.requests.items()):
+                lines.append(f'pgtq_requests_total{{path="{path}",status="{status}"}} {count}')
+            lines.append("# TYPE pgtq_request_seconds_total counter")
+            for path, seconds in sorted(self.request_seconds.items()):
+                lines.append(f'pgtq_request_seconds_total{{path="{path}"}} {seconds:.6f}')
+            lines.append("# TYPE pgtq_stage_seconds summary")
+            for stage, seconds in sorted(self.stage_seconds.items()):
+                lines.append(f'pgtq_stage_seconds_sum{{stage="{stage}"}} {seconds:.6f}')
+                lines.append(f'pgtq_stage_seconds_count{{stage="{stage}"}} {self.stage_count[stage]}')
+            lines.append("# TYPE pgtq_events_total counter")
+            for name, count in sorted(self.events.items()):
+                lines.append(f'pgtq_events_total{{event="{name}"}} {count}')
+            lines.append("# TYPE pgtq_tokens_total counter")
+            for kind, count in sorted(self.tokens.items()):
+                lines.append(f'pgtq_tokens_total{{kind="{kind}"}} {count}')
+        for name, value in sorted(gauges.items()):
+            lines.append(f"# TYPE pgtq_{name} gauge")
+            lines.append(f"pgtq_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _field(body: t.Dict[str, t.Any], name: str, kind: t.Union[type, t.Tuple[type, ...]], required: bool = True) -> t.Any:
+    value = body.get(name)
+    if value is None and not required:
+        return None
+    if isinstance(value, bool) or not isinstance(value, kind):
+        kinds = kind if isinstance(kind, tuple) else (kind,)
+        raise HTTPError(400, f"{name!r} must be a {' or '.join(k.__name__ for k in kinds)}")
+    return value
+
+
+class Service:
+    """The text-to-SQL ASGI application.
+
+    databases maps database names to DSNs and schemas maps database names to
+    fixed schemas (as returned by get_db_schema). generator defaults to one
+    using the package-wide transport and config. max_cost and max_rows are the
+    default cost thresholds reported by /explain and /generate with explain.
+    """
+
+    def __init__(
+        self,
+        databases: t.Optional[t.Mapping[str, str]] = None,
+        schemas: t.Optional[t.Mapping[str, InfoSchemaCache]] = None,
+        generator: t.Optional[QueryGenerator] = None,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        schema_ttl: float = DEFAULT_SCHEMA_TTL,
+        schema_cache_bytes: int = DEFAULT_SCHEMA_CACHE_BYTES,
+        skeleton_cache_entries: int = 0,
+        pool_maxconn: int = DEFAULT_POOL_MAXCONN,
+        max_cost: t.Optional[float] = None,
+        max_rows: t.Optional[int] = None,
+    ) -> None:
+        self.databases = dict(databases or {})
+        self.generator = generator or QueryGenerator()
+        self.max_concurrency = max_concurrency
+        self.max_pending = max(max_pending, max_concurrency)
+        self.schema_ttl = schema_ttl
+        self.pool_maxconn = pool_maxconn
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.metrics = ServiceMetrics()
+
+        self._fixed_schemas = dict(schemas or {})
+        self.schema_store = SchemaStore(
+            lambda database: self._fetch_schema(database), max_bytes=schema_cache_bytes, ttl=schema_ttl
+        )
+        self.skeletons = SkeletonCache(skeleton_cache_entries) if skeleton_cache_entries else None
+        self._schema_flight = AsyncSingleFlight()
+        self._generation_flight = AsyncSingleFlight()
+        self._generation_executor = ThreadPoolExecutor(max_concurrency, thread_name_prefix="pgtq-generate")
+        self._db_executor = ThreadPoolExecutor(
+            pool_maxconn * max(1, len(self.databases)), thread_name_prefix="pgtq-db"
+        )
+        self._pools: t.Dict[str, BlockingPool] = {}
+        self._pools_lock = threading.Lock()
+        self._semaphore: t.Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+        self._pending = 0
+        self._routes: t.Dict[str, t.Tuple[str, t.Callable[..., t.Awaitable[t.Any]]]] = {
+            "/generate": ("POST", self.generate),
+            "/validate": ("POST", self.validate),
+            "/explain": ("POST", self.explain),
+            "/health": ("GET", self.health),
+            "/metrics": ("GET", self.render_metrics),
+        }
+
+    # ASGI plumbing
+
+    async def __call__(self, scope: t.Dict[str, t.Any], receive: t.Callable, send: t.Callable) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        start = time.perf_counter()
+        path = scope["path"]
+        status = 500
+        try:
+            with trace.use_tracer(self.metrics):
+                status, body, headers = await self._handle(scope, receive)
+        except HTTPError as e:
+            status, body, headers = e.status, {"error": str(e)}, e.headers
+        finally:
+            self.metrics.record_request(path if path in self._routes else "other", status, time.perf_counter() - start)
+
+        if isinstance(body, str):
+            payload, content_type = body.encode(), "text/plain; version=0.0.4"
+        else:
+            payload, content_type = json.dumps(body).encode(), "application/json"
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", content_type.encode()),
+                (b"content-length", str(len(payload)).encode()),
+                *((name.encode(), value.encode()) for name, value in headers),
+            ],
+        })
+        await send({"type": "http.response.body", "body": payload})
+
+    async def _handle(self, scope: t.Dict[str, t.Any], receive: t.Callable) -> t.Tuple[int, t.Any, list]:
+        if scope["path"] not in self._routes:
+            raise HTTPError(404, "Not found")
+        method, handler = self._routes[scope["path"]]
+        if scope["method"] != method:
+            raise HTTPError(405, "Method not allowed", [("allow", method)])
+        if method == "GET":
+            return 200, await handler(), []
+        body = await self._read_json(receive)
+        try:
+            return 200, await handler(body), []
+        except QueryGenError as e:
+            raise HTTPError(422, str(e)) from e
+        except QueryExecError as e:
+            raise HTTPError(400, str(e)) from e
+        except Exception as e:
+            raise self._upstream_error(e) from e
+
+    @staticmethod
+    def _upstream_error(error: Exception) -> HTTPError:
+        if isinstance(error, HTTPError):
+            return error
+        import psycopg2
+        import openai.error
+
+        if isinstance(error, psycopg2.Error):
+            # A server-reported SQL error is the query's fault; others are ours
+            if error.pgcode:
+                return HTTPError(400, f"Database error: {error.pgerror or error}")
+            return HTTPError(503, "Database unavailable", [("retry-after", "1")])
+        if isinstance(error, openai.error.OpenAIError):
+            return HTTPError(502, f"Model error: {error}")
+        return HTTPError(500, "Internal error")
+
+    @staticmethod
+    async def _read_json(receive: t.Callable) -> t.Dict[str, t.Any]:
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise HTTPError(400, "Client disconnected")
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > MAX_BODY_BYTES:
+                raise HTTPError(413, "Request body too large")
+            chunks.append(chunk)
+            if not message.get("more_body"):
+                break
+        try:
+            body = json.loads(b"".join(chunks) or b"{}")
+        except ValueError as e:
+            raise HTTPError(400, f"Invalid JSON: {e}") from e
+        if not isinstance(body, dict):
+            raise HTTPError(400, "Request body must be a JSON object")
+        return body
+
+    async def _lifespan(self, receive: t.Callable, send: t.Callable) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def close(self) -> None:
+        """Close all connection pools and the generator."""
+        with self._pools_lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.closeall()
+        self._generation_executor.shutdown(wait=False)
+        self._db_executor.shutdown(wait=False)
+        self.generator.close()
+
+    # Resources
+
+    @staticmethod
+    async def _run(executor: ThreadPoolExecutor, fn: t.Callable[..., t.Any], *args: t.Any) -> t.Any:
+        """Run blocking fn on executor, in the current context."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, contextvars.copy_context().run, fn, *args)
+
+    def pool(self, database: str) -> BlockingPool:
+        """Return the connection pool for database, creating it on first use."""
+        if database not in self.databases:
+            raise HTTPError(404, f"Unknown database {database!r}")
+        with self._pools_lock:
+            if database not in self._pools:
+                self._pools[database] = BlockingPool(self.databases[database], self.pool_maxconn)
+            return self._pools[database]
+
+    def _fetch_schema(self, database: str) -> InfoSchemaCache:
+        with pooled_cursor(self.pool(database)) as cur:
+            return get_db_schema(cur, cur.connection.info.dbname)
+
+    async def schema(self, database: str) -> t.Union[InfoSchemaCache, SchemaFile]:
+        """Return database's schema, from the schema store if loaded within schema_ttl."""
+        if database in self._fixed_schemas:
+            return self._fixed_schemas[database]
+        if database not in self.databases:
+            raise HTTPError(404, f"Unknown database {database!r}")
+        schema = self.schema_store.lookup(database)
+        if schema is not None:
+            return schema
+        return await self._schema_flight.do(
+            database, functools.partial(self._run, self._db_executor, self._load_schema, database)
+        )
+
+    def _load_schema(self, database: str) -> SchemaFile:
+        schema = self.schema_store.load(database)
+        if self.skeletons is not None:
+            self.skeletons.invalidate_changed(schema, database)
+        return schema
+
+    @contextlib.asynccontextmanager
+    async def _admit(self) -> t.AsyncIterator[None]:
+        """Admit a generation, waiting for one of max_concurrency slots."""
+        if self._pending >= self.max_pending:
+            raise HTTPError(503, "Too many pending requests", [("retry-after", "1")])
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._pending += 1
+        try:
+            with trace.span("admission_wait"):
+                await self._semaphore.acquire()
+            self._in_flight += 1
+            try:
+                yield
+            finally:
+                self._in_flight -= 1
+                self._semaphore.release()
+        finally:
+            self._pending -= 1
+
+    # Endpoints
+
+    async def generate(self, body: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+        database = _field(body, "database", str)
+        question = _field(body, "question", str)
+        completion_type = body.get("completion_type")
+        if completion_type not in COMPLETION_TYPES:
+            raise HTTPError(400, f"'completion_type' must be one of {sorted(filter(None, COMPLETION_TYPES))}")
+        params = _field(body, "params", dict, required=False) or {}
+        if not set(params) <= ALLOWED_PARAMS:
+            raise HTTPError(400, f"'params' may only include {sorted(ALLOWED_PARAMS)}")
+
+        validate_sql = bool(body.get("validate"))
+        schema = await self.schema(database)
+        prompt = get_canonical_prompt(question, schema)
+
+        async def run() -> str:
+            async with self._admit():
+                return await self._run(self._generation_executor, functools.partial(
+                    self.generator.generate, prompt.prompt, validate_sql, completion_type, **params
+                ))
+
+        # Everything besides the question that the query depends on
+        namespace = json.dumps([database, completion_type, params], sort_keys=True)
+        query = self.skeletons.lookup(question, namespace) if self.skeletons is not None else None
+        if query is None:
+            key = (prompt.prompt, completion_type, validate_sql, json.dumps(params, sort_keys=True))
+            query = await self._generation_flight.do(key, run)
+            if self.skeletons is not None:
+                self.skeletons.store(question, query, namespace, schema, database)
+        result = {"query": query, "prefix_hash": prompt.prefix_hash}
+        if body.get("explain"):
+            result["cost"] = await self.explain({"database": database, "query": query})
+        return result
+
+    async def validate(self, body: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+        from pg_text_query.normalize import normalize_query
+
+        query = _field(body, "query", str)
+        valid = bool(is_valid_query(query))
+        return {"valid": valid, "normalized": normalize_query(query) if valid else None}
+
+    async def explain(self, body: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+        database = _field(body, "database", str)
+        query = _field(body, "query", str)
+        max_cost = _field(body, "max_cost", (int, float), required=False)
+        max_rows = _field(body, "max_rows", int, required=False)
+        pool = self.pool(database)
+
+        def check() -> t.Dict[str, t.Any]:
+            with pooled_cursor(pool) as cur:
+                return check_query_cost(
+                    cur,
+                    query,
+                    self.max_cost if max_cost is None else max_cost,
+                    self.max_rows if max_rows is None else max_rows,
+                    raise_on_exceed=False,
+                )
+
+        return await self._run(self._db_executor, check)
+
+    async def health(self) -> t.Dict[str, t.Any]:
+        return {"status": "ok", "in_flight": self._in_flight, "pending": self._pending}
+
+    async def render_metrics(self) -> str:
+        return self.metrics.render({
+            "in_flight": self._in_flight,
+            "pending": self._pending,
+            "connection_pools": len(self._pools),
+            "cached_schemas": len(self.schema_store),
+            "schema_cache_bytes": self.schema_store.stats().bytes,
+            "cached_skeletons": len(self.skeletons) if self.skeletons is not None else 0,
+        })
+
+
+def create_app() -> Service:
+    """Create a Service configured from the environment (see module docstring)."""
+    databases = json.loads(os.getenv("PGTQ_SERVICE_DATABASES", "{}"))
+    schemas = {}
+    for name, path in json.loads(os.getenv("PGTQ_SERVICE_SCHEMAS", "{}")).items():
+        with open(path) as f:
+            schemas[name] = json.load(f)
+
+    generator = None
+    if os.getenv("PGTQ_REPLAY_FILE"):
+        from pg_text_query.transport import ReplayTransport
+
+        generator = QueryGenerator(ReplayTransport(
+            os.environ["PGTQ_REPLAY_FILE"], latency=float(os.getenv("PGTQ_REPLAY_LATENCY", "0")),
+        ))
+
+    return Service(
+        databases,
+        schemas,
+        generator,
+        max_concurrency=int(os.getenv("PGTQ_SERVICE_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)),
+        max_pending=int(os.getenv("PGTQ_SERVICE_MAX_PENDING", DEFAULT_MAX_PENDING)),
+        schema_cache_bytes=int(os.getenv("PGTQ_SERVICE_SCHEMA_CACHE_BYTES", DEFAULT_SCHEMA_CACHE_BYTES)),
+        skeleton_cache_entries=int(os.getenv("PGTQ_SERVICE_SKELETON_CACHE_ENTRIES", 0)),
+    )
@@ -0,0 +1,145 @@
+"""Multi-turn query generation that reuses schema context across questions.
+
+A ChatSession describes the database schema once, in the system message, and
+keeps the conversation as compact question/query pairs, so follow-up and
+refinement questions ("now group that by island") are answered in context
+without restating the schema in every user message. The system message is
+rendered canonically (see get_canonical_prompt) and never changes during a
+session, so providers that cache prompt prefixes serve it from cache on every
+turn after the first. Older turns are dropped, leaving a one-line summary of
+their questions, to keep the history within a token budget.
+
+Example:
+    session = ChatSession(db_schema)
+    session.ask("how many penguins are on each island?")
+    session.ask("now only count female penguins")
+"""
+
+import threading
+import typing as t
+
+from pg_text_query import trace
+from pg_text_query.backends import DEFAULT_SYSTEM_PROMPT, Message
+from pg_text_query.gen_query import QueryGenerator
+from pg_text_query.prompt import describe_database
+from pg_text_query.ratelimit import CHARS_PER_TOKEN
+
+
+DEFAULT_MAX_HISTORY_TOKENS = 1000
+# Longest question quoted in the summary of dropped turns
+SUMMARY_QUESTION_CHARS = 200
+
+
+def _estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+class Turn(t.NamedTuple):
+    question: str
+    query: str
+
+
+class ChatSession:
+    """A conversation generating one query per question against one schema.
+
+    generator defaults to one using the package-wide transport and config;
+    requests use its chat model (completion_type="chat") unless another
+    completion_type is given, e.g. None for the generator's own backend.
+    system is the instruction preceding the schema description.
+
+    The history sent with each question holds the most recent turns fitting in
+    max_history_tokens (estimated like the rate limiter does), and always at
+    least the last turn, which refinement questions build on. With summarize,
+    the questions of dropped turns are listed, most recent first and within
+    what remains of the budget, in a message preceding the kept turns.
+
+    Sessions can be shared between threads; each question sees the turns
+    completed before it was asked.
+    """
+
+    def __init__(
+        self,
+        db_schema: t.Dict[t.Any, t.Any],
+        generator: t.Optional[QueryGenerator] = None,
+        system: str = DEFAULT_SYSTEM_PROMPT,
+        completion_type: t.Optional[str] = "chat",
+        max_history_tokens: int = DEFAULT_MAX_HISTORY_TOKENS,
+        summarize: bool = True,
+        include_types: bool = True,
+    ) -> None:
+        self.generator = generator or QueryGenerator()
+        self.completion_type = completion_type
+        self.max_history_tokens = max_history_tokens
+        self.summarize = summarize
+        self.system = "\n\n".join([
+            system,
+            "Use the following PostgreSQL database schema:",
+            describe_database(db_schema, include_types, canonical=True),
+        ])
+        self._turns: t.List[Turn] = []
+        self._lock = threading.Lock()
+
+    @property
+    def turns(self) -> t.List[Turn]:
+        with self._lock:
+            return list(self._turns)
+
+    def reset(self) -> None:
+        """Forget all turns, keeping the schema."""
+        with self._lock:
+            self._turns.clear()
+
+    def history(self) -> t.List[Message]:
+        """Return the messages sent with the next question."""
+        turns = self.turns
+        budget = self.max_history_tokens
+        kept: t.List[Turn] = []
+        for turn in reversed(turns):
+            cost = _estimate_tokens(turn.question) + _estimate_tokens(turn.query)
+            if kept and cost > budget:
+                break
+            kept.append(turn)
+            budget -= cost
+        kept.reverse()
+
+        messages: t.List[Message] = []
+        dropped = turns[: len(turns) - len(kept)]
+        if dropped and self.summarize:
+            prefix = "Earlier in this conversation I asked: "
+            acknowledgement = "Understood."
+            budget -= _estimate_tokens(prefix) + _estimate_tokens(acknowledgement)
+            questions: t.List[str] = []
+            for turn in reversed(dropped):
+                question = turn.question[:SUMMARY_QUESTION_CHARS]
+                cost = _estimate_tokens(question) + 1
+                if cost > budget:
+                    break
+                questions.append(question)
+                budget -= cost
+            if questions:
+                messages.append({"role": "user", "content": prefix + "; ".join(questions)})
+                messages.append({"role": "assistant", "content": acknowledgement})
+        for turn in kept:
+            messages.append({"role": "user", "content": turn.question})
+            messages.append({"role": "assistant", "content": turn.query})
+        return messages
+
+    def ask(self, question: str, validate_sql: bool = False, **kwargs: t.Any) -> str:
+        """Generate a query answering question in the context of earlier turns.
+
+        kwargs are parameter overrides, as for QueryGenerator.generate. The
+        turn is only added to the history if generation succeeds.
+        """
+        history = self.history()
+        with trace.span("session_turn", history_messages=len(history)):
+            query = self.generator.generate(
+                question,
+                validate_sql,
+                self.completion_type,
+                history=history,
+                task_prompt={"system": self.system},
+                **kwargs,
+            )
+        with self._lock:
+            self._turns.append(Turn(question, query))
+        return query
@@ -0,0 +1,97 @@
+"""Single-flight coalescing of identical concurrent calls.
+
+When many callers make the same call at once (e.g. a dashboard's users all
+asking the same question of the same schema), only the first caller for a key
+makes it; the others wait for it and receive its result, or its error. Once a
+call finishes its key is forgotten, so later calls run again: this shares
+in-flight work only and is not a cache.
+
+SingleFlight coalesces calls from threads, AsyncSingleFlight calls from tasks
+of one event loop. Each coalesced caller is reported as a "coalesced" trace
+event.
+"""
+
+import threading
+import typing as t
+
+from pg_text_query import trace
+
+if t.TYPE_CHECKING:
+    import asyncio
+
+
+T = t.TypeVar("T")
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: t.Any = None
+        self.error: t.Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Coalesces identical concurrent calls from threads."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: t.Dict[t.Hashable, _Call] = {}
+
+    def do(self, key: t.Hashable, fn: t.Callable[[], T]) -> T:
+        """Return fn(), sharing the call with concurrent callers with key."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            trace.event("coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class AsyncSingleFlight:
+    """Coalesces identical concurrent calls from tasks of one event loop.
+
+    The shared call runs as its own task, so cancelling any one caller
+    (including the first) does not cancel it for the others.
+    """
+
+    def __init__(self) -> None:
+        self._tasks: t.Dict[t.Hashable, "asyncio.Future"] = {}
+
+    def _forget(self, key: t.Hashable, task: "asyncio.Future") -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Mark the error retrieved, in case every caller was cancelled
+            task.exception()
+
+    async def do(self, key: t.Hashable, fn: t.Callable[[], t.Awaitable[T]]) -> T:
+        """Return await fn(), sharing the call with concurrent callers with key."""
+        import asyncio
+
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            trace.event("coalesced")
+        return await asyncio.shield(task)
@@ -0,0 +1,364 @@
+"""Reuse of generated queries for questions that differ only in literals.
+
+"orders in March" and "orders in April" need the same query but for one
+constant. SkeletonCache turns each generated query into a skeleton: the
+question's literals (quoted strings, ISO dates, numbers and month names) are
+replaced by typed slots to give its pattern ("orders in {month}"), and the
+query's constants that hold those literals become the skeleton's slots. A
+later question with the same pattern is answered by filling its literals
+into the skeleton, without calling the model.
+
+A query is only stored when every literal of the question appears as exactly
+one of its constants, unambiguously, so that changing a literal cannot leave
+a stale value behind. Constants that are not values compared with or
+returned, i.e. function arguments (substr(name, 1, 3)), type modifiers and
+GROUP BY or ORDER BY ordinals, are never slots. A filled query is only
+returned if it is valid (is_valid_query) and has the same pglast fingerprint,
+i.e. the same structure, as the query it was made from.
+
+Skeletons stored with the schema they were generated against are tracked in
+a DependencyIndex (see dependencies.py), and invalidate_changed drops only
+those using relations or columns that differ in a newer schema.
+
+Example:
+    skeletons = SkeletonCache()
+    query = skeletons.lookup(question, namespace=prefix_hash)
+    if query is None:
+        query = generator.generate(prompt, validate_sql=True)
+        skeletons.store(question, query, namespace=prefix_hash)
+"""
+
+import collections
+import re
+import threading
+import typing as t
+
+from pg_text_query import trace
+from pg_text_query.dependencies import DependencyIndex, SchemaObject
+
+if t.TYPE_CHECKING:
+    from pg_text_query.db_schema import InfoSchemaCache
+    from pg_text_query.schema_file import SchemaFile
+
+
+DEFAULT_MAX_ENTRIES = 1024
+
+MONTHS = [
+    "january", "february", "march", "april", "may", "june",
+    "july", "august", "september", "october", "november", "december",
+]
+
+_LITERAL_RE = re.compile(
+    r"""(?P<string>"[^"]*"|'[^']*')"""
+    r"|(?P<date>\b\d{4}-\d{2}-\d{2}\b)"
+    r"|(?P<number>\b\d+(?:\.\d+)?\b)"
+    # Capitalized only, so that e.g. "may" is not taken for a month
+    rf"|(?P<month>\b(?:{'|'.join(month.title() for month in MONTHS)})\b)"
+)
+
+
+class Literal(t.NamedTuple):
+    # One of string, date, number or month
+    kind: str
+    # The literal's value, without quotes
+    value: str
+
+
+class Slot(t.NamedTuple):
+    # Index of the question literal filled in
+    literal: int
+    # How the literal is written in the query: number, string, month_number, or month_name
+    form: str
+    # Character span of the constant in the query
+    start: int
+    end: int
+
+
+class Skeleton(t.NamedTuple):
+    query: str
+    fingerprint: str
+    slots: t.Tuple[Slot, ...]
+
+
+class SkeletonCacheStats(t.NamedTuple):
+    entries: int
+    hits: int
+    misses: int
+    stored: int
+    rejected: int
+    invalidated: int
+
+
+def question_pattern(question: str) -> t.Tuple[str, t.List[Literal]]:
+    """Return question with its literals replaced by {kind} slots, and the literals."""
+    literals: t.List[Literal] = []
+
+    def replace(match: "re.Match[str]") -> str:
+        kind = match.lastgroup
+        value = match.group()
+        if kind == "string":
+            value = value[1:-1]
+        literals.append(Literal(kind, value))
+        return f"{{{kind}}}"
+
+    pattern = _LITERAL_RE.sub(replace, question)
+    pattern = " ".join(pattern.lower().split()).rstrip("?.! ")
+    return pattern, literals
+
+
+def _constant_forms(literal: Literal) -> t.List[t.Tuple[str, str]]:
+    """Return the ways a query might write literal, as (form, value) pairs."""
+    if literal.kind == "number":
+        return [("number", literal.value)]
+    if literal.kind == "month":
+        return [("month_number", str(MONTHS.index(literal.value.lower()) + 1)), ("month_name", literal.value)]
+    return [("string", literal.value)]
+
+
+def _matches(form: str, text: str, token: str, value: str) -> bool:
+    if form == "number" or form == "month_number":
+        if token not in ("ICONST", "FCONST"):
+            return False
+        return float(text) == float(value)
+    if token != "SCONST" or not text.startswith("'"):
+        return False
+    constant = text[1:-1].replace("''", "'")
+    return constant.lower() == value.lower() if form == "month_name" else constant == value
+
+
+def _is_constant(node: t.Any) -> bool:
+    return isinstance(node, dict) and "A_Const" in node
+
+
+def _walk_constants(node: t.Any, slottable: bool, found: t.Set[int]) -> None:
+    """Add the byte offsets of the constants in a JSON parse tree node that may be slots to found."""
+    if isinstance(node, list):
+        for item in node:
+            _walk_constants(item, slottable, found)
+        return
+    if not isinstance(node, dict):
+        return
+    for name, fields in node.items():
+        if name == "A_Const":
+            if slottable and "location" in fields:
+                found.add(fields["location"])
+        elif name == "FuncCall":
+            for member, value in fields.items():
+                _walk_constants(value, slottable and member != "args", found)
+        elif name == "typmods":
+            _walk_constants(fields, False, found)
+        elif name == "SortBy":
+            for member, value in fields.items():
+                _walk_constants(value, slottable and not (member == "node" and _is_constant(value)), found)
+        elif name == "SelectStmt":
+            for member, value in fields.items():
+                if member == "groupClause":
+                    for item in value:
+                        _walk_constants(item, slottable and not _is_constant(item), found)
+                else:
+                    _walk_constants(value, slottable, found)
+        else:
+            _walk_constants(fields, slottable, found)
+
+
+def slottable_constants(query: str) -> t.Set[int]:
+    """Return the character offsets of query's constants that may be slots.
+
+    Function arguments, type modifiers and GROUP BY or ORDER BY ordinals are
+    left out: changing them changes what the query computes, not the values
+    it compares with or returns.
+    """
+    import json
+
+    from pglast.parser import parse_sql_json
+
+    found: t.Set[int] = set()
+    _walk_constants(json.loads(parse_sql_json(query)), True, found)
+    # The parser's locations are byte offsets; a negative number's is its sign's
+    encoded = query.encode()
+    offsets = set()
+    for offset in found:
+        offset = len(encoded[:offset].decode())
+        if query.startswith("-", offset):
+            offset += 1
+            while query[offset].isspace():
+                offset += 1
+        offsets.add(offset)
+    return offsets
+
+
+def make_skeleton(query: str, literals: t.Sequence[Literal]) -> t.Optional[Skeleton]:
+    """Return query's skeleton for a question with literals, or None if not parameterizable."""
+    from pglast.parser import ParseError, fingerprint, scan
+
+    try:
+        tokens = scan(query)
+        query_fingerprint = fingerprint(query)
+        slottable = slottable_constants(query)
+    except ParseError:
+        return None
+
+    slots: t.List[Slot] = []
+    matched = set()
+    for token in tokens:
+        if token.name not in ("ICONST", "FCONST", "SCONST") or token.start not in slottable:
+            continue
+        text = query[token.start:token.end + 1]
+        candidates = [
+            (index, form)
+            for index, literal in enumerate(literals)
+            for form, value in _constant_forms(literal)
+            if _matches(form, text, token.name, value)
+        ]
+        if len({index for index, _ in candidates}) > 1:
+            # The constant could stand for more than one literal
+            return None
+        if candidates:
+            index, form = candidates[0]
+            if index in matched:
+                # Changing the literal would change each constant alike, though
+                # they may mean different things (e.g. LIMIT 1 and "= 1")
+                return None
+            slots.append(Slot(index, form, token.start, token.end + 1))
+            matched.add(index)
+    if len(matched) != len(literals):
+        return None
+    return Skeleton(query, query_fingerprint, tuple(slots))
+
+
+def _render(form: str, literal: Literal, original: str) -> t.Optional[str]:
+    if form == "number":
+        return literal.value if literal.kind == "number" else None
+    if form == "month_number":
+        return str(MONTHS.index(literal.value.lower()) + 1) if literal.kind == "month" else None
+    value = literal.value
+    if form == "month_name":
+        if literal.kind != "month":
+            return None
+        # Keep the original constant's capitalization
+        original = original[1:-1]
+        value = value.upper() if original.isupper() else value.lower() if original.islower() else value.title()
+    return "'" + value.replace("'", "''") + "'"
+
+
+def fill_skeleton(skeleton: Skeleton, literals: t.Sequence[Literal]) -> t.Optional[str]:
+    """Return skeleton's query with literals filled in, or None if the result doesn't check out."""
+    from pglast.parser import ParseError, fingerprint
+
+    from pg_text_query.gen_query import is_valid_query
+
+    parts = []
+    position = 0
+    for slot in skeleton.slots:
+        rendered = _render(slot.form, literals[slot.literal], skeleton.query[slot.start:slot.end])
+        if rendered is None:
+            return None
+        parts.append(skeleton.query[position:slot.start])
+        parts.append(rendered)
+        position = slot.end
+    parts.append(skeleton.query[position:])
+    query = "".join(parts)
+
+    if not is_valid_query(query):
+        return None
+    try:
+        if fingerprint(query) != skeleton.fingerprint:
+            return None
+    except ParseError:
+        return None
+    return query
+
+
+class SkeletonCache:
+    """An LRU cache of query skeletons by (namespace, question pattern).
+
+    namespace separates queries that depend on more than the question, e.g.
+    the database (or a prompt prefix hash) and generation parameters.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._skeletons: "collections.OrderedDict[t.Tuple[str, str], Skeleton]" = collections.OrderedDict()
+        self._hits = self._misses = self._stored = self._rejected = self._invalidated = 0
+        self.dependencies = DependencyIndex()
+
+    def lookup(self, question: str, namespace: str = "") -> t.Optional[str]:
+        """Return the query for question from a stored skeleton, or None."""
+        pattern, literals = question_pattern(question)
+        with self._lock:
+            skeleton = self._skeletons.get((namespace, pattern))
+            if skeleton is not None:
+                self._skeletons.move_to_end((namespace, pattern))
+        query = fill_skeleton(skeleton, literals) if skeleton is not None else None
+        with self._lock:
+            if query is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        trace.event("cache_miss" if query is None else "cache_hit", cache="skeleton")
+        return query
+
+    def store(
+        self,
+        question: str,
+        query: str,
+        namespace: str = "",
+        db_schema: t.Optional[t.Union["InfoSchemaCache", "SchemaFile"]] = None,
+        database: t.Optional[str] = None,
+    ) -> bool:
+        """Store query's skeleton for question's pattern; return whether it could be stored.
+
+        If db_schema (the schema query was generated against) is given, the
+        skeleton is invalidated by invalidate_changed when an object it uses
+        changes. database identifies the schema's database if its name may
+        not (see DependencyIndex.add).
+        """
+        from pg_text_query.gen_query import is_valid_query
+
+        pattern, literals = question_pattern(question)
+        skeleton = make_skeleton(query, literals) if is_valid_query(query) else None
+        if skeleton is None:
+            with self._lock:
+                self._rejected += 1
+            return False
+
+        key = (namespace, pattern)
+        if db_schema is not None:
+            self.dependencies.add(key, query, db_schema, database)
+        else:
+            self.dependencies.discard(key)
+        with self._lock:
+            self._skeletons[key] = skeleton
+            self._skeletons.move_to_end(key)
+            self._stored += 1
+            while len(self._skeletons) > self.max_entries:
+                evicted, _ = self._skeletons.popitem(last=False)
+                self.dependencies.discard(evicted)
+        return True
+
+    def invalidate_changed(
+        self, db_schema: t.Union["InfoSchemaCache", "SchemaFile"], database: t.Optional[str] = None
+    ) -> int:
+        """Drop skeletons using objects that differ in db_schema; return how many."""
+        return self._drop(self.dependencies.check(db_schema, database))
+
+    def invalidate(self, objects: t.Iterable[SchemaObject]) -> int:
+        """Drop skeletons using any of objects; return how many."""
+        return self._drop(self.dependencies.invalidate(objects))
+
+    def _drop(self, keys: t.Set[t.Hashable]) -> int:
+        with self._lock:
+            dropped = sum(self._skeletons.pop(key, None) is not None for key in keys)
+            self._invalidated += dropped
+        return dropped
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._skeletons)
+
+    def stats(self) -> SkeletonCacheStats:
+        with self._lock:
+            return SkeletonCacheStats(
+                len(self._skeletons), self._hits, self._misses, self._stored, self._rejected, self._invalidated
+            )
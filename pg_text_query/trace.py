@@ -0,0 +1,283 @@
+"""Per-request timing and token usage tracing.
+
+The package times its main stages as spans and reports point events:
+
+    spans:  schema_fetch, prompt_render, schema_describe, generate,
+            queue_wait, request, validation
+    events: retry, cache_hit, cache_miss, coalesced, eviction
+
+Spans carry attributes such as the backend, token usage (prompt_tokens,
+completion_tokens, total_tokens) and provider response headers (request_id,
+processing_ms). Spans and events go to the package-wide tracer, set with
+set_tracer, and to any tracers installed for the current context with
+use_tracer. The default tracer discards everything, and while no tracer is
+installed spans cost about one function call.
+
+Example, collecting one request's trace:
+    with RequestTrace() as trace:
+        query = generate_query(prompt)
+    print(trace.usage, trace.durations())
+
+Or exporting everything to Prometheus or OpenTelemetry:
+    set_tracer(PrometheusTracer())
+"""
+
+import collections
+import contextlib
+import contextvars
+import threading
+import time
+import typing as t
+
+
+class Span:
+    """A timed stage of a request, reported to tracers when it ends."""
+
+    __slots__ = ("name", "attributes", "start", "end", "parent", "data")
+
+    def __init__(self, name: str, attributes: t.Dict[str, t.Any], parent: t.Optional["Span"]) -> None:
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.end: t.Optional[float] = None
+        # Per-tracer state, e.g. the exported span of an OpenTelemetryTracer
+        self.data: t.Dict[int, t.Any] = {}
+
+    @property
+    def duration(self) -> t.Optional[float]:
+        return None if self.end is None else self.end - self.start
+
+    def set(self, **attributes: t.Any) -> None:
+        self.attributes.update(attributes)
+
+
+class _NoopSpan:
+    """Stands in for a Span when no tracer is installed."""
+
+    __slots__ = ()
+
+    def set(self, **attributes: t.Any) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """Receives spans and events. This base class discards them."""
+
+    def on_start(self, span: Span) -> None:
+        """Called when span starts."""
+
+    def on_end(self, span: Span) -> None:
+        """Called when span ends, with its duration and final attributes."""
+
+    def on_event(self, name: str, attributes: t.Dict[str, t.Any], span: t.Optional[Span]) -> None:
+        """Called for an event, with the span current when it happened."""
+
+
+class RequestTrace(Tracer):
+    """Collects the spans and events of one request (or any block of code).
+
+    Used as a context manager, it installs itself with use_tracer for the
+    duration of the block. Ended spans and events are kept in order.
+    """
+
+    def __init__(self) -> None:
+        self.spans: t.List[Span] = []
+        self.events: t.List[t.Tuple[str, t.Dict[str, t.Any]]] = []
+        self._lock = threading.Lock()
+        self._installed: t.Optional[contextlib.ExitStack] = None
+
+    def on_end(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def on_event(self, name: str, attributes: t.Dict[str, t.Any], span: t.Optional[Span]) -> None:
+        with self._lock:
+            self.events.append((name, attributes))
+
+    def durations(self) -> t.Dict[str, float]:
+        """Return the total seconds spent per span name."""
+        totals: t.Dict[str, float] = collections.defaultdict(float)
+        for span in self.spans:
+            totals[span.name] += span.duration or 0.0
+        return dict(totals)
+
+    def count(self, event_name: str) -> int:
+        return sum(1 for name, _ in self.events if name == event_name)
+
+    @property
+    def usage(self) -> t.Dict[str, int]:
+        """Token usage summed over all request spans."""
+        totals: t.Dict[str, int] = collections.Counter()
+        for span in self.spans:
+            if span.name == "request":
+                for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                    totals[key] += span.attributes.get(key) or 0
+        return dict(totals)
+
+    def __enter__(self) -> "RequestTrace":
+        self._installed = contextlib.ExitStack()
+        self._installed.enter_context(use_tracer(self))
+        return self
+
+    def __exit__(self, *exc_info: t.Any) -> None:
+        if self._installed is not None:
+            self._installed.close()
+            self._installed = None
+
+
+class PrometheusTracer(Tracer):
+    """Exports span durations, token usage and event counts to Prometheus.
+
+    Metrics (with the default namespace):
+        pgtq_stage_seconds{stage}: histogram of span durations
+        pgtq_tokens_total{kind}: counter of prompt and completion tokens
+        pgtq_events_total{event}: counter of events
+
+    Requires the optional prometheus_client package.
+    """
+
+    def __init__(self, registry: t.Any = None, namespace: str = "pgtq") -> None:
+        import prometheus_client
+
+        kwargs = {"namespace": namespace}
+        if registry is not None:
+            kwargs["registry"] = registry
+        self.stage_seconds = prometheus_client.Histogram(
+            "stage_seconds", "Time spent per stage", ["stage"], **kwargs
+        )
+        self.tokens = prometheus_client.Counter("tokens", "Tokens used by generation requests", ["kind"], **kwargs)
+        self.events = prometheus_client.Counter("events", "Events such as retries and cache hits", ["event"], **kwargs)
+
+    def on_end(self, span: Span) -> None:
+        self.stage_seconds.labels(span.name).observe(span.duration or 0.0)
+        for kind in ("prompt", "completion"):
+            tokens = span.attributes.get(f"{kind}_tokens")
+            if tokens:
+                self.tokens.labels(kind).inc(tokens)
+
+    def on_event(self, name: str, attributes: t.Dict[str, t.Any], span: t.Optional[Span]) -> None:
+        self.events.labels(name).inc()
+
+
+class OpenTelemetryTracer(Tracer):
+    """Exports spans (nested as they ran) and events to OpenTelemetry.
+
+    tracer defaults to the global provider's tracer for this package. Span
+    attributes that are not str, bool, int or float are exported as strings.
+    Requires the optional opentelemetry-api package.
+    """
+
+    def __init__(self, tracer: t.Any = None) -> None:
+        from opentelemetry import trace as otel_trace
+
+        self._otel_trace = otel_trace
+        self._tracer = tracer or otel_trace.get_tracer("pg_text_query")
+
+    @staticmethod
+    def _attributes(attributes: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+        return {
+            key: value if isinstance(value, (str, bool, int, float)) else str(value)
+            for key, value in attributes.items()
+            if value is not None
+        }
+
+    def on_start(self, span: Span) -> None:
+        parent = span.parent.data.get(id(self)) if span.parent is not None else None
+        context = self._otel_trace.set_span_in_context(parent) if parent is not None else None
+        span.data[id(self)] = self._tracer.start_span(span.name, context=context)
+
+    def on_end(self, span: Span) -> None:
+        otel_span = span.data.pop(id(self), None)
+        if otel_span is not None:
+            otel_span.set_attributes(self._attributes(span.attributes))
+            otel_span.end()
+
+    def on_event(self, name: str, attributes: t.Dict[str, t.Any], span: t.Optional[Span]) -> None:
+        otel_span = span.data.get(id(self)) if span is not None else None
+        if otel_span is None:
+            otel_span = self._otel_trace.get_current_span()
+        otel_span.add_event(name, self._attributes(attributes))
+
+
+_NOOP_TRACER = Tracer()
+_tracer: Tracer = _NOOP_TRACER
+_context_tracers: contextvars.ContextVar[t.Tuple[Tracer, ...]] = contextvars.ContextVar(
+    "pgtq_context_tracers", default=()
+)
+_current_span: contextvars.ContextVar[t.Optional[Span]] = contextvars.ContextVar(
+    "pgtq_current_span", default=None
+)
+
+
+def get_tracer() -> Tracer:
+    """Return the package-wide tracer."""
+    return _tracer
+
+
+def set_tracer(tracer: t.Optional[Tracer]) -> None:
+    """Set the package-wide tracer (None restores the no-op default)."""
+    global _tracer
+    _tracer = tracer if tracer is not None else _NOOP_TRACER
+
+
+@contextlib.contextmanager
+def use_tracer(tracer: Tracer) -> t.Iterator[Tracer]:
+    """Also report spans and events in this context to tracer."""
+    token = _context_tracers.set(_context_tracers.get() + (tracer,))
+    try:
+        yield tracer
+    finally:
+        _context_tracers.reset(token)
+
+
+def _active_tracers() -> t.Tuple[Tracer, ...]:
+    tracers = _context_tracers.get()
+    return tracers if _tracer is _NOOP_TRACER else (_tracer,) + tracers
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes: t.Any) -> t.Iterator[t.Union[Span, _NoopSpan]]:
+    """Time the enclosed block as a span named name.
+
+    The span is ended (and reported) even if the block raises, with the
+    exception's type as its error attribute.
+    """
+    tracers = _active_tracers()
+    if not tracers:
+        yield _NOOP_SPAN
+        return
+    current = Span(name, attributes, _current_span.get())
+    for tracer in tracers:
+        tracer.on_start(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end = time.perf_counter()
+        for tracer in tracers:
+            tracer.on_end(current)
+
+
+def annotate(**attributes: t.Any) -> None:
+    """Set attributes on the current span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def event(name: str, **attributes: t.Any) -> None:
+    """Report an event (e.g. retry or cache_hit) within the current span."""
+    tracers = _active_tracers()
+    if not tracers:
+        return
+    current = _current_span.get()
+    for tracer in tracers:
+        tracer.on_event(name, attributes, current)
@@ -0,0 +1,425 @@
+"""Pluggable transports for sending completion requests.
+
+A transport takes an endpoint name ("completion" or "chat_completion") and the
+full request kwargs, and returns the response as a dict shaped like the OpenAI
+API response. OpenAITransport, the default, talks to the OpenAI REST API over a
+pooled keep-alive HTTP session. The module-level functions in gen_query.py
+send requests through the transport set with set_transport.
+
+RecordingTransport and ReplayTransport wrap this to capture request/response
+pairs to a compact JSON lines file and serve them back locally, e.g. to run the
+test_prompts suites or throughput benchmarks deterministically with no network.
+"""
+
+import abc
+import collections
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import typing as t
+import urllib.parse
+
+from pg_text_query import trace
+from pg_text_query.errors import EnvVarError, QueryGenError
+
+
+DEFAULT_API_BASE = "https://api.openai.com/v1"
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (5.0, 120.0)
+DEFAULT_POOL_MAXSIZE = 10
+ENDPOINT_PATHS = {"completion": "completions", "chat_completion": "chat/completions"}
+
+
+def response_text(endpoint: str, response: t.Dict[str, t.Any]) -> str:
+    """Return the generated text of the first choice in response."""
+    choice = response["choices"][0]
+    return choice["text"] if endpoint == "completion" else choice["message"]["content"]
+
+
+def _text_response(endpoint: str, text: str) -> t.Dict[str, t.Any]:
+    if endpoint == "completion":
+        return {"choices": [{"text": text, "index": 0}]}
+    return {"choices": [{"message": {"role": "assistant", "content": text}, "index": 0}]}
+
+
+class Transport(abc.ABC):
+    """Base class for objects that send completion requests.
+
+    Subclasses implement create; stream defaults to sending the request with
+    create.
+    """
+
+    @abc.abstractmethod
+    def create(self, endpoint: str, request: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+        """Send request to endpoint and return the response body."""
+
+    def stream(self, endpoint: str, request: t.Dict[str, t.Any]) -> t.Iterator[str]:
+        """Yield the generated text of the first choice in pieces as it arrives.
+
+        Closing the iterator early should stop the generation. The default
+        implementation sends the request with create and yields all of the text
+        at once.
+        """
+        yield response_text(endpoint, self.create(endpoint, request))
+
+    def close(self) -> None:
+        """Release any resources (e.g. pooled connections) held by the transport."""
+
+
+def _raise_for_status(response: t.Any) -> None:
+    """Raise the openai.error exception matching an unsuccessful response."""
+    import openai.error
+
+    if response.ok:
+        return
+    try:
+        json_body = response.json()
+        message = json_body["error"]["message"]
+    except (ValueError, KeyError, TypeError):
+        json_body = None
+        message = response.text
+    kwargs = {
+        "http_body": response.text,
+        "http_status": response.status_code,
+        "json_body": json_body,
+        "headers": response.headers,
+    }
+    status = response.status_code
+    if status in (400, 404, 415):
+        raise openai.error.InvalidRequestError(message, None, **kwargs)
+    elif status == 401:
+        raise openai.error.AuthenticationError(message, **kwargs)
+    elif status == 403:
+        raise openai.error.PermissionError(message, **kwargs)
+    elif status == 429:
+        raise openai.error.RateLimitError(message, **kwargs)
+    elif status == 503:
+        raise openai.error.ServiceUnavailableError(message, **kwargs)
+    raise openai.error.APIError(message, **kwargs)
+
+
+class OpenAITransport(Transport):
+    """Sends requests to the OpenAI REST API over a persistent HTTP session.
+
+    The transport owns a requests.Session whose connection pool keeps up to
+    pool_maxsize keep-alive connections open, so repeated requests (from any
+    number of threads) reuse TLS connections instead of handshaking each time.
+    Threads block for a free connection rather than opening extra ones.
+
+    api_key, api_base, organization, api_type and api_version default to the
+    openai module's settings (openai.api_key, openai.api_base and so on, which
+    it reads from OPENAI_API_KEY, OPENAI_API_BASE etc.), read once here. With
+    an api_type of "azure" or "azure_ad", requests are sent to the deployment
+    named by their engine (or deployment_id), as the openai package does.
+    timeout is a (connect, read) tuple or a single number of seconds. Errors
+    are raised as the corresponding openai.error exceptions, as the openai
+    package would.
+    """
+
+    def __init__(
+        self,
+        api_key: t.Optional[str] = None,
+        api_base: t.Optional[str] = None,
+        timeout: t.Union[float, t.Tuple[float, float]] = DEFAULT_TIMEOUT,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        max_connection_retries: int = 2,
+        organization: t.Optional[str] = None,
+        api_type: t.Optional[str] = None,
+        api_version: t.Optional[str] = None,
+    ) -> None:
+        import openai
+        import openai.util
+        import requests
+        import requests.adapters
+
+        if api_key is None:
+            if openai.api_key_path or openai.api_key is not None:
+                api_key = openai.util.default_api_key()
+            else:
+                api_key = os.getenv("OPENAI_API_KEY")
+        if api_key is None:
+            raise EnvVarError("OPENAI_API_KEY not found in environment")
+
+        self.api_base = (api_base or openai.api_base or DEFAULT_API_BASE).rstrip("/")
+        self.api_type = openai.util.ApiType.from_str(api_type or openai.api_type or "open_ai")
+        self.api_version = api_version or openai.api_version
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_maxsize,
+            max_retries=max_connection_retries,
+            pool_block=True,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if self.api_type == openai.util.ApiType.AZURE:
+            self.session.headers["api-key"] = api_key
+        else:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+        self.session.headers["Connection"] = "keep-alive"
+        organization = organization or openai.organization
+        if organization:
+            self.session.headers["OpenAI-Organization"] = organization
+
+    def url(self, endpoint: str, request: t.Dict[str, t.Any]) -> t.Tuple[str, t.Dict[str, t.Any]]:
+        """Return the URL to POST request to, and the request without its engine (or deployment_id)."""
+        import openai.error
+        import openai.util
+
+        if endpoint not in ENDPOINT_PATHS:
+            raise ValueError(f"Unknown endpoint {endpoint!r}, must be one of {tuple(ENDPOINT_PATHS)}")
+        request = dict(request)
+        deployment_id = request.pop("deployment_id", None)
+        engine = request.pop("engine", deployment_id)
+        path = ENDPOINT_PATHS[endpoint]
+        if self.api_type == openai.util.ApiType.OPEN_AI:
+            if engine is None:
+                return f"{self.api_base}/{path}", request
+            return f"{self.api_base}/engines/{urllib.parse.quote_plus(engine)}/{path}", request
+
+        if not self.api_version:
+            raise openai.error.InvalidRequestError("An API version is required for the Azure API type.", None)
+        if engine is None:
+            raise openai.error.InvalidRequestError(
+                "You must provide the deployment name in the 'engine' parameter to access the Azure OpenAI service",
+                "engine",
+            )
+        query = urllib.parse.urlencode({"api-version": self.api_version})
+        return f"{self.api_base}/openai/deployments/{urllib.parse.quote_plus(engine)}/{path}?{query}", request
+
+    def post(self, endpoint: str, request: t.Dict[str, t.Any], stream: bool = False) -> t.Any:
+        """POST request to endpoint and return the raw, status-checked response."""
+        import openai.error
+        import requests
+
+        url, request = self.url(endpoint, request)
+        try:
+            response = self.session.post(
+                url,
+                json=request,
+                timeout=self.timeout,
+                stream=stream,
+            )
+        except requests.exceptions.Timeout as e:
+            raise openai.error.Timeout(f"Request timed out: {e}") from e
+        except requests.exceptions.RequestException as e:
+            raise openai.error.APIConnectionError(f"Error communicating with OpenAI: {e}") from e
+        trace.annotate(
+            request_id=response.headers.get("x-request-id"),
+            processing_ms=response.headers.get("openai-processing-ms"),
+        )
+        _raise_for_status(response)
+        return response
+
+    def create(self, endpoint: str, request: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+        return self.post(endpoint, request).json()
+
+    def stream(self, endpoint: str, request: t.Dict[str, t.Any]) -> t.Iterator[str]:
+        """Yield text deltas from the API's server-sent event stream.
+
+        Closing the iterator early closes the HTTP response (and with it the
+        connection), which stops the generation server-side.
+        """
+        response = self.post(endpoint, {**request, "stream": True}, stream=True)
+        try:
+            for line in response.iter_lines():
+                if not line.startswith(b"data: "):
+                    continue
+                data = line[len(b"data: "):].strip()
+                if data == b"[DONE]":
+                    break
+                choice = json.loads(data)["choices"][0]
+                if endpoint == "completion":
+                    text = choice.get("text")
+                else:
+                    text = choice.get("delta", {}).get("content")
+                if text:
+                    yield text
+        finally:
+            response.close()
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def request_key(endpoint: str, request: t.Dict[str, t.Any]) -> str:
+    """Return a stable key identifying a request, independent of kwarg order."""
+    payload = json.dumps([endpoint, request], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _compact_response(response: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+    # Only the fields gen_query reads (plus usage, for accounting) are kept
+    compact = {"choices": [dict(choice) for choice in response["choices"]]}
+    if response.get("usage") is not None:
+        compact["usage"] = dict(response["usage"])
+    return json.loads(json.dumps(compact, default=dict))
+
+
+class RecordingTransport(Transport):
+    """Forwards requests to another transport and appends each exchange to path.
+
+    Each line of the file is a JSON object with the request key, endpoint and
+    compacted response. Requests are not stored verbatim, only their key, so
+    recordings stay small even with large schema prompts.
+    """
+
+    def __init__(self, path: str, transport: t.Optional[Transport] = None) -> None:
+        self.path = path
+        self.transport = transport or get_transport()
+        self._lock = threading.Lock()
+
+    def _record(self, endpoint: str, request: t.Dict[str, t.Any], response: t.Dict[str, t.Any]) -> None:
+        line = json.dumps(
+            {
+                "key": request_key(endpoint, request),
+                "endpoint": endpoint,
+                "response": _compact_response(response),
+            },
+            separators=(",", ":"),
+        )
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+
+    def create(self, endpoint: str, request: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+        response = self.transport.create(endpoint, request)
+        self._record(endpoint, request, response)
+        return response
+
+    def stream(self, endpoint: str, request: t.Dict[str, t.Any]) -> t.Iterator[str]:
+        """Stream from the wrapped transport, recording the assembled text.
+
+        Only streams consumed to the end are recorded, so a replayed request
+        never returns a truncated completion.
+        """
+        pieces = []
+        for piece in self.transport.stream(endpoint, request):
+            pieces.append(piece)
+            yield piece
+        self._record(endpoint, request, _text_response(endpoint, "".join(pieces)))
+
+
+class ReplayTransport(Transport):
+    """Serves responses previously captured by RecordingTransport.
+
+    latency (plus up to latency_jitter more) seconds of delay are injected per
+    request, and a fraction error_rate of requests raise a retryable OpenAI
+    error (RateLimitError or ServiceUnavailableError) instead of returning, so
+    retry and throughput behaviour can be exercised offline. seed makes the
+    injected jitter and errors reproducible.
+
+    Like the real API, requests_per_minute and tokens_per_minute limits (token
+    usage estimated with pg_text_query.ratelimit.estimate_tokens) can be
+    enforced over a sliding window of window_seconds; requests over either
+    limit raise RateLimitError.
+
+    Raises QueryGenError for a request that was never recorded.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        error_rate: float = 0.0,
+        seed: t.Optional[int] = None,
+        requests_per_minute: t.Optional[int] = None,
+        tokens_per_minute: t.Optional[int] = None,
+        window_seconds: float = 60.0,
+    ) -> None:
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window_seconds = window_seconds
+        # (timestamp, estimated tokens) of requests admitted within the window
+        self._window: t.Deque[t.Tuple[float, int]] = collections.deque()
+        self._responses: t.Dict[str, t.Dict[str, t.Any]] = {}
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._responses[entry["key"]] = entry["response"]
+
+    def _over_limit(self, request: t.Dict[str, t.Any]) -> bool:
+        if self.requests_per_minute is None and self.tokens_per_minute is None:
+            return False
+        from pg_text_query.ratelimit import estimate_tokens
+
+        tokens = estimate_tokens(request)
+        now = time.monotonic()
+        with self._lock:
+            while self._window and self._window[0][0] <= now - self.window_seconds:
+                self._window.popleft()
+            if self.requests_per_minute is not None and len(self._window) >= self.requests_per_minute:
+                return True
+            used = sum(used_tokens for _, used_tokens in self._window)
+            if self.tokens_per_minute is not None and used + tokens > self.tokens_per_minute:
+                return True
+            self._window.append((now, tokens))
+        return False
+
+    def create(self, endpoint: str, request: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+        if self._over_limit(request):
+            import openai.error
+
+            raise openai.error.RateLimitError("Replay rate limit exceeded", http_status=429)
+
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.latency_jitter)
+            fail = self._random.random() < self.error_rate
+            rate_limited = self._random.random() < 0.5
+        if delay:
+            time.sleep(delay)
+        if fail:
+            import openai.error
+
+            if rate_limited:
+                raise openai.error.RateLimitError("Injected replay error", http_status=429)
+            raise openai.error.ServiceUnavailableError("Injected replay error", http_status=503)
+
+        key = request_key(endpoint, request)
+        try:
+            return self._responses[key]
+        except KeyError:
+            raise QueryGenError(f"No recorded response for {endpoint} request {key}") from None
+
+    def stream(self, endpoint: str, request: t.Dict[str, t.Any]) -> t.Iterator[str]:
+        """Replay a recorded response as a stream of word-sized pieces."""
+        text = response_text(endpoint, self.create(endpoint, request))
+        for piece in re.findall(r"\S*\s*", text):
+            if piece:
+                yield piece
+
+
+_transport: t.Optional[Transport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> Transport:
+    """Return the default transport, creating an OpenAITransport on first use."""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = OpenAITransport()
+    return _transport
+
+
+def set_transport(transport: t.Optional[Transport]) -> None:
+    """Send subsequent default generation requests through transport.
+
+    Passing None resets to a fresh OpenAITransport on next use.
+    """
+    global _transport
+    with _transport_lock:
+        _transport = transport
@@ -4,6 +4,8 @@
 import os
 import sys
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import streamlit as st
 from dotenv import load_dotenv
@@ -17,8 +19,63 @@ dirname = os.path.dirname(__file__)
 sys.path.append(parent_dir)
 
 from pg_text_query.db_schema import get_db_schema
-from pg_text_query.gen_query import generate_query, generate_query_chat
+from pg_text_query.execute import iter_query_rows, pooled_cursor
+from pg_text_query.gen_query import QueryGenerator
 from pg_text_query.prompt import concat_prompt, describe_database
+from pg_text_query.result_cache import ResultCache
+
+
+@st.cache_resource
+def get_connection_pool(db_host, db_user, db_password, db_name):
+    """Return the connection pool for a set of credentials, created on first use.
+
+    Streamlit reruns the script on every interaction, so the pool is cached
+    across reruns (and sessions) rather than created per button click.
+    """
+    return create_connection_pool(db_host, db_user, db_password, db_name)
+
+
+@st.cache_resource
+def get_generator(openai_key):
+    """Return a generator (with pooled keep-alive connections) per API key."""
+    return QueryGenerator.from_openai(openai_key or None)
+
+
+@st.cache_resource
+def get_generation_executor():
+    """Return the thread pool running generations in the background."""
+    return ThreadPoolExecutor(max_workers=4)
+
+
+@st.cache_resource
+def get_result_cache():
+    """Return the cache of query results, kept until their tables change."""
+    return ResultCache(max_bytes=32 << 20, ttl=600)
+
+
+@st.cache_data(ttl=600, show_spinner="Fetching database schema...")
+def fetch_db_schema(db_host, db_user, db_password, db_name):
+    """Extract a database's schema as JSON, cached per credentials for 10 minutes."""
+    connection_pool = get_connection_pool(db_host, db_user, db_password, db_name)
+    with pooled_cursor(connection_pool) as curs:
+        return json.dumps(get_db_schema(curs, db_name), indent=2)
+
+
+@st.cache_data(max_entries=32)
+def render_schema(schema_json):
+    """Describe a schema (as edited in the app) for the prompt, cached per schema text."""
+    return describe_database(json.loads(schema_json))
+
+
+def generate_sql(generator, model_choice, prompt):
+    """Generate SQL for prompt; runs on the generation executor's threads.
+
+    Takes the generator itself rather than resolving get_generator here, as
+    cached resources must be resolved in the script thread.
+    """
+    if model_choice == "Codex":
+        return generator.generate(prompt, completion_type="single")
+    return generator.generate_chat(prompt, system=None)
 
 
 def main():
@@ -79,15 +136,16 @@ We recommend saving these values as environment variables. Fill out the `env_tem
         os.environ["OPENAI_API_KEY"] = openai_key
 
         if st.button("**Test Connection**"):
-            connection_pool = create_connection_pool(
-                db_host, db_user, db_password, db_name
-            )
+            try:
+                connection_pool = get_connection_pool(
+                    db_host, db_user, db_password, db_name
+                )
+            except Exception:
+                connection_pool = None
             if connection_pool:
                 try:
-                    connection = connection_pool.getconn()
-                    cursor = connection.cursor()
-                    cursor.execute("SELECT 1")
-                    connection_pool.putconn(connection)
+                    with pooled_cursor(connection_pool) as cursor:
+                        cursor.execute("SELECT 1")
                     st.success("Connection successful!")
                 except Exception as e:
                     st.error(f"Error while trying to establish connection: {e}")
@@ -95,7 +153,6 @@ We recommend saving these values as environment variables. Fill out the `env_tem
                 st.error(
                     "Connection failed. Please check your credentials and try again."
                 )
-            connection_pool.close()
 
     with tab2:
 
@@ -137,12 +194,10 @@ included in the prompt. Click the "Get Database Schema" button to get schema
         if include_schema:
 
             if st.button("Get Database Schema"):
-                connection_pool = create_connection_pool(
+                # Update test_schema value
+                st.session_state["test_schema"] = fetch_db_schema(
                     db_host, db_user, db_password, db_name
                 )
-                curs = connection_pool.getconn().cursor()
-                schema_from_db = get_db_schema(curs, db_name)
-                st.session_state["test_schema"] = json.dumps(schema_from_db, indent=2)  # Update test_schema value
             elif not st.session_state.get("test_schema"):
                 with open(os.path.join(dirname, "example_schema.json"), "r") as f:
                     example_schema = json.load(f)
@@ -175,7 +230,7 @@ included in the prompt. Click the "Get Database Schema" button to get schema
 
         combined_prompt = init_prompt.replace("{user_input}", plain_text)
         prompt_schema = (
-            describe_database(json.loads(st.session_state.get("test_schema")))
+            render_schema(st.session_state.get("test_schema"))
             if include_schema
             else ""
         )
@@ -191,25 +246,46 @@ included in the prompt. Click the "Get Database Schema" button to get schema
 
 
         if st.button("Generate SQL"):
-            if st.session_state["model_choice"] == "Codex":
-                st.session_state["sql"] = generate_query(prompt_to_send)
-            elif st.session_state["model_choice"] == "ChatGPT":
-                st.session_state["sql"] = generate_query_chat(prompt_to_send,
-                                                              system=None)
+            # Generate in the background, so the app stays interactive meanwhile
+            generator = get_generator(openai_key)
+            st.session_state["generation"] = get_generation_executor().submit(
+                generate_sql, generator, st.session_state["model_choice"], prompt_to_send
+            )
+        generation = st.session_state.get("generation")
+        if generation is not None and generation.done():
+            st.session_state["generation"] = None
+            try:
+                st.session_state["sql"] = generation.result()
+            except Exception as e:
+                st.error(f"Error while generating SQL: {e}")
+        elif generation is not None:
+            st.info("Generating SQL...")
         st.code(st.session_state["sql"], language="sql")
 
         if st.button("Run SQL"):
             # connect to the database using the provided credentials
             # and execute the generated SQL code
-            connection_pool = create_connection_pool(
+            connection_pool = get_connection_pool(
                 db_host, db_user, db_password, db_name
             )
 
             if connection_pool:
                 connection = connection_pool.getconn()
-                cursor = connection.cursor()
-                cursor.execute(st.session_state["sql"])
-                st.code(cursor.fetchmany(50))
+                try:
+                    rows = list(
+                        iter_query_rows(
+                            connection, st.session_state["sql"], max_rows=50, cache=get_result_cache()
+                        )
+                    )
+                finally:
+                    connection.rollback()
+                    connection_pool.putconn(connection)
+                st.code(rows)
+
+    if st.session_state.get("generation") is not None:
+        # Poll for the result; any interaction meanwhile reruns the app at once
+        time.sleep(0.25)
+        st.rerun()
 
 
 if __name__ == "__main__":
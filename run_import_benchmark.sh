@@ -0,0 +1,3 @@
+#!/bin/bash
+set -exu -o pipefail
+python -c "from test import benchmark_imports; benchmark_imports.main()"
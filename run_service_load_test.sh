@@ -0,0 +1,3 @@
+#!/bin/bash
+set -exu -o pipefail
+python -m test.load_test_service "$@"
@@ -0,0 +1,51 @@
+"""Measures cold import time of pg_text_query entry points.
+
+Each statement is timed in fresh interpreter processes, so nothing is cached
+in sys.modules between runs, and the median wall time is reported alongside
+which heavy third-party modules the statement pulled in.
+"""
+import json
+import statistics
+import subprocess
+import sys
+import typing as t
+
+
+RUNS = 15
+HEAVY_MODULES = ["openai", "yaml", "pglast", "psycopg2"]
+STATEMENTS = [
+    "import pg_text_query",
+    "from pg_text_query import get_default_prompt",
+    "from pg_text_query import get_db_schema",
+    "from pg_text_query import generate_query",
+    "from pg_text_query import get_config; get_config().completion",
+]
+
+_TIMER = """
+import json, sys, time
+start = time.perf_counter()
+exec({statement!r})
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, [m for m in {heavy!r} if m in sys.modules]]))
+"""
+
+
+def time_statement(statement: str, runs: int = RUNS) -> t.Tuple[float, t.List[str]]:
+    timings = []
+    loaded: t.List[str] = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", _TIMER.format(statement=statement, heavy=HEAVY_MODULES)],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        elapsed, loaded = json.loads(out)
+        timings.append(elapsed)
+    return statistics.median(timings), loaded
+
+
+def main() -> None:
+    for statement in STATEMENTS:
+        median, loaded = time_statement(statement)
+        print(f"{median * 1000:8.1f} ms  {statement}  (loaded: {', '.join(loaded) or 'none'})")
@@ -0,0 +1,102 @@
+"""Load tests pg_text_query.service in-process against a stub model.
+
+Requests are sent straight to the ASGI app (no HTTP server or network), so
+the numbers reflect the service itself: admission, schema caching, prompt
+rendering, coalescing and, with --dsn, connection pooling and EXPLAIN against
+a local Postgres. The stub model answers every prompt after --latency seconds.
+
+Example:
+    python -m test.load_test_service --requests 2000 --concurrency 200 --distinct 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import typing as t
+
+from pg_text_query.gen_query import QueryGenerator
+from pg_text_query.service import Service
+
+from test.test_logic.stub_backend import StubBackend
+
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "test_prompts", "test_schemas", "penguin_schema.json")
+
+
+async def _request(app: Service, path: str, body: dict) -> int:
+    payload = json.dumps(body).encode()
+    status = 0
+
+    async def receive() -> dict:
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    async def send(message: dict) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app({"type": "http", "method": "POST", "path": path, "headers": []}, receive, send)
+    return status
+
+
+async def run(app: Service, requests: int, concurrency: int, distinct: int, explain: bool) -> None:
+    latencies: t.List[float] = []
+    statuses: t.Dict[int, int] = {}
+    queue: "asyncio.Queue[int]" = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+
+    async def worker() -> None:
+        while not queue.empty():
+            i = queue.get_nowait()
+            body = {"database": "penguins", "question": f"question {i % distinct}", "explain": explain}
+            start = time.perf_counter()
+            status = await _request(app, "/generate", body)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"{requests} requests in {elapsed:.2f}s: {requests / elapsed:.1f} req/s")
+    print(f"latency p50 {statistics.median(latencies) * 1000:.1f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms")
+    print(f"statuses: {statuses}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100, help="concurrent clients")
+    parser.add_argument("--distinct", type=int, default=100, help="distinct questions asked")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub model latency in seconds")
+    parser.add_argument("--max-concurrency", type=int, default=16, help="the service's generation slots")
+    parser.add_argument("--max-pending", type=int, default=1000, help="the service's admission limit")
+    parser.add_argument("--dsn", default=os.getenv("PGTQ_TEST_DSN"),
+                        help="a local Postgres to fetch the schema from and EXPLAIN against")
+    args = parser.parse_args()
+
+    backend = StubBackend("SELECT species, COUNT(*) FROM penguins GROUP BY species", args.latency)
+    kwargs: t.Dict[str, t.Any] = {"databases": {"penguins": args.dsn}} if args.dsn else {}
+    if not args.dsn:
+        with open(SCHEMA_PATH) as f:
+            kwargs["schemas"] = {"penguins": json.load(f)}
+    app = Service(
+        generator=QueryGenerator(backend=backend),
+        max_concurrency=args.max_concurrency,
+        max_pending=args.max_pending,
+        **kwargs,
+    )
+    try:
+        asyncio.run(run(app, args.requests, args.concurrency, args.distinct, explain=bool(args.dsn)))
+    finally:
+        app.close()
+    print(f"model calls: {backend.calls}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import threading
+import time
+import typing as t
+
+from pg_text_query.backends import Backend, Completion
+
+
+class StubBackend(Backend):
+    """Answers every prompt with the same query after latency seconds."""
+
+    name = "stub"
+
+    def __init__(self, query: str = "SELECT COUNT(*) FROM penguins", latency: float = 0.0) -> None:
+        self.query = query
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def build_request(self, prompt: str, system: t.Optional[str] = None, history: t.Sequence = (),
+                      **overrides: t.Any) -> t.Dict[str, t.Any]:
+        return {"prompt": prompt, **overrides}
+
+    def complete(self, request: t.Dict[str, t.Any]) -> Completion:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return {"text": self.query, "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}}
@@ -0,0 +1,127 @@
+import sys
+import types
+import typing as t
+import unittest
+from unittest.mock import Mock, patch
+
+from pg_text_query import backends
+from pg_text_query.backends import Backend, LlamaCppBackend, OpenAIChatBackend, OpenAICompletionBackend
+from pg_text_query.config import Config
+from pg_text_query.errors import QueryGenError
+from pg_text_query.gen_query import QueryGenerator
+from pg_text_query.transport import Transport
+
+
+class FakeLlama:
+    instances = 0
+
+    def __init__(self, model_path: str, **kwargs: object) -> None:
+        FakeLlama.instances += 1
+        self.model_path = model_path
+        self.kwargs = kwargs
+        self.create_completion = Mock()
+
+
+class LlamaCppBackendTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        FakeLlama.instances = 0
+        module = types.ModuleType("llama_cpp")
+        module.Llama = FakeLlama
+        patcher = patch.dict(sys.modules, {"llama_cpp": module})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(backends._llama_models.clear)
+
+    def test_model_is_loaded_once(self) -> None:
+        first = LlamaCppBackend("/models/sql.gguf", n_threads=4)
+        second = LlamaCppBackend("/models/sql.gguf", n_threads=4)
+        self.assertIs(first.load()[0], second.load()[0])
+        self.assertEqual(FakeLlama.instances, 1)
+        self.assertEqual(first.load()[0].kwargs, {"verbose": False, "n_threads": 4})
+
+        LlamaCppBackend("/models/sql.gguf", n_threads=8).load()
+        self.assertEqual(FakeLlama.instances, 2)
+
+    def test_generate_extracts_sql(self) -> None:
+        generator = QueryGenerator.from_local("/models/sql.gguf", params={"max_tokens": 50})
+        model, _ = generator.backend().load()
+        model.create_completion.return_value = {
+            "choices": [{"text": " SELECT COUNT(*) FROM penguins;\n-- counts penguins"}],
+            "usage": {"total_tokens": 30},
+        }
+
+        query = generator.generate("-- how many penguins?", validate_sql=True, task_prompt={"system": "Write SQL."})
+
+        self.assertEqual(query, "SELECT COUNT(*) FROM penguins")
+        model.create_completion.assert_called_once_with(
+            prompt="Write SQL.\n\n-- how many penguins?", max_tokens=50, temperature=0.0, stop=[";"]
+        )
+
+    def test_stream(self) -> None:
+        backend = LlamaCppBackend("/models/sql.gguf")
+        model, _ = backend.load()
+        chunks = iter([{"choices": [{"text": "SELECT"}]}, {"choices": [{"text": ""}]}, {"choices": [{"text": " 1"}]}])
+        model.create_completion.return_value = Mock(__iter__=lambda self: chunks)
+
+        pieces = list(QueryGenerator(backend=backend).stream("p"))
+
+        self.assertEqual(pieces, ["SELECT", " 1"])
+        self.assertTrue(model.create_completion.call_args.kwargs["stream"])
+        model.create_completion.return_value.close.assert_called_once()
+
+    def test_requires_llama_cpp(self) -> None:
+        with patch.dict(sys.modules, {"llama_cpp": None}):
+            with self.assertRaises(ImportError):
+                LlamaCppBackend("/models/missing.gguf").load()
+
+
+class OpenAIBackendTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.config = Config()
+        self.config._completion = {"model": "code-model", "stop": [";"]}
+        self.config._chat = {"model": "chat-model"}
+        self.transport = Mock(spec=Transport)
+
+    def test_requests_and_keys(self) -> None:
+        completion = OpenAICompletionBackend(self.transport, self.config)
+        chat = OpenAIChatBackend(self.transport, self.config)
+
+        request = completion.build_request("-- p", temperature=0.5)
+        self.assertEqual(request, {"prompt": "-- p", "model": "code-model", "stop": [";"], "temperature": 0.5})
+        self.assertEqual(completion.build_request("-- p", system="-- schema")["prompt"], "-- schema\n\n-- p")
+        chat_request = chat.build_request("p", system="be terse")
+        self.assertEqual(chat_request["messages"][0], {"role": "system", "content": "be terse"})
+        self.assertEqual(chat_request["model"], "chat-model")
+
+        self.assertEqual(completion.request_key(request), completion.request_key(dict(request)))
+        self.assertNotEqual(completion.request_key(request), chat.request_key(request))
+
+    def test_incomplete_backends_and_transports_fail_on_creation(self) -> None:
+        class NoComplete(Backend):
+            def build_request(self, prompt: str, system: t.Optional[str] = None, history: t.Sequence = (),
+                              **overrides: t.Any) -> t.Dict[str, t.Any]:
+                return {"prompt": prompt}
+
+        class NoCreate(Transport):
+            pass
+
+        with self.assertRaises(TypeError):
+            NoComplete()
+        with self.assertRaises(TypeError):
+            NoCreate()
+
+    def test_generator_backend_selection(self) -> None:
+        local = Mock(spec=Backend, extract_sql=False)
+        local.build_request.return_value = {"prompt": "p"}
+        local.complete.return_value = {"text": "-- nothing", "usage": None}
+        generator = QueryGenerator(self.transport, self.config, backend=local)
+
+        with self.assertRaises(QueryGenError):
+            generator.generate("p", validate_sql=True)
+        self.transport.create.assert_not_called()
+
+        self.transport.create.return_value = {"choices": [{"text": "SELECT 1"}]}
+        self.assertEqual(generator.generate("p", completion_type="single"), "SELECT 1")
+        self.assertEqual(self.transport.create.call_args.args[0], "completion")
+        with self.assertRaises(ValueError):
+            generator.backend("unknown")
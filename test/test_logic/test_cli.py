@@ -0,0 +1,126 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import typing as t
+import unittest
+from unittest.mock import patch
+
+from pg_text_query import __main__ as cli
+from pg_text_query.backends import Backend, Completion
+from pg_text_query.gen_query import QueryGenerator
+
+from test_prompt import test_db_schema
+
+
+class EchoBackend(Backend):
+    """Answers with a query naming the question, slower for earlier questions."""
+
+    name = "echo"
+
+    def __init__(self, fail_on: t.Optional[str] = None) -> None:
+        self.fail_on = fail_on
+        self.max_in_flight = self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def build_request(self, prompt: str, system: t.Optional[str] = None, history: t.Sequence = (),
+                      **overrides: t.Any) -> t.Dict[str, t.Any]:
+        return {"prompt": prompt}
+
+    def complete(self, request: t.Dict[str, t.Any]) -> Completion:
+        question = request["prompt"].splitlines()[-2].rsplit("for ", 1)[-1]
+        with self._lock:
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        try:
+            time.sleep(0.01 * (10 - int(question.split()[-1])) / 10)
+            if question == self.fail_on:
+                raise ValueError("model unavailable")
+            return {"text": f"SELECT '{question}'", "usage": None}
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+
+class BulkCLITestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.schema_path = self._path("schema.json")
+        with open(self.schema_path, "w") as f:
+            json.dump(test_db_schema, f)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.tmp.name, name)
+
+    def _main(self, backend: Backend, *argv: str) -> None:
+        with patch.object(cli, "make_generator", return_value=QueryGenerator(backend=backend)), \
+                patch("sys.stderr", io.StringIO()):
+            cli.main(["--schema-file", self.schema_path, *argv])
+
+    def _read_output(self, path: str) -> t.List[dict]:
+        with open(path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_csv_in_order_with_bounded_concurrency(self) -> None:
+        input_path, output_path = self._path("questions.csv"), self._path("out.jsonl")
+        with open(input_path, "w") as f:
+            f.write("question\n" + "".join(f"question {i}\n" for i in range(10)))
+        backend = EchoBackend(fail_on="question 3")
+
+        self._main(backend, input_path, "--output", output_path, "--concurrency", "2")
+
+        results = self._read_output(output_path)
+        self.assertEqual([r["id"] for r in results], list(range(10)))
+        self.assertEqual(results[0], {
+            "id": 0, "question": "question 0", "query": "SELECT 'question 0'", "valid": True, "error": None,
+        })
+        self.assertEqual(results[3]["error"], "ValueError: model unavailable")
+        self.assertFalse(results[3]["valid"])
+        self.assertLessEqual(backend.max_in_flight, 2)
+
+    def test_resumes_from_checkpoint(self) -> None:
+        input_path, output_path = self._path("questions.jsonl"), self._path("out.jsonl")
+        checkpoint_path = self._path("out.ckpt")
+        with open(input_path, "w") as f:
+            f.writelines(json.dumps({"id": f"q{i}", "question": f"question {i}"}) + "\n" for i in range(10))
+
+        # An interrupted run: four records checkpointed, plus a partly written fifth
+        with open(output_path, "w") as f:
+            for i in range(4):
+                f.write(json.dumps({"id": f"q{i}", "resumed": False}) + "\n")
+            size = f.tell()
+            f.write('{"id": "q4", "qu')
+        cli.write_checkpoint(checkpoint_path, cli.Checkpoint(4, size))
+
+        self._main(EchoBackend(), input_path, "--output", output_path, "--checkpoint", checkpoint_path,
+                   "--checkpoint-every", "3")
+
+        results = self._read_output(output_path)
+        self.assertEqual([r["id"] for r in results], [f"q{i}" for i in range(10)])
+        self.assertEqual(results[4]["query"], "SELECT 'question 4'")
+        self.assertEqual(cli.read_checkpoint(checkpoint_path), cli.Checkpoint(10, os.path.getsize(output_path)))
+
+    def test_invalid_jsonl_lines_get_error_results(self) -> None:
+        input_path, output_path = self._path("questions.jsonl"), self._path("out.jsonl")
+        with open(input_path, "w") as f:
+            f.write(json.dumps({"id": "q1", "question": "question 1"}) + "\n")
+            f.write('{"id": "q2", "question": \n')
+            f.write('"question 3"\n[1]\n')
+            f.write(json.dumps({"id": "q5", "question": "question 5"}) + "\n")
+
+        self._main(EchoBackend(), input_path, "--output", output_path)
+
+        results = self._read_output(output_path)
+        self.assertEqual([r["id"] for r in results], ["q1", 1, 2, 3, "q5"])
+        self.assertEqual(results[4]["query"], "SELECT 'question 5'")
+        self.assertTrue(results[1]["error"].startswith("Invalid JSON: "))
+        self.assertEqual(results[2]["error"], "Record is not a JSON object")
+        self.assertEqual(results[3]["error"], "Record is not a JSON object")
+        self.assertFalse(any(r["valid"] for r in results[1:4]))
+
+    def test_checkpoint_requires_output_file(self) -> None:
+        with self.assertRaises(SystemExit), patch("sys.stderr", io.StringIO()):
+            cli.parse_args(["--schema-file", self.schema_path, "--checkpoint", self._path("ckpt")])
@@ -0,0 +1,265 @@
+import copy
+import os
+import typing as t
+import unittest
+from unittest.mock import MagicMock
+
+from pg_text_query.db_schema import (
+    GET_DB_SCHEMA_SQL,
+    GET_RELATIONS_SQL,
+    GET_SCHEMA_DESCRIPTIONS_SQL,
+    GET_SCHEMA_MARKERS_SQL,
+    RelationMarker,
+    SchemaFilter,
+    SchemaSnapshot,
+    db_schema_sql,
+    get_db_schema,
+    get_db_schema_snapshot,
+    refresh_db_schema,
+    schema_markers_sql,
+)
+
+
+TEST_DSN = os.getenv("PGTQ_TEST_DSN")
+
+RELATION_COLUMNS = [
+    "description", "name", "schemata.name", "schemata.tables.name", "schemata.tables.type",
+    "schemata.tables.columns.name", "schemata.tables.columns.ordinal_position",
+    "schemata.tables.columns.column_default", "schemata.tables.columns.is_nullable",
+    "schemata.tables.columns.data_type", "schemata.tables.columns.character_maximum_length",
+    "schemata.description", "schemata.tables.description", "schemata.tables.columns.description",
+]
+
+
+class Column(t.NamedTuple):
+    name: str
+
+
+class FakeCursor:
+    """Answers the refresh queries from canned markers, descriptions and relation rows."""
+
+    def __init__(self, markers: list, descriptions: list, relation_rows: list) -> None:
+        self.results = {
+            GET_SCHEMA_MARKERS_SQL: markers,
+            GET_SCHEMA_DESCRIPTIONS_SQL: descriptions,
+            GET_RELATIONS_SQL: relation_rows,
+        }
+        self.executed: t.List[tuple] = []
+        self.description: t.Optional[list] = None
+
+    def execute(self, sql: str, params: tuple = ()) -> None:
+        self.executed.append((sql, params))
+        self.description = [Column(name) for name in RELATION_COLUMNS] if sql == GET_RELATIONS_SQL else None
+        self._rows = self.results[sql]
+
+    def fetchall(self) -> list:
+        return self._rows
+
+
+def column(name: str, position: int = 1) -> dict:
+    return {
+        "name": name, "ordinal_position": position, "column_default": None, "is_nullable": "YES",
+        "data_type": "integer", "character_maximum_length": None, "description": None,
+    }
+
+
+def relation_row(schema: str, rel: str, col: str, rel_type: str = "BASE TABLE") -> tuple:
+    return ("db comment", "shop", schema, rel, rel_type, col, 1, None, "YES", "integer", None, None, None, None)
+
+
+def marker(xmin: int, digest: str = "d") -> RelationMarker:
+    return RelationMarker(xmin, xmin, 1, digest)
+
+
+class RefreshDBSchemaTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        schema = {
+            "name": "shop",
+            "description": "db comment",
+            "schemata": [
+                {"name": "archive", "description": None, "is_foreign": False, "views": [],
+                 "tables": [{"name": "old", "description": None, "columns": [column("id")]}]},
+                {"name": "public", "description": None, "is_foreign": False,
+                 "tables": [
+                     {"name": "a", "description": None, "columns": [column("id")]},
+                     {"name": "c", "description": None, "columns": [column("id")]},
+                 ],
+                 "views": [{"name": "v", "description": None, "columns": [column("id")]}]},
+            ],
+        }
+        markers = {
+            ("archive", None): marker(1),
+            ("archive", "old"): marker(2),
+            ("public", None): marker(3),
+            ("public", "a"): marker(4),
+            ("public", "c"): marker(5),
+            ("public", "v"): marker(6),
+        }
+        self.snapshot = SchemaSnapshot(schema, markers)
+
+    def test_patches_only_changed_relations(self) -> None:
+        original = copy.deepcopy(self.snapshot.schema)
+        new_markers = [
+            ("public", None, *marker(3, "commented")),
+            ("public", "a", *marker(10)),
+            ("public", "b", *marker(11)),
+            ("public", "c", *marker(5)),
+            ("public", "v", *marker(6)),
+            ("sales", None, *marker(12)),
+            ("sales", "orders", *marker(13)),
+        ]
+        cur = FakeCursor(
+            new_markers,
+            [("public", "main schema"), ("sales", None)],
+            [
+                relation_row("public", "a", "id"),
+                relation_row("public", "a", "added"),
+                relation_row("public", "b", "id"),
+                relation_row("sales", "orders", "id"),
+            ],
+        )
+
+        snapshot, changes = refresh_db_schema(cur, self.snapshot)
+
+        self.assertEqual(set(changes.changed), {
+            ("public", None), ("public", "a"), ("public", "b"), ("sales", None), ("sales", "orders"),
+        })
+        self.assertEqual(set(changes.dropped), {("archive", None), ("archive", "old")})
+        self.assertEqual(cur.executed[-1][1], ("shop", ["public", "public", "sales"], ["a", "b", "orders"]))
+
+        schemata = snapshot.schema["schemata"]
+        self.assertEqual([s["name"] for s in schemata], ["public", "sales"])
+        public, sales = schemata
+        self.assertEqual(public["description"], "main schema")
+        self.assertEqual([r["name"] for r in public["tables"]], ["a", "b", "c"])
+        self.assertEqual([c["name"] for c in public["tables"][0]["columns"]], ["id", "added"])
+        self.assertEqual([r["name"] for r in sales["tables"]], ["orders"])
+        # Unchanged relations are shared with the old snapshot, which is left as it was
+        self.assertIs(public["tables"][2], self.snapshot.schema["schemata"][1]["tables"][1])
+        self.assertIs(public["views"][0], self.snapshot.schema["schemata"][1]["views"][0])
+        self.assertEqual(self.snapshot.schema, original)
+        self.assertEqual(snapshot.markers[("public", "b")], marker(11))
+
+    def test_unchanged_snapshot_is_returned_as_is(self) -> None:
+        cur = FakeCursor([(*key, *value) for key, value in self.snapshot.markers.items()], [], [])
+        snapshot, changes = refresh_db_schema(cur, self.snapshot)
+        self.assertIs(snapshot, self.snapshot)
+        self.assertEqual(changes, ([], []))
+        self.assertEqual([sql for sql, _ in cur.executed], [GET_SCHEMA_MARKERS_SQL])
+
+    def test_refresh_recomputes_foreign_schemata(self) -> None:
+        markers = [(*key, *value) for key, value in self.snapshot.markers.items() if key[0] == "public"]
+        markers += [("archive", None, *marker(1)), ("archive", "remote", *marker(7)._replace(kind="f"))]
+        cur = FakeCursor(markers, [], [relation_row("archive", "remote", "id", "FOREIGN")])
+
+        snapshot, _ = refresh_db_schema(cur, self.snapshot)
+
+        archive = snapshot.schema["schemata"][0]
+        self.assertEqual([r["name"] for r in archive["tables"]], ["remote"])
+        self.assertTrue(archive["is_foreign"])
+        self.assertFalse(snapshot.schema["schemata"][1]["is_foreign"])
+
+
+class SchemaFilterTestCase(unittest.TestCase):
+    schema_filter = SchemaFilter(
+        include_schemas=["public", "sales%"], exclude_tables=["%\\_old"], relkinds=["r", "p"], collapse_partitions=True,
+    )
+
+    def test_filters_are_query_parameters(self) -> None:
+        sql, params = db_schema_sql(self.schema_filter)
+        self.assertEqual(params, [["%\\_old"], ["%\\_old"], ["r", "p"], ["public", "sales%"]])
+        self.assertEqual(sql.count("%s"), 1 + len(params))
+        self.assertIn("AND NOT c.relispartition", sql)
+
+        sql, params = schema_markers_sql(self.schema_filter)
+        self.assertEqual(params, [["public", "sales%"], ["public", "sales%"], ["%\\_old"], ["%\\_old"], ["r", "p"]])
+        self.assertEqual(sql.count("%s"), len(params))
+        self.assertEqual(db_schema_sql(), (GET_DB_SCHEMA_SQL, []))
+
+    def test_rejects_unknown_relkinds(self) -> None:
+        with self.assertRaises(ValueError):
+            db_schema_sql(SchemaFilter(relkinds=["m"]))
+
+    def test_snapshot_refreshes_with_its_filter(self) -> None:
+        cur = MagicMock()
+        cur.description = [Column(name) for name in RELATION_COLUMNS]
+        cur.fetchall.side_effect = [[("public", None, *marker(1))], [relation_row("public", "a", "id")]]
+        snapshot = get_db_schema_snapshot(cur, "shop", self.schema_filter)
+
+        cur.fetchall.side_effect = [[("public", None, *marker(1))]]
+        refreshed, _ = refresh_db_schema(cur, snapshot)
+
+        markers_sql, markers_params = schema_markers_sql(self.schema_filter)
+        self.assertEqual(cur.execute.call_args_list[0].args, (markers_sql, markers_params))
+        self.assertEqual(cur.execute.call_args_list[1].args[1][0], "shop")
+        self.assertEqual(cur.execute.call_args_list[2].args, (markers_sql, markers_params))
+        self.assertIs(refreshed.schema_filter, self.schema_filter)
+
+    def test_foreign_schemata(self) -> None:
+        cur = MagicMock()
+        cur.description = [Column(name) for name in RELATION_COLUMNS]
+        cur.fetchall.return_value = [
+            relation_row("local", "a", "id"),
+            relation_row("local", "b", "id", "FOREIGN"),
+            relation_row("remote", "b", "id", "FOREIGN"),
+            relation_row("remote", "c", "id", "FOREIGN"),
+            relation_row("empty", None, None),
+        ]
+        self.assertEqual(
+            {schema["name"]: schema["is_foreign"] for schema in get_db_schema(cur, "shop")["schemata"]},
+            {"local": False, "remote": True, "empty": False},
+        )
+
+
+@unittest.skipUnless(TEST_DSN, "PGTQ_TEST_DSN not set")
+class LocalPostgresRefreshTestCase(unittest.TestCase):
+    def test_refresh_matches_full_fetch(self) -> None:
+        import psycopg2
+
+        from pg_text_query.db_schema import get_db_schema
+
+        conn = psycopg2.connect(TEST_DSN)
+        self.addCleanup(conn.close)
+        with conn.cursor() as cur:
+            cur.execute("CREATE SCHEMA pgtq_refresh")
+            self.addCleanup(conn.rollback)
+            cur.execute("CREATE TABLE pgtq_refresh.penguins (id int)")
+            cur.execute("CREATE TABLE pgtq_refresh.islands (id int)")
+            snapshot = get_db_schema_snapshot(cur, conn.info.dbname)
+
+            cur.execute("ALTER TABLE pgtq_refresh.penguins ADD COLUMN species text")
+            cur.execute("COMMENT ON TABLE pgtq_refresh.islands IS 'Islands'")
+            snapshot, changes = refresh_db_schema(cur, snapshot)
+
+            self.assertEqual(
+                sorted(changes.changed), [("pgtq_refresh", "islands"), ("pgtq_refresh", "penguins")]
+            )
+            self.assertEqual(snapshot.schema, get_db_schema(cur, conn.info.dbname))
+
+    def test_filtered_refresh_matches_filtered_fetch(self) -> None:
+        import psycopg2
+
+        conn = psycopg2.connect(TEST_DSN)
+        self.addCleanup(conn.close)
+        schema_filter = SchemaFilter(include_schemas=["pgtq_filter"], exclude_tables=["%_old"], collapse_partitions=True)
+        with conn.cursor() as cur:
+            cur.execute("CREATE SCHEMA pgtq_filter")
+            self.addCleanup(conn.rollback)
+            cur.execute("CREATE TABLE pgtq_filter.events (id int, at date) PARTITION BY RANGE (at)")
+            cur.execute(
+                "CREATE TABLE pgtq_filter.events_2023 PARTITION OF pgtq_filter.events "
+                "FOR VALUES FROM ('2023-01-01') TO ('2024-01-01')"
+            )
+            cur.execute("CREATE TABLE pgtq_filter.events_old (id int)")
+            snapshot = get_db_schema_snapshot(cur, conn.info.dbname, schema_filter)
+            self.assertEqual(
+                [(s["name"], [r["name"] for r in s["tables"]]) for s in snapshot.schema["schemata"]],
+                [("pgtq_filter", ["events"])],
+            )
+
+            cur.execute("CREATE TABLE pgtq_filter.islands (id int)")
+            cur.execute("CREATE TABLE pgtq_filter.islands_old (id int)")
+            snapshot, changes = refresh_db_schema(cur, snapshot)
+
+            self.assertEqual(changes.changed, [("pgtq_filter", "islands")])
+            self.assertEqual(snapshot.schema, get_db_schema(cur, conn.info.dbname, schema_filter))
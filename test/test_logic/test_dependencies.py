@@ -0,0 +1,104 @@
+import copy
+import unittest
+
+from pg_text_query.dependencies import DependencyIndex, query_dependencies
+from pg_text_query.schema_file import SchemaFile, dump_schema
+from pg_text_query.skeleton import SkeletonCache
+
+from test_prompt import test_db_schema
+
+
+DB = test_db_schema["name"]
+
+
+def with_islands(db_schema: dict) -> dict:
+    db_schema = copy.deepcopy(db_schema)
+    db_schema["schemata"].append({"name": "geo", "views": [], "tables": [
+        {"name": "islands", "columns": [
+            {"name": "name", "data_type": "text", "ordinal_position": 1},
+            {"name": "area", "data_type": "bigint", "ordinal_position": 2},
+        ]},
+    ]})
+    return db_schema
+
+
+def penguin_columns(db_schema: dict) -> list:
+    return db_schema["schemata"][0]["tables"][0]["columns"]
+
+
+class QueryDependenciesTestCase(unittest.TestCase):
+    def test_resolves_relations_and_columns(self) -> None:
+        db_schema = with_islands(test_db_schema)
+        query = """
+            WITH heavy AS (SELECT * FROM penguins WHERE body_mass_g > 4000)
+            SELECT p.species, i.area FROM heavy h
+            JOIN penguins p ON p.island = h.island JOIN islands i ON i.name = p.island
+        """
+        for schema in (db_schema, SchemaFile(dump_schema(db_schema))):
+            self.assertEqual(query_dependencies(query, schema), {
+                (DB, "public", "penguins", None): "tables",
+                (DB, "public", "penguins", "*"): tuple((c["name"], c["data_type"]) for c in penguin_columns(db_schema)),
+                (DB, "public", "penguins", "body_mass_g"): "bigint",
+                (DB, "public", "penguins", "species"): "text",
+                (DB, "public", "penguins", "island"): "text",
+                # Unqualified, but only in one schema
+                (DB, "geo", "islands", None): "tables",
+                (DB, "geo", "islands", "area"): "bigint",
+                (DB, "geo", "islands", "name"): "text",
+                # Unqualified columns are matched against every relation in the query
+                (DB, "geo", "islands", "*"): (("name", "text"), ("area", "bigint")),
+            })
+
+    def test_missing_objects_have_no_signature(self) -> None:
+        self.assertEqual(query_dependencies("SELECT wingspan FROM birds", test_db_schema, "db"), {
+            ("db", "public", "birds", None): None,
+        })
+
+
+class DependencyIndexTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.index = DependencyIndex()
+        self.index.add("mass", "SELECT avg(body_mass_g) FROM penguins", test_db_schema)
+        self.index.add("all", "SELECT * FROM penguins", test_db_schema)
+        self.index.add("area", "SELECT area FROM geo.islands", with_islands(test_db_schema))
+
+    def test_invalidates_entries_using_changed_objects(self) -> None:
+        changed = with_islands(test_db_schema)
+        penguin_columns(changed).append({"name": "beak_color", "data_type": "text", "ordinal_position": 10})
+        self.assertEqual(self.index.check(changed), {"all"})
+
+        penguin_columns(changed)[3]["data_type"] = "numeric"
+        self.assertEqual(self.index.check(SchemaFile(dump_schema(changed))), {"mass"})
+        self.assertEqual(len(self.index), 1)
+
+        # Dropping a relation invalidates its entries
+        self.assertEqual(self.index.check(test_db_schema), {"area"})
+        self.assertEqual((len(self.index), self.index.objects), (0, 0))
+
+    def test_unrelated_changes_keep_entries(self) -> None:
+        changed = with_islands(test_db_schema)
+        changed["schemata"][1]["tables"][0]["columns"][0]["description"] = "island name"
+        changed["schemata"][1]["tables"].append({"name": "colonies", "columns": []})
+        self.assertEqual(self.index.check(changed), set())
+        # Other databases are never checked
+        self.assertEqual(self.index.check(changed, "another"), set())
+        self.assertEqual(len(self.index), 3)
+
+    def test_invalidate_relations(self) -> None:
+        self.assertEqual(self.index.invalidate_relations(DB, [("geo", None)]), {"area"})
+        self.assertEqual(self.index.invalidate_relations(DB, [("public", "penguins")]), {"mass", "all"})
+
+
+class SkeletonInvalidationTestCase(unittest.TestCase):
+    def test_invalidate_changed(self) -> None:
+        skeletons = SkeletonCache()
+        skeletons.store("penguins in 2007", "SELECT count(*) FROM penguins WHERE year = 2007", db_schema=test_db_schema)
+        skeletons.store("mass over 4000", "SELECT count(*) FROM penguins WHERE body_mass_g > 4000",
+                        db_schema=test_db_schema)
+
+        changed = copy.deepcopy(test_db_schema)
+        penguin_columns(changed)[4]["data_type"] = "text"
+        self.assertEqual(skeletons.invalidate_changed(changed), 1)
+        self.assertIsNone(skeletons.lookup("penguins in 2008"))
+        self.assertEqual(skeletons.lookup("mass over 5000"), "SELECT count(*) FROM penguins WHERE body_mass_g > 5000")
+        self.assertEqual(skeletons.stats().invalidated, 1)
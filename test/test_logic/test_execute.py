@@ -0,0 +1,84 @@
+import unittest
+from unittest.mock import MagicMock
+
+from pg_text_query.errors import QueryExecError
+from pg_text_query.execute import iter_query_rows, limit_query
+
+
+class LimitQueryTestCase(unittest.TestCase):
+    def test_adds_missing_limit(self) -> None:
+        self.assertEqual(
+            limit_query("SELECT * FROM orders", 100),
+            "SELECT * FROM orders LIMIT 100",
+        )
+
+    def test_adds_limit_after_order_by(self) -> None:
+        self.assertEqual(
+            limit_query("SELECT id FROM orders ORDER BY created_at DESC", 10),
+            "SELECT id FROM orders ORDER BY created_at DESC LIMIT 10",
+        )
+
+    def test_tightens_large_limit(self) -> None:
+        self.assertEqual(
+            limit_query("SELECT id FROM orders LIMIT 5000 OFFSET 10", 100),
+            "SELECT id FROM orders LIMIT 100 OFFSET 10",
+        )
+
+    def test_keeps_smaller_limit(self) -> None:
+        query = "SELECT id FROM orders LIMIT 5"
+        self.assertEqual(limit_query(query, 100), query)
+
+    def test_replaces_limit_all(self) -> None:
+        self.assertEqual(
+            limit_query("SELECT id FROM orders LIMIT ALL", 100),
+            "SELECT id FROM orders LIMIT 100",
+        )
+
+    def test_limits_set_operation(self) -> None:
+        self.assertEqual(
+            limit_query("SELECT a FROM x UNION SELECT a FROM y", 3),
+            "SELECT a FROM x UNION SELECT a FROM y LIMIT 3",
+        )
+
+    def test_wraps_non_constant_limit(self) -> None:
+        self.assertEqual(
+            limit_query("SELECT id FROM orders LIMIT (SELECT count(*) FROM t)", 7),
+            "SELECT * FROM (SELECT id FROM orders LIMIT (SELECT count(*) FROM t)) AS limited LIMIT 7",
+        )
+
+    def test_leaves_non_select_unchanged(self) -> None:
+        query = "DELETE FROM orders"
+        self.assertEqual(limit_query(query, 10), query)
+
+    def test_rejects_multiple_statements(self) -> None:
+        with self.assertRaises(QueryExecError):
+            limit_query("SELECT 1; SELECT 2", 10)
+
+
+class IterQueryRowsTestCase(unittest.TestCase):
+    def test_stops_once_max_rows_fetched(self) -> None:
+        conn = MagicMock(autocommit=False)
+        cur = conn.cursor.return_value
+        cur.fetchmany.side_effect = [[(1,), (2,)], [(3,), (4,)], [(5,)]]
+
+        rows = list(iter_query_rows(conn, "SELECT n FROM big", max_rows=5, batch_size=2))
+
+        self.assertEqual(rows, [(1,), (2,), (3,), (4,), (5,)])
+        cur.execute.assert_called_once_with("SELECT n FROM big LIMIT 5")
+        self.assertEqual(
+            [c.args for c in cur.fetchmany.call_args_list], [(2,), (2,), (1,)]
+        )
+        self.assertFalse(conn.cursor.call_args.kwargs["withhold"])
+        cur.close.assert_called_once()
+
+    def test_closes_cursor_when_abandoned(self) -> None:
+        conn = MagicMock(autocommit=True)
+        cur = conn.cursor.return_value
+        cur.fetchmany.return_value = [(1,), (2,)]
+
+        rows = iter_query_rows(conn, "SELECT n FROM big", max_rows=100, batch_size=2)
+        self.assertEqual(next(rows), (1,))
+        rows.close()
+
+        self.assertTrue(conn.cursor.call_args.kwargs["withhold"])
+        cur.close.assert_called_once()
@@ -0,0 +1,85 @@
+import os
+import typing as t
+import unittest
+from unittest.mock import MagicMock
+
+from pg_text_query.errors import QueryCostError, QueryExecError
+from pg_text_query.explain import check_query_cost, explain_query
+from pg_text_query.execute import pooled_cursor
+
+
+# Set to a libpq connection string (e.g. "dbname=postgres") to also run the
+# checks against a local Postgres server.
+TEST_DSN = os.getenv("PGTQ_TEST_DSN")
+
+SEQ_SCAN_PLAN = [
+    {
+        "Plan": {
+            "Node Type": "Seq Scan",
+            "Startup Cost": 0.0,
+            "Total Cost": 185000.0,
+            "Plan Rows": 10000000,
+            "Plan Width": 16,
+        }
+    }
+]
+
+
+def _mock_cursor(plan: t.Any = SEQ_SCAN_PLAN) -> MagicMock:
+    cur = MagicMock()
+    cur.fetchone.return_value = (plan,)
+    return cur
+
+
+class ExplainTestCase(unittest.TestCase):
+    def test_explain_query_reads_top_plan(self) -> None:
+        cur = _mock_cursor()
+        plan = explain_query(cur, "SELECT * FROM orders")
+        cur.execute.assert_called_once_with("EXPLAIN (FORMAT JSON) SELECT * FROM orders")
+        self.assertEqual(plan["node_type"], "Seq Scan")
+        self.assertEqual(plan["total_cost"], 185000.0)
+        self.assertEqual(plan["plan_rows"], 10000000)
+
+    def test_explain_query_rejects_multiple_statements(self) -> None:
+        cur = _mock_cursor()
+        with self.assertRaises(QueryExecError):
+            explain_query(cur, "SELECT 1; DROP TABLE orders")
+        cur.execute.assert_not_called()
+
+    def test_check_query_cost_raises_over_threshold(self) -> None:
+        with self.assertRaises(QueryCostError) as ctx:
+            check_query_cost(_mock_cursor(), "SELECT * FROM orders", max_cost=1000)
+        self.assertIn("estimated cost", str(ctx.exception))
+
+    def test_check_query_cost_flags_without_raising(self) -> None:
+        check = check_query_cost(
+            _mock_cursor(), "SELECT * FROM orders", max_rows=1000, raise_on_exceed=False
+        )
+        self.assertTrue(check["exceeds_limits"])
+        self.assertEqual(len(check["reasons"]), 1)
+
+    def test_check_query_cost_within_threshold(self) -> None:
+        check = check_query_cost(_mock_cursor(), "SELECT * FROM orders", max_cost=1e6)
+        self.assertFalse(check["exceeds_limits"])
+
+
+@unittest.skipUnless(TEST_DSN, "PGTQ_TEST_DSN not set")
+class LocalPostgresExplainTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        from psycopg2.pool import SimpleConnectionPool
+
+        self.pool = SimpleConnectionPool(1, 2, TEST_DSN)
+
+    def tearDown(self) -> None:
+        self.pool.closeall()
+
+    def test_rejects_large_series(self) -> None:
+        with pooled_cursor(self.pool) as cur:
+            with self.assertRaises(QueryCostError):
+                check_query_cost(
+                    cur,
+                    "SELECT * FROM generate_series(1, 1000) a, generate_series(1, 1000) b",
+                    max_rows=1000,
+                )
+            check = check_query_cost(cur, "SELECT 1", max_cost=1.0)
+        self.assertEqual(check["plan"]["plan_rows"], 1)
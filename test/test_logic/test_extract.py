@@ -0,0 +1,55 @@
+import unittest
+
+from pg_text_query.extract import extract_query, find_terminated_statement, statement_start
+
+
+class ExtractQueryTestCase(unittest.TestCase):
+    def test_plain_sql(self) -> None:
+        query, statement = extract_query("SELECT COUNT(*) FROM penguins;")
+        self.assertEqual(query, "SELECT COUNT(*) FROM penguins")
+        self.assertIsNotNone(statement)
+
+    def test_sql_fence_with_prose(self) -> None:
+        text = (
+            "Sure! Here is the query:\n\n"
+            "```sql\nSELECT species, COUNT(*)\nFROM penguins\nGROUP BY species;\n```\n\n"
+            "This counts penguins per species."
+        )
+        query, _ = extract_query(text)
+        self.assertEqual(query, "SELECT species, COUNT(*)\nFROM penguins\nGROUP BY species")
+
+    def test_sql_fence_preferred_over_other_fences(self) -> None:
+        text = "```\nSELECT 1\n```\n```postgresql\nSELECT 2\n```"
+        self.assertEqual(extract_query(text).query, "SELECT 2")
+
+    def test_inline_prose_and_trailing_commentary(self) -> None:
+        text = "The query is: SELECT name FROM actor WHERE actor_id = 1\nThis returns one actor's name."
+        self.assertEqual(extract_query(text).query, "SELECT name FROM actor WHERE actor_id = 1")
+
+    def test_keyword_in_prose_ignored(self) -> None:
+        text = "The query uses table penguins\nSELECT 1"
+        self.assertEqual(extract_query(text).query, "SELECT 1")
+
+    def test_longer_later_statement_preferred(self) -> None:
+        text = "Reading TABLE penguins is not enough, so:\nSELECT species, COUNT(*) FROM penguins GROUP BY species"
+        self.assertEqual(extract_query(text).query, "SELECT species, COUNT(*) FROM penguins GROUP BY species")
+
+    def test_lower_case_statement_at_line_start(self) -> None:
+        text = "Here you go:\nselect name from actor\nThis returns all names."
+        self.assertEqual(extract_query(text).query, "select name from actor")
+
+    def test_statement_start(self) -> None:
+        self.assertEqual(statement_start("```sql\n  SELECT 1;\n```"), 9)
+        self.assertEqual(statement_start(" select 1"), 1)
+        self.assertIsNone(statement_start("```sql\n"))
+        self.assertIsNone(statement_start("Here is the query:\nSELECT 1;"))
+        self.assertEqual(find_terminated_statement("Here is the query:\nSELECT 1; Done."), (19, 28))
+        self.assertIsNone(find_terminated_statement("Here is the query:\nSELECT 1"))
+
+    def test_first_of_several_statements(self) -> None:
+        self.assertEqual(extract_query("SELECT 1; SELECT 2;").query, "SELECT 1")
+
+    def test_no_sql(self) -> None:
+        query, statement = extract_query("  I'm sorry, I can't help with that.  ")
+        self.assertEqual(query, "I'm sorry, I can't help with that.")
+        self.assertIsNone(statement)
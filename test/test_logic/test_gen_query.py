@@ -1,18 +1,23 @@
+import os
+import tempfile
+import typing as t
 import unittest
 from unittest.mock import Mock, patch
 
-from pg_text_query.gen_query import generate_query, DEFAULT_COMPLETION_CONFIG
+from pg_text_query.config import get_config, reload_config, set_config
+from pg_text_query.gen_query import (
+    generate_query, find_statement_end, DEFAULT_COMPLETION_CONFIG, QueryGenerator
+)
 from pg_text_query.errors import QueryGenError
+from pg_text_query.transport import Transport
 
 
 class QueryGenTestCase(unittest.TestCase):
 
-    @patch("openai.Completion.create")
-    @patch("pg_text_query.gen_query.openai.api_key")
+    @patch("pg_text_query.gen_query.get_transport")
     def test_generate_query_invalid_syntax(
         self,
-        mock_openai_key: Mock,
-        mock_completion_create: Mock,
+        mock_get_transport: Mock,
     ) -> None:
         prompt = "\n".join(
             [
@@ -24,23 +29,21 @@ class QueryGenTestCase(unittest.TestCase):
         )
         # Demonstrate default override
         expected_kwargs = {**DEFAULT_COMPLETION_CONFIG}
-        mock_completion_create.return_value = {"choices": [{"text": "sum(records)"}]}
-        mock_openai_key.return_value.api_key.return_value = "FAKE_KEY"
+        mock_create = mock_get_transport.return_value.create
+        mock_create.return_value = {"choices": [{"text": "sum(records)"}]}
         
         with self.assertRaises(QueryGenError) as ctx:
             _ = generate_query(prompt, validate_sql=True)
         self.assertIn("Generated query is empty, only a comment, or invalid.", str(ctx.exception))
-        mock_completion_create.assert_called_once_with(
-            prompt=prompt,
-            **expected_kwargs,
+        mock_create.assert_called_once_with(
+            "completion",
+            {"prompt": prompt, **expected_kwargs},
         )
 
-    @patch("openai.Completion.create")
-    @patch("pg_text_query.gen_query.openai.api_key")
+    @patch("pg_text_query.gen_query.get_transport")
     def test_generate_query_returns_only_comment(
         self,
-        mock_openai_key: Mock,
-        mock_completion_create: Mock,
+        mock_get_transport: Mock,
     ) -> None:
         prompt = "\n".join(
             [
@@ -52,23 +55,21 @@ class QueryGenTestCase(unittest.TestCase):
         )
         # Demonstrate default override
         expected_kwargs = {**DEFAULT_COMPLETION_CONFIG}
-        mock_completion_create.return_value = {"choices": [{"text": "-- SELECT COUNT(*) FROM penguins"}]}
-        mock_openai_key.return_value.api_key.return_value = "FAKE_KEY"
+        mock_create = mock_get_transport.return_value.create
+        mock_create.return_value = {"choices": [{"text": "-- SELECT COUNT(*) FROM penguins"}]}
         
         with self.assertRaises(QueryGenError) as ctx:
             _ = generate_query(prompt, validate_sql=True)
         self.assertIn("Generated query is empty, only a comment, or invalid.", str(ctx.exception))
-        mock_completion_create.assert_called_once_with(
-            prompt=prompt,
-            **expected_kwargs,
+        mock_create.assert_called_once_with(
+            "completion",
+            {"prompt": prompt, **expected_kwargs},
         )
 
-    @patch("openai.Completion.create")
-    @patch("pg_text_query.gen_query.openai.api_key")
+    @patch("pg_text_query.gen_query.get_transport")
     def test_generate_query_w_param(
         self,
-        mock_openai_key: Mock,
-        mock_completion_create: Mock,
+        mock_get_transport: Mock,
     ) -> None:
         prompt = "\n".join(
             [
@@ -81,11 +82,106 @@ class QueryGenTestCase(unittest.TestCase):
         expected_query = "SELECT COUNT(*)"
         # Demonstrate default override
         expected_kwargs = {**DEFAULT_COMPLETION_CONFIG, **{"temperature": 0.5}}
-        mock_completion_create.return_value = {"choices": [{"text": "SELECT COUNT(*)"}]}
-        mock_openai_key.return_value.api_key.return_value = "FAKE_KEY"
+        mock_create = mock_get_transport.return_value.create
+        mock_create.return_value = {"choices": [{"text": "SELECT COUNT(*)"}]}
         query = generate_query(prompt, temperature=0.5)
         self.assertEqual(query, expected_query)
-        mock_completion_create.assert_called_once_with(
-            prompt=prompt,
-            **expected_kwargs,
+        mock_create.assert_called_once_with(
+            "completion",
+            {"prompt": prompt, **expected_kwargs},
         )
+
+    def test_query_generator_uses_own_transport(self) -> None:
+        transport = Mock(spec=Transport)
+        transport.create.return_value = {
+            "choices": [{"message": {"role": "assistant", "content": "```sql\nSELECT COUNT(*) FROM penguins;\n```"}}]
+        }
+        with QueryGenerator(transport) as generator:
+            query = generator.generate(
+                "how many penguins?", validate_sql=True, completion_type="chat", task_prompt={"system": "be terse"}
+            )
+        self.assertEqual(query, "SELECT COUNT(*) FROM penguins")
+        endpoint, request = transport.create.call_args.args
+        self.assertEqual(endpoint, "chat_completion")
+        self.assertEqual(request["messages"][0], {"role": "system", "content": "be terse"})
+        self.assertNotIn("task_prompt", request)
+        transport.close.assert_called_once()
+
+
+class StreamQueryTestCase(unittest.TestCase):
+    def _generator(self, pieces: list) -> QueryGenerator:
+        self.remaining = list(pieces)
+        self.closed = False
+
+        def stream(endpoint: str, request: dict) -> t.Iterator[str]:
+            try:
+                while self.remaining:
+                    yield self.remaining.pop(0)
+            finally:
+                self.closed = True
+
+        transport = Mock(spec=Transport)
+        transport.stream.side_effect = stream
+        return QueryGenerator(transport)
+
+    def test_find_statement_end(self) -> None:
+        self.assertIsNone(find_statement_end("SELECT 'a;b"))
+        self.assertEqual(find_statement_end("SELECT 'a;b'; SELECT 2;"), 13)
+        self.assertIsNone(find_statement_end("-- just a comment;"))
+        self.assertIsNone(find_statement_end("Here is the query; SELECT"))
+        text = "SELECT a -- pick a; then\nFROM t;"
+        self.assertEqual(find_statement_end(text), len(text))
+        self.assertEqual(find_statement_end("SELECT /* a; b */ 1;"), 20)
+        self.assertEqual(find_statement_end("SELECT 1; That's it."), 9)
+
+    def test_stream_stops_after_first_statement(self) -> None:
+        generator = self._generator(
+            ["SELECT", " species FROM penguins", " WHERE note = 'a;b'", "; SELECT", " 2;"]
+        )
+        pieces = list(generator.stream("p", completion_type="chat"))
+        self.assertEqual("".join(pieces), "SELECT species FROM penguins WHERE note = 'a;b';")
+        self.assertTrue(self.closed)
+        self.assertEqual(self.remaining, [" 2;"])
+
+    def test_stream_skips_code_fence(self) -> None:
+        generator = self._generator(["```", "sql\nSELECT species", " FROM penguins;", "\n```\n", "This counts them."])
+        pieces = list(generator.stream("p", completion_type="chat"))
+        self.assertEqual("".join(pieces), "SELECT species FROM penguins;")
+        self.assertTrue(self.closed)
+        self.assertEqual(self.remaining, ["\n```\n", "This counts them."])
+
+        # A fenced statement without a terminator ends at the closing fence
+        generator = self._generator(["```sql\nSELECT 1\n`", "``\nDone", "."])
+        self.assertEqual("".join(generator.stream("p", completion_type="chat")), "SELECT 1")
+        self.assertEqual(self.remaining, ["."])
+
+    def test_stream_skips_prose(self) -> None:
+        generator = self._generator(["Here is", " the query:\n", "SELECT COUNT(*)", " FROM penguins;", " It's simple."])
+        pieces = list(generator.stream("p", completion_type="chat"))
+        self.assertEqual(pieces, ["SELECT COUNT(*) FROM penguins;"])
+        self.assertTrue(self.closed)
+        self.assertEqual(self.remaining, [" It's simple."])
+
+        # Without a terminator, the statement is extracted when the response ends
+        generator = self._generator(["Here is the query:\n", "SELECT 1\n", "That's all."])
+        self.assertEqual(list(generator.stream("p", completion_type="chat")), ["SELECT 1"])
+
+    def test_stream_without_statement_check(self) -> None:
+        generator = self._generator(["SELECT 1;", " SELECT 2"])
+        pieces = list(generator.stream("p", stop_at_statement=False))
+        self.assertEqual(pieces, ["SELECT 1;", " SELECT 2"])
+
+
+class ConfigTestCase(unittest.TestCase):
+    def test_reload_config_reads_env(self) -> None:
+        original = get_config()
+        with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as f:
+            f.write("completion_create:\n  model: test-model\n  max_tokens: 5\n")
+        try:
+            with patch.dict(os.environ, {"PGTQ_OPENAI_CONFIG": f.name}):
+                config = reload_config()
+            self.assertEqual(config.completion, {"model": "test-model", "max_tokens": 5})
+            self.assertIs(get_config(), config)
+        finally:
+            set_config(original)
+            os.remove(f.name)
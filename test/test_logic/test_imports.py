@@ -0,0 +1,28 @@
+import json
+import subprocess
+import sys
+import unittest
+
+
+def _loaded_after(statement: str) -> list:
+    code = (
+        f"import sys, json; {statement}; "
+        "print(json.dumps([m for m in ('openai', 'yaml', 'pglast') if m in sys.modules]))"
+    )
+    out = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True)
+    return json.loads(out.stdout)
+
+
+class LazyImportTestCase(unittest.TestCase):
+    def test_package_import_is_lazy(self) -> None:
+        self.assertEqual(_loaded_after("import pg_text_query"), [])
+
+    def test_prompt_import_is_lazy(self) -> None:
+        self.assertEqual(_loaded_after("from pg_text_query import get_default_prompt"), [])
+
+    def test_config_loaded_on_first_use(self) -> None:
+        self.assertEqual(_loaded_after("from pg_text_query import generate_query"), [])
+        self.assertEqual(
+            _loaded_after("from pg_text_query import get_config; get_config().completion"),
+            ["yaml"],
+        )
@@ -0,0 +1,48 @@
+import csv
+import datetime
+import decimal
+import io
+import os
+import unittest
+from unittest.mock import MagicMock
+
+from test.test_model.runner import TEST_DATA_PATH, load_seed_data, result_digest
+
+
+class ResultDigestTestCase(unittest.TestCase):
+    def test_unordered_digest_ignores_order_but_not_duplicates(self) -> None:
+        rows = [("Adelie", 152), ("Gentoo", 124), ("Chinstrap", 68)]
+        self.assertEqual(result_digest(rows, ordered=False), result_digest(reversed(rows), ordered=False))
+        self.assertEqual(result_digest(rows, ordered=False)[0], 3)
+        self.assertNotEqual(result_digest([(1,), (1,)], ordered=False), result_digest([(2,), (2,)], ordered=False))
+        self.assertNotEqual(result_digest([(1,), (1,)], ordered=False), result_digest([(1,)], ordered=False))
+
+    def test_ordered_digest_depends_on_order(self) -> None:
+        rows = [(1,), (2,)]
+        self.assertNotEqual(result_digest(rows, ordered=True), result_digest(rows[::-1], ordered=True))
+
+    def test_database_values_match_json_expectations(self) -> None:
+        # Rows from the database against expected_records loaded from JSON
+        rows = [(decimal.Decimal("43.5"), datetime.date(2007, 11, 11), 344)]
+        self.assertEqual(
+            result_digest(rows, ordered=False), result_digest([[43.5, "2007-11-11", 344]], ordered=False)
+        )
+
+
+class SeedDataTestCase(unittest.TestCase):
+    def test_penguins_seed_matches_suite_expectations(self) -> None:
+        with open(os.path.join(TEST_DATA_PATH, "penguins.csv"), newline="") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 344)
+        self.assertEqual(sum(row["year"] == "2007" for row in rows), 110)
+
+    def test_load_seed_data_copies_csv(self) -> None:
+        cur = MagicMock()
+        copied = io.StringIO()
+        cur.copy_expert.side_effect = lambda sql, f: copied.write(f.read())
+        load_seed_data(cur, {"public.penguins": "penguins.csv"})
+
+        sql = cur.copy_expert.call_args.args[0]
+        self.assertTrue(sql.startswith('COPY "public"."penguins" ("species", "island", "bill_length_mm"'))
+        self.assertIn("NULL 'NA'", sql)
+        self.assertEqual(len(copied.getvalue().splitlines()), 345)
@@ -0,0 +1,39 @@
+import unittest
+
+from pg_text_query.normalize import (
+    normalize_query, parse_statements, queries_equivalent, statements_match
+)
+
+
+class NormalizeTestCase(unittest.TestCase):
+    def test_normalize_query(self) -> None:
+        self.assertEqual(
+            normalize_query("select  avg(bill_length_mm) from penguins where species='Adelie';"),
+            "SELECT avg(bill_length_mm)\nFROM penguins\nWHERE species = 'Adelie'",
+        )
+
+    def test_equivalent_ignores_formatting(self) -> None:
+        self.assertTrue(
+            queries_equivalent(
+                "select MAX(body_mass_g)\n  from PENGUINS\n where species = 'Chinstrap';",
+                "SELECT MAX(body_mass_g) FROM penguins WHERE species = 'Chinstrap'",
+            )
+        )
+
+    def test_not_equivalent_on_different_literal(self) -> None:
+        self.assertFalse(
+            queries_equivalent(
+                "SELECT COUNT(*) FROM penguins WHERE year = 2008",
+                "SELECT COUNT(*) FROM penguins WHERE year = 2007",
+            )
+        )
+
+    def test_trailing_statements_are_ignored(self) -> None:
+        self.assertTrue(
+            queries_equivalent("SELECT COUNT(*) FROM penguins; SELECT 1", "SELECT count(*) FROM penguins")
+        )
+
+    def test_invalid_never_matches(self) -> None:
+        self.assertIsNone(parse_statements("['not', 'valid', 'sql']"))
+        self.assertFalse(statements_match(None, parse_statements("SELECT 1")))
+        self.assertFalse(queries_equivalent("-- only a comment", "-- only a comment"))
@@ -1,6 +1,7 @@
+import copy
 import unittest
 
-from pg_text_query.prompt import get_default_prompt
+from pg_text_query.prompt import get_canonical_prompt, get_default_prompt
 
 
 test_db_schema = {
@@ -109,3 +110,30 @@ class PromptTestCase(unittest.TestCase):
 
         prompt = get_default_prompt("how many penguins are there?", test_db_schema)
         self.assertEqual(prompt, expected)
+
+    def test_canonical_prompt_prefix_is_stable(self) -> None:
+        reordered = copy.deepcopy(test_db_schema)
+        reordered["schemata"].insert(0, {"name": "staging", "views": [], "tables": [
+            {"name": "sightings", "columns": [{"name": "seen_at", "data_type": "date", "ordinal_position": 1}]},
+        ]})
+        reordered["schemata"].append({"name": "empty", "views": [], "tables": []})
+        shuffled = copy.deepcopy(reordered)
+        shuffled["schemata"].reverse()
+        shuffled["schemata"][1]["tables"][0]["columns"].reverse()
+
+        first = get_canonical_prompt("how many penguins are there?", reordered)
+        second = get_canonical_prompt("which island has the most penguins?", shuffled)
+
+        self.assertEqual(first.prefix, second.prefix)
+        self.assertEqual(first.prefix_hash, second.prefix_hash)
+        self.assertTrue(second.prompt.startswith(second.prefix))
+        self.assertEqual(
+            first.prompt,
+            "\n".join([
+                "-- Language PostgreSQL",
+                "-- Table = \"penguins\", columns = [species text, island text, bill_length_mm double precision, bill_depth_mm double precision, flipper_length_mm bigint, body_mass_g bigint, sex text, year bigint]",
+                "-- Table = \"staging\".\"sightings\", columns = [seen_at date]",
+                "-- A PostgreSQL query to return 1 and a PostgreSQL query for how many penguins are there?",
+                "SELECT 1;",
+            ]),
+        )
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import Mock
+
+import openai
+
+from pg_text_query.ratelimit import (
+    RateLimitedTransport, RateLimiter, RetryPolicy, estimate_tokens, rate_limit_tenant
+)
+from pg_text_query.transport import RecordingTransport, ReplayTransport, Transport
+
+
+class EstimateTokensTestCase(unittest.TestCase):
+    def test_completion_request(self) -> None:
+        self.assertEqual(estimate_tokens({"prompt": "x" * 40, "max_tokens": 200}), 210)
+
+    def test_chat_request(self) -> None:
+        request = {
+            "messages": [{"role": "system", "content": "abcd"}, {"role": "user", "content": "abcde"}],
+            "max_tokens": 100,
+            "n": 2,
+        }
+        self.assertEqual(estimate_tokens(request), 203)
+
+
+class RateLimiterTestCase(unittest.TestCase):
+    def test_requests_per_minute(self) -> None:
+        # 20 requests/s with a burst of 5: the last 5 of 10 wait ~0.25s
+        limiter = RateLimiter(requests_per_minute=1200, burst_seconds=0.25)
+        start = time.monotonic()
+        for _ in range(10):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_tenants_are_served_round_robin(self) -> None:
+        limiter = RateLimiter(requests_per_minute=600, burst_seconds=0.1)
+        limiter.acquire()  # drain the single-request burst
+        order = []
+
+        def request(tenant: str) -> None:
+            with rate_limit_tenant(tenant):
+                limiter.acquire()
+            order.append(tenant)
+
+        threads = [threading.Thread(target=request, args=("noisy",)) for _ in range(3)]
+        threads.append(threading.Thread(target=request, args=("quiet",)))
+        for thread in threads:
+            thread.start()
+            time.sleep(0.01)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, ["noisy", "quiet", "noisy", "noisy"])
+
+
+class RateLimitedTransportTestCase(unittest.TestCase):
+    def test_retries_retryable_errors(self) -> None:
+        inner = Mock(spec=Transport)
+        inner.create.side_effect = [
+            openai.error.RateLimitError("slow down", http_status=429),
+            openai.error.APIError("bad gateway", http_status=502),
+            {"choices": [{"text": "SELECT 1"}]},
+        ]
+        sleep = Mock()
+        transport = RateLimitedTransport(inner, retry_policy=RetryPolicy(base_delay=1.0, seed=0), sleep=sleep)
+
+        response = transport.create("completion", {"prompt": "p"})
+
+        self.assertEqual(response["choices"][0]["text"], "SELECT 1")
+        self.assertEqual(inner.create.call_count, 3)
+        delays = [c.args[0] for c in sleep.call_args_list]
+        self.assertLessEqual(delays[0], 1.0)
+        self.assertLessEqual(delays[1], 2.0)
+
+    def test_does_not_retry_client_errors(self) -> None:
+        inner = Mock(spec=Transport)
+        inner.create.side_effect = openai.error.InvalidRequestError("bad", None, http_status=400)
+        transport = RateLimitedTransport(inner, sleep=Mock())
+        with self.assertRaises(openai.error.InvalidRequestError):
+            transport.create("completion", {"prompt": "p"})
+        inner.create.assert_called_once()
+
+    def test_stays_within_replay_limits(self) -> None:
+        fd, path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        inner = Mock(spec=Transport)
+        inner.create.return_value = {"choices": [{"text": "SELECT 1"}]}
+        RecordingTransport(path, inner).create("completion", {"prompt": "p"})
+
+        # The stand-in rejects more than 5 requests per 0.5s window
+        replay = ReplayTransport(path, requests_per_minute=5, window_seconds=0.5)
+        with self.assertRaises(openai.error.RateLimitError):
+            for _ in range(6):
+                replay.create("completion", {"prompt": "p"})
+
+        replay = ReplayTransport(path, requests_per_minute=5, window_seconds=0.5)
+        # 7 requests/s with no burst keeps any 0.5s window at 5 requests or fewer
+        limiter = RateLimiter(requests_per_minute=7 * 60, burst_seconds=0)
+        transport = RateLimitedTransport(replay, limiter, RetryPolicy(max_retries=0))
+        for _ in range(8):
+            transport.create("completion", {"prompt": "p"})
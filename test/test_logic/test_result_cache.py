@@ -0,0 +1,127 @@
+import os
+import unittest
+from unittest.mock import MagicMock
+
+from pg_text_query.execute import iter_query_rows
+from pg_text_query.result_cache import ResultCache, ResultCacheStats, query_sources
+
+
+TEST_DSN = os.getenv("PGTQ_TEST_DSN")
+
+
+def versioned_conn(version: str, batches: list) -> MagicMock:
+    """A connection whose data version is version, answering queries with batches."""
+    conn = MagicMock(autocommit=False)
+    version_cur = conn.cursor.return_value.__enter__.return_value
+    version_cur.fetchone.return_value = (True, "penguins", "reader", None, 5432, version)
+    conn.cursor.return_value.fetchmany.side_effect = batches
+    return conn
+
+
+class QuerySourcesTestCase(unittest.TestCase):
+    def test_collects_relations_and_functions(self) -> None:
+        sources = query_sources(
+            "WITH heavy AS (SELECT * FROM penguins WHERE body_mass_g > 4000) "
+            "SELECT i.name, count(*) FROM heavy JOIN geo.islands i ON i.name = heavy.island GROUP BY 1"
+        )
+        self.assertEqual(sources.relations, [("geo", "islands"), (None, "penguins")])
+        self.assertEqual(sources.functions, ["count"])
+
+    def test_rejects_uncacheable_queries(self) -> None:
+        for query in [
+            "SELECT * FROM orders WHERE at > now() - interval '1 day'",
+            "SELECT * FROM orders WHERE at::date = CURRENT_DATE",
+            "SELECT * FROM orders WHERE at > 'yesterday'",
+            "SELECT * FROM orders FOR UPDATE",
+            "SELECT * INTO copied FROM orders",
+            "DELETE FROM orders",
+            "SELECT 1; SELECT 2",
+        ]:
+            self.assertIsNone(query_sources(query), query)
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    def test_serves_rows_until_data_version_changes(self) -> None:
+        cache = ResultCache()
+        query = "select island, count(*) from penguins group by island"
+        conn = versioned_conn("16384:731:16384:344:0:0", [[("Biscoe", 168), ("Dream", 124)], []])
+        self.assertEqual(list(iter_query_rows(conn, query, cache=cache)), [("Biscoe", 168), ("Dream", 124)])
+
+        # The same query, differently written, is served from the cache
+        conn = versioned_conn("16384:731:16384:344:0:0", [])
+        rows = list(iter_query_rows(conn, "SELECT island, COUNT(*) FROM penguins GROUP BY island;", cache=cache))
+        self.assertEqual(rows, [("Biscoe", 168), ("Dream", 124)])
+        conn.cursor.return_value.execute.assert_not_called()
+
+        # Once a row is inserted it is run again
+        conn = versioned_conn("16384:731:16384:345:0:0", [[("Biscoe", 169), ("Dream", 124)], []])
+        self.assertEqual(list(iter_query_rows(conn, query, cache=cache))[0], ("Biscoe", 169))
+        # As it is once the table is altered (a new pg_class row version), without a rewrite
+        conn = versioned_conn("16384:812:16384:345:0:0", [[("Biscoe", 169), ("Dream", 124)], []])
+        list(iter_query_rows(conn, query, cache=cache))
+        conn.cursor.return_value.execute.assert_called_once()
+        stats = cache.stats()
+        self.assertEqual((stats.entries, stats.hits, stats.misses, stats.stored), (1, 1, 3, 3))
+
+    def test_does_not_store_abandoned_or_oversized_results(self) -> None:
+        cache = ResultCache(max_result_bytes=500)
+        rows = iter_query_rows(versioned_conn("1:1:1:0:0:0", [[(1,), (2,)], []]), "SELECT n FROM t", cache=cache)
+        next(rows)
+        rows.close()
+        big = [[("x" * 1000,)], []]
+        list(iter_query_rows(versioned_conn("1:1:1:0:0:0", big), "SELECT s FROM t", cache=cache))
+        self.assertEqual(len(cache), 0)
+
+    def test_uncacheable_queries_are_not_versioned(self) -> None:
+        cache = ResultCache()
+        conn = versioned_conn("1:1:1:0:0:0", [[(1,)], []])
+        self.assertEqual(list(iter_query_rows(conn, "SELECT 1", cache=cache)), [(1,)])
+        conn.cursor.return_value.__enter__.return_value.execute.assert_not_called()
+        self.assertEqual(len(cache), 0)
+
+    def test_evicts_within_budget_and_expires(self) -> None:
+        now = [0.0]
+        cache = ResultCache(max_bytes=250, ttl=10, clock=lambda: now[0])
+        for key in ("a", "b", "c"):
+            cache.store(key, "v1", [(key,)], 100)
+        self.assertIsNone(cache.lookup("a", "v1"))
+        self.assertEqual(cache.lookup("c", "v1"), (("c",),))
+        # A different version or an expired entry is dropped
+        self.assertIsNone(cache.lookup("c", "v2"))
+        now[0] = 10
+        self.assertIsNone(cache.lookup("b", "v1"))
+        self.assertEqual(cache.stats(), ResultCacheStats(
+            entries=0, bytes=0, max_bytes=250, hits=1, misses=3, stored=3, evictions=1,
+        ))
+
+
+@unittest.skipUnless(TEST_DSN, "PGTQ_TEST_DSN not set")
+class LocalPostgresResultCacheTestCase(unittest.TestCase):
+    def test_caches_catalog_query(self) -> None:
+        import psycopg2
+
+        conn = psycopg2.connect(TEST_DSN)
+        self.addCleanup(conn.close)
+        cache = ResultCache()
+        query = "SELECT count(*) FROM pg_namespace"
+        first = list(iter_query_rows(conn, query, cache=cache))
+        conn.rollback()
+        self.assertEqual(list(iter_query_rows(conn, query, cache=cache)), first)
+        self.assertEqual(cache.stats().hits, 1)
+
+    def test_alter_changes_data_version(self) -> None:
+        import psycopg2
+
+        conn = psycopg2.connect(TEST_DSN)
+        self.addCleanup(conn.close)
+        conn.autocommit = True
+        cache = ResultCache()
+        query = "SELECT a FROM pgtq_versioned"
+        with conn.cursor() as cur:
+            cur.execute("CREATE TEMP TABLE pgtq_versioned (a int)")
+            key, before = cache.key(cur, query)
+            # Adds a column without rewriting the table or touching its counters
+            cur.execute("ALTER TABLE pgtq_versioned ADD COLUMN b int")
+            after_key, after = cache.key(cur, query)
+        self.assertEqual(after_key, key)
+        self.assertNotEqual(after, before)
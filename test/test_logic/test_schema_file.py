@@ -0,0 +1,64 @@
+import glob
+import json
+import os
+import tempfile
+import unittest
+
+from pg_text_query.prompt import describe_database, get_canonical_prompt, get_default_prompt
+from pg_text_query.schema_file import (
+    COLUMN,
+    RELATION,
+    Identifier,
+    SchemaFile,
+    dump_schema,
+    json_to_schema_file,
+    schema_file_to_json,
+)
+
+
+SCHEMAS_DIR = os.path.join(os.path.dirname(__file__), "..", "test_prompts", "test_schemas")
+
+
+class SchemaFileTestCase(unittest.TestCase):
+    def test_json_round_trip_and_descriptions(self) -> None:
+        paths = sorted(glob.glob(os.path.join(SCHEMAS_DIR, "*.json")))
+        self.assertTrue(paths)
+        with tempfile.TemporaryDirectory() as tmp:
+            for json_path in paths:
+                with self.subTest(json_path=json_path):
+                    with open(json_path) as f:
+                        db_schema = json.load(f)
+                    path = os.path.join(tmp, "schema.pgtqs")
+                    json_to_schema_file(json_path, path)
+                    schema_file_to_json(path, os.path.join(tmp, "schema.json"))
+                    with open(os.path.join(tmp, "schema.json")) as f:
+                        self.assertEqual(json.load(f), db_schema)
+
+                    with SchemaFile.open(path) as schema:
+                        for include_types in (True, False):
+                            for canonical in (True, False):
+                                self.assertEqual(
+                                    describe_database(schema, include_types, canonical),
+                                    describe_database(db_schema, include_types, canonical),
+                                )
+                        self.assertEqual(get_default_prompt("q", schema), get_default_prompt("q", db_schema))
+                        self.assertEqual(get_canonical_prompt("q", schema), get_canonical_prompt("q", db_schema))
+
+    def test_identifier_index_and_fragments(self) -> None:
+        with open(os.path.join(SCHEMAS_DIR, "rental_schema.json")) as f:
+            schema = SchemaFile(dump_schema(json.load(f)))
+
+        self.assertIn(Identifier(RELATION, "public", "actor", None), schema.find("Actor"))
+        self.assertEqual(
+            {match.relation for match in schema.find("ACTOR_ID") if match.kind == COLUMN},
+            {"actor", "film_actor", "actor_info"},
+        )
+        self.assertEqual(schema.find("nowhere"), [])
+        self.assertEqual(
+            schema.describe_relations([("public", "actor"), ("public", "nowhere")], include_types=False),
+            '-- Table = "actor", columns = [actor_id, first_name, last_name, last_update]',
+        )
+
+    def test_rejects_other_files(self) -> None:
+        with self.assertRaises(ValueError):
+            SchemaFile(b'{"name": "not a schema file"}')
@@ -0,0 +1,71 @@
+import copy
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from pg_text_query.prompt import describe_database
+from pg_text_query.schema_file import dump_schema
+from pg_text_query.schema_store import SchemaStore, SchemaStoreStats
+
+from test_prompt import test_db_schema
+
+
+def tenant_schema(tenant: str) -> dict:
+    schema = copy.deepcopy(test_db_schema)
+    schema["name"] = tenant
+    schema["schemata"][0]["tables"][0]["name"] = f"{tenant}_penguins"
+    return schema
+
+
+class SchemaStoreTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.loads = []
+        self.lock = threading.Lock()
+        self.size = len(dump_schema(tenant_schema("t0")))
+
+    def load(self, tenant: str) -> dict:
+        with self.lock:
+            self.loads.append(tenant)
+        return tenant_schema(tenant)
+
+    def test_evicts_least_recently_used_within_budget(self) -> None:
+        store = SchemaStore(self.load, max_bytes=2 * self.size)
+        store.get("t0")
+        store.get("t1")
+        store.get("t0")  # t1 is now the least recently used
+        store.get("t2")
+
+        self.assertNotIn("t1", store)
+        self.assertEqual(store.stats(), SchemaStoreStats(
+            entries=2, bytes=2 * self.size, max_bytes=2 * self.size, hits=1, misses=3, loads=3, evictions=1,
+        ))
+
+        # Evicted tenants are reloaded on their next request
+        self.assertEqual(store.describe("t1"), describe_database(tenant_schema("t1")))
+        self.assertEqual(self.loads, ["t0", "t1", "t2", "t1"])
+        self.assertNotIn("t0", store)
+
+    def test_expired_and_invalidated_schemas_are_reloaded(self) -> None:
+        now = [0.0]
+        store = SchemaStore(self.load, ttl=10, clock=lambda: now[0])
+        store.get("t0")
+        now[0] = 5
+        store.get("t0")
+        now[0] = 20
+        store.get("t0")
+        store.invalidate("t0")
+        self.assertEqual(store.stats().bytes, 0)
+        store.get("t0")
+        self.assertEqual(self.loads, ["t0"] * 3)
+
+    def test_concurrent_misses_load_once(self) -> None:
+        def slow_load(tenant: str) -> dict:
+            time.sleep(0.05)
+            return self.load(tenant)
+
+        store = SchemaStore(slow_load)
+        with ThreadPoolExecutor(4) as pool:
+            schemas = list(pool.map(store.get, ["t0"] * 4))
+        self.assertEqual(self.loads, ["t0"])
+        self.assertEqual({schema.name for schema in schemas}, {"t0"})
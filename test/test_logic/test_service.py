@@ -0,0 +1,180 @@
+import asyncio
+import json
+import os
+import time
+import typing as t
+import unittest
+from unittest.mock import patch
+
+from pg_text_query.backends import Backend
+from pg_text_query.gen_query import QueryGenerator
+from pg_text_query.service import Service
+
+from stub_backend import StubBackend
+from test_prompt import test_db_schema
+
+
+TEST_DSN = os.getenv("PGTQ_TEST_DSN")
+
+
+async def call(app: Service, method: str, path: str, body: t.Any = None) -> t.Tuple[int, dict, t.Any]:
+    """Send one HTTP request to an ASGI app and return (status, headers, body)."""
+    payload = json.dumps(body).encode() if body is not None else b""
+    messages: list = []
+
+    async def receive() -> dict:
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    async def send(message: dict) -> None:
+        messages.append(message)
+
+    await app({"type": "http", "method": method, "path": path, "headers": []}, receive, send)
+    headers = {k.decode(): v.decode() for k, v in messages[0]["headers"]}
+    content = messages[1]["body"].decode()
+    if headers["content-type"] == "application/json":
+        content = json.loads(content)
+    return messages[0]["status"], headers, content
+
+
+class ServiceTestCase(unittest.TestCase):
+    def _service(self, backend: Backend, **kwargs: t.Any) -> Service:
+        service = Service(schemas={"penguins": test_db_schema}, generator=QueryGenerator(backend=backend), **kwargs)
+        self.addCleanup(service.close)
+        return service
+
+    def test_generate_validate_and_metrics(self) -> None:
+        service = self._service(StubBackend())
+
+        async def main() -> list:
+            return [
+                await call(service, "POST", "/generate", {"database": "penguins", "question": "how many?", "validate": True}),
+                await call(service, "POST", "/generate", {"database": "penguins", "question": "how many males?"}),
+                await call(service, "POST", "/validate", {"query": "select  1"}),
+                await call(service, "GET", "/health"),
+                await call(service, "GET", "/metrics"),
+            ]
+
+        first, second, validated, health, metrics = asyncio.run(main())
+
+        self.assertEqual(first[0], 200)
+        self.assertEqual(first[2]["query"], "SELECT COUNT(*) FROM penguins")
+        self.assertEqual(first[2]["prefix_hash"], second[2]["prefix_hash"])
+        self.assertEqual(validated[2], {"valid": True, "normalized": "SELECT 1"})
+        self.assertEqual(health[2], {"status": "ok", "in_flight": 0, "pending": 0})
+        self.assertIn('pgtq_requests_total{path="/generate",status="200"} 2', metrics[2])
+        self.assertIn('pgtq_stage_seconds_count{stage="request"} 2', metrics[2])
+        self.assertIn('pgtq_tokens_total{kind="prompt"} 20', metrics[2])
+
+    def test_rejects_bad_requests(self) -> None:
+        service = self._service(StubBackend(query="I don't know"))
+
+        async def main() -> list:
+            return [
+                await call(service, "GET", "/nowhere"),
+                await call(service, "GET", "/generate"),
+                await call(service, "POST", "/generate", {"database": "penguins"}),
+                await call(service, "POST", "/generate", {"database": "nhtsa", "question": "q"}),
+                await call(service, "POST", "/generate", {"database": "penguins", "question": "q", "params": {"n": 9}}),
+                await call(service, "POST", "/generate", {"database": "penguins", "question": "q", "validate": True}),
+            ]
+
+        statuses = [status for status, _, _ in asyncio.run(main())]
+        self.assertEqual(statuses, [404, 405, 400, 404, 400, 422])
+
+    def test_backpressure(self) -> None:
+        backend = StubBackend(latency=0.2)
+        service = self._service(backend, max_concurrency=1, max_pending=2)
+
+        async def main() -> list:
+            return await asyncio.gather(*[
+                call(service, "POST", "/generate", {"database": "penguins", "question": f"question {i}"})
+                for i in range(3)
+            ])
+
+        statuses = sorted(status for status, _, _ in asyncio.run(main()))
+        self.assertEqual(statuses, [200, 200, 503])
+        self.assertEqual(backend.calls, 2)
+
+    def test_identical_requests_share_a_slot(self) -> None:
+        backend = StubBackend(latency=0.1)
+        service = self._service(backend, max_concurrency=1, max_pending=1)
+
+        async def main() -> list:
+            return await asyncio.gather(*[
+                call(service, "POST", "/generate", {"database": "penguins", "question": "same question"})
+                for _ in range(4)
+            ])
+
+        self.assertEqual([status for status, _, _ in asyncio.run(main())], [200] * 4)
+        self.assertEqual(backend.calls, 1)
+
+    def test_skeleton_reuse(self) -> None:
+        backend = StubBackend("SELECT COUNT(*) FROM penguins WHERE year = 2007")
+        service = self._service(backend, skeleton_cache_entries=16)
+
+        async def main() -> list:
+            return [
+                await call(service, "POST", "/generate", {"database": "penguins", "question": question})
+                for question in ["how many in 2007?", "how many in 2008?", "how many in 2009?"]
+            ]
+
+        queries = [body["query"] for _, _, body in asyncio.run(main())]
+        self.assertEqual(queries[1:], [
+            "SELECT COUNT(*) FROM penguins WHERE year = 2008",
+            "SELECT COUNT(*) FROM penguins WHERE year = 2009",
+        ])
+        self.assertEqual(backend.calls, 1)
+
+    def test_schema_is_fetched_once(self) -> None:
+        service = Service(databases={"penguins": "dbname=penguins"}, generator=QueryGenerator(backend=StubBackend()))
+        self.addCleanup(service.close)
+        fetches = []
+
+        def fetch(database: str) -> dict:
+            fetches.append(database)
+            time.sleep(0.05)
+            return test_db_schema
+
+        async def main() -> list:
+            return await asyncio.gather(*[
+                call(service, "POST", "/generate", {"database": "penguins", "question": f"question {i}"})
+                for i in range(4)
+            ])
+
+        with patch.object(service, "_fetch_schema", side_effect=fetch):
+            self.assertEqual([status for status, _, _ in asyncio.run(main())], [200] * 4)
+            asyncio.run(main())
+        self.assertEqual(fetches, ["penguins"])
+
+    def test_schema_store_budget(self) -> None:
+        databases = {"penguins": "dbname=penguins", "islands": "dbname=islands"}
+        service = Service(databases=databases, generator=QueryGenerator(backend=StubBackend()), schema_cache_bytes=1)
+        self.addCleanup(service.close)
+
+        async def main() -> list:
+            for database in ["penguins", "islands", "penguins"]:
+                await call(service, "POST", "/generate", {"database": database, "question": "how many?"})
+            return await call(service, "GET", "/metrics")
+
+        with patch.object(service, "_fetch_schema", return_value=test_db_schema) as fetch:
+            _, _, metrics = asyncio.run(main())
+        self.assertEqual(fetch.call_count, 3)
+        self.assertIn("pgtq_cached_schemas 1\n", metrics)
+        self.assertIn('pgtq_events_total{event="eviction"} 2', metrics)
+
+
+@unittest.skipUnless(TEST_DSN, "PGTQ_TEST_DSN not set")
+class LocalPostgresServiceTestCase(unittest.TestCase):
+    def test_generate_and_explain(self) -> None:
+        service = Service(databases={"test": TEST_DSN}, generator=QueryGenerator(backend=StubBackend("SELECT 1")))
+        self.addCleanup(service.close)
+
+        async def main() -> list:
+            return [
+                await call(service, "POST", "/generate", {"database": "test", "question": "one", "explain": True}),
+                await call(service, "POST", "/explain", {"database": "test", "query": "SELECT * FROM nowhere"}),
+            ]
+
+        generated, failed = asyncio.run(main())
+        self.assertEqual(generated[2]["cost"]["plan"]["plan_rows"], 1)
+        self.assertEqual(failed[0], 400)
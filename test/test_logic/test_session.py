@@ -0,0 +1,74 @@
+import unittest
+from unittest.mock import Mock
+
+from pg_text_query.errors import QueryGenError
+from pg_text_query.gen_query import QueryGenerator
+from pg_text_query.session import ChatSession
+from pg_text_query.transport import Transport
+
+from test_prompt import test_db_schema
+
+
+def _chat_response(content: str) -> dict:
+    return {"choices": [{"message": {"role": "assistant", "content": content}}]}
+
+
+class ChatSessionTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.transport = Mock(spec=Transport)
+        self.generator = QueryGenerator(self.transport)
+
+    def test_follow_up_includes_previous_turn(self) -> None:
+        self.transport.create.side_effect = [
+            _chat_response("SELECT island, COUNT(*) FROM penguins GROUP BY island;"),
+            _chat_response("```sql\nSELECT island, COUNT(*) FROM penguins WHERE sex = 'female' GROUP BY island;\n```"),
+        ]
+        session = ChatSession(test_db_schema, self.generator)
+
+        session.ask("how many penguins are on each island?")
+        query = session.ask("now only count female penguins", validate_sql=True)
+
+        self.assertEqual(query, "SELECT island, COUNT(*) FROM penguins WHERE sex = 'female' GROUP BY island")
+        first, second = [c.args[1]["messages"] for c in self.transport.create.call_args_list]
+        self.assertEqual(first[0], second[0])
+        self.assertIn('-- Table = "penguins"', second[0]["content"])
+        self.assertEqual([m["role"] for m in second], ["system", "user", "assistant", "user"])
+        self.assertEqual(second[2]["content"], "SELECT island, COUNT(*) FROM penguins GROUP BY island")
+        # The schema is only sent in the system message
+        self.assertTrue(all("penguins, columns" not in m["content"] for m in second[1:]))
+
+    def test_completion_prompt_includes_schema(self) -> None:
+        self.transport.create.return_value = {"choices": [{"text": "SELECT COUNT(*) FROM penguins"}]}
+        session = ChatSession(test_db_schema, self.generator, completion_type="single")
+
+        session.ask("how many penguins are there?")
+
+        endpoint, request = self.transport.create.call_args.args
+        self.assertEqual(endpoint, "completion")
+        self.assertTrue(request["prompt"].startswith(session.system))
+        self.assertIn('-- Table = "penguins"', request["prompt"])
+        self.assertIn("how many penguins are there?", request["prompt"])
+
+    def test_history_stays_within_budget(self) -> None:
+        columns = ["species", "island", "bill_length_mm", "bill_depth_mm", "flipper_length_mm", "body_mass_g", "sex", "year"]
+        session = ChatSession(test_db_schema, self.generator, max_history_tokens=125)
+        for i in range(10):
+            self.transport.create.return_value = _chat_response(f"SELECT {i}, {', '.join(columns)} FROM penguins")
+            session.ask(f"question number {i}")
+
+        history = session.history()
+
+        self.assertEqual(history[0]["content"], "Earlier in this conversation I asked: question number 6")
+        self.assertEqual([m["content"] for m in history[2::2]], ["question number 7", "question number 8", "question number 9"])
+        self.assertLessEqual(sum(-(-len(m["content"]) // 4) for m in history), 125)
+        self.assertEqual(len(session.turns), 10)
+
+        session.summarize = False
+        self.assertEqual(session.history()[0]["content"], "question number 7")
+
+    def test_failed_turn_is_not_kept(self) -> None:
+        self.transport.create.return_value = _chat_response("I can't answer that.")
+        session = ChatSession(test_db_schema, self.generator)
+        with self.assertRaises(QueryGenError):
+            session.ask("what is the meaning of life?", validate_sql=True)
+        self.assertEqual(session.turns, [])
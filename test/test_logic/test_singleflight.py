@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock
+
+from pg_text_query.gen_query import QueryGenerator
+from pg_text_query.singleflight import AsyncSingleFlight, SingleFlight
+from pg_text_query.trace import RequestTrace
+from pg_text_query.transport import Transport
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    def test_concurrent_calls_share_result_and_error(self) -> None:
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def slow() -> str:
+            calls.append(1)
+            release.wait()
+            return "shared"
+
+        with ThreadPoolExecutor(5) as pool:
+            futures = [pool.submit(flight.do, "key", slow) for _ in range(5)]
+            time.sleep(0.05)
+            release.set()
+            self.assertEqual([f.result() for f in futures], ["shared"] * 5)
+        self.assertEqual(len(calls), 1)
+
+        def failing() -> str:
+            release.wait()
+            raise ValueError("boom")
+
+        release.clear()
+        with ThreadPoolExecutor(3) as pool:
+            futures = [pool.submit(flight.do, "key", failing) for _ in range(3)]
+            time.sleep(0.05)
+            release.set()
+            for future in futures:
+                with self.assertRaises(ValueError):
+                    future.result()
+
+        # Finished calls are not cached
+        self.assertEqual(flight.do("key", lambda: "again"), "again")
+
+    def test_async_cancelling_first_caller_does_not_cancel_call(self) -> None:
+        async def main() -> list:
+            flight = AsyncSingleFlight()
+            calls = []
+
+            async def slow() -> str:
+                calls.append(1)
+                await asyncio.sleep(0.05)
+                return "shared"
+
+            first = asyncio.ensure_future(flight.do("key", slow))
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(flight.do("key", slow))
+            await asyncio.sleep(0)
+            first.cancel()
+            return [await second, len(calls), first.cancelled()]
+
+        self.assertEqual(asyncio.run(main()), ["shared", 1, True])
+
+
+class CoalescedGenerationTestCase(unittest.TestCase):
+    def _transport(self) -> Mock:
+        transport = Mock(spec=Transport)
+
+        def create(endpoint: str, request: dict) -> dict:
+            time.sleep(0.1)
+            return {
+                "choices": [{"text": f"SELECT COUNT(*) FROM {request['prompt']}"}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+            }
+
+        transport.create.side_effect = create
+        return transport
+
+    def test_threads_share_identical_generations(self) -> None:
+        transport = self._transport()
+        generator = QueryGenerator(transport)
+
+        def generate(prompt: str) -> tuple:
+            with RequestTrace() as request_trace:
+                query = generator.generate(prompt, completion_type="single", temperature=0)
+            return query, request_trace.count("coalesced"), request_trace.usage.get("total_tokens")
+
+        with ThreadPoolExecutor(6) as pool:
+            results = list(pool.map(generate, ["penguins"] * 5 + ["islands"]))
+
+        self.assertEqual(transport.create.call_count, 2)
+        self.assertEqual([query for query, _, _ in results[:5]], ["SELECT COUNT(*) FROM penguins"] * 5)
+        self.assertEqual(sum(coalesced for _, coalesced, _ in results), 4)
+        # Usage is only recorded by the caller that made the request
+        self.assertEqual(sorted(tokens for _, coalesced, tokens in results if not coalesced), [15, 15])
+        self.assertEqual({tokens for _, coalesced, tokens in results if coalesced}, {0})
+        self.assertEqual(results[5][0], "SELECT COUNT(*) FROM islands")
+
+        # Different merged configs are different requests
+        generator.generate("penguins", completion_type="single", temperature=0.5)
+        self.assertEqual(transport.create.call_count, 3)
+
+    def test_asyncio_shares_identical_generations(self) -> None:
+        transport = self._transport()
+        generator = QueryGenerator(transport)
+
+        async def main() -> list:
+            return await asyncio.gather(*[
+                generator.agenerate("penguins", validate_sql=True, completion_type="single") for _ in range(5)
+            ])
+
+        with RequestTrace() as request_trace:
+            self.assertEqual(asyncio.run(main()), ["SELECT COUNT(*) FROM penguins"] * 5)
+        transport.create.assert_called_once()
+        self.assertEqual(request_trace.count("coalesced"), 4)
+        self.assertEqual(request_trace.usage["total_tokens"], 15)
+
+    def test_coalescing_can_be_disabled(self) -> None:
+        transport = self._transport()
+        generator = QueryGenerator(transport, coalesce=False)
+        with ThreadPoolExecutor(3) as pool:
+            list(pool.map(lambda _: generator.generate("penguins", completion_type="single"), range(3)))
+        self.assertEqual(transport.create.call_count, 3)
@@ -0,0 +1,79 @@
+import unittest
+
+from pg_text_query.skeleton import Literal, SkeletonCache, question_pattern
+
+
+class SkeletonCacheTestCase(unittest.TestCase):
+    def test_question_pattern(self) -> None:
+        self.assertEqual(
+            question_pattern('Orders  in March 2023 over 99.5 for "Acme" since 2023-01-31?'),
+            (
+                "orders in {month} {number} over {number} for {string} since {date}",
+                [
+                    Literal("month", "March"), Literal("number", "2023"), Literal("number", "99.5"),
+                    Literal("string", "Acme"), Literal("date", "2023-01-31"),
+                ],
+            ),
+        )
+        # Lowercase month names are ordinary words
+        self.assertEqual(question_pattern("which may be late")[1], [])
+
+    def test_fills_literals_into_stored_skeletons(self) -> None:
+        skeletons = SkeletonCache()
+        self.assertTrue(skeletons.store(
+            "orders in March 2023",
+            "SELECT count(*) FROM orders WHERE extract(month FROM at) = 3 AND extract(year FROM at) = 2023",
+        ))
+        self.assertTrue(skeletons.store(
+            "sales for 'Acme' in May", "SELECT sum(total) FROM sales WHERE name = 'Acme' AND month = 'may'",
+        ))
+
+        self.assertEqual(
+            skeletons.lookup("Orders in April 2022?"),
+            "SELECT count(*) FROM orders WHERE extract(month FROM at) = 4 AND extract(year FROM at) = 2022",
+        )
+        self.assertEqual(
+            skeletons.lookup('sales for "O\'Brien" in June'),
+            "SELECT sum(total) FROM sales WHERE name = 'O''Brien' AND month = 'june'",
+        )
+        # Other patterns and namespaces miss
+        self.assertIsNone(skeletons.lookup("orders in April"))
+        self.assertIsNone(skeletons.lookup("orders in April 2022", namespace="other schema"))
+        self.assertEqual(tuple(skeletons.stats()), (2, 2, 2, 2, 0, 0))
+
+    def test_ordinals_and_function_arguments_are_not_slots(self) -> None:
+        skeletons = SkeletonCache()
+        self.assertTrue(skeletons.store(
+            "top 1 species", "SELECT species, count(*) FROM penguins GROUP BY 1 ORDER BY 2 DESC LIMIT 1",
+        ))
+        self.assertTrue(skeletons.store(
+            "customers born in March",
+            "SELECT substr(name, 1, 3) FROM customers WHERE extract(month FROM born) = 3",
+        ))
+
+        self.assertEqual(
+            skeletons.lookup("top 3 species"),
+            "SELECT species, count(*) FROM penguins GROUP BY 1 ORDER BY 2 DESC LIMIT 3",
+        )
+        self.assertEqual(
+            skeletons.lookup("customers born in April"),
+            "SELECT substr(name, 1, 3) FROM customers WHERE extract(month FROM born) = 4",
+        )
+
+    def test_rejects_queries_that_are_not_parameterizable(self) -> None:
+        skeletons = SkeletonCache()
+        # The literal doesn't appear in the query
+        self.assertFalse(skeletons.store("orders in 2023", "SELECT count(*) FROM orders WHERE at >= '2023-01-01'"))
+        # A constant could stand for either literal
+        self.assertFalse(skeletons.store("top 5 of 5", "SELECT * FROM t LIMIT 5"))
+        # The literal appears as more than one constant
+        self.assertFalse(skeletons.store("nests with 1 egg", "SELECT * FROM nests WHERE eggs = 1 LIMIT 1"))
+        self.assertFalse(skeletons.store("orders in 2023", "not SQL 2023"))
+        self.assertEqual(len(skeletons), 0)
+
+    def test_evicts_least_recently_used(self) -> None:
+        skeletons = SkeletonCache(max_entries=2)
+        for table in ("a", "b", "c"):
+            skeletons.store(f"count {table}", f"SELECT count(*) FROM {table}")
+        self.assertIsNone(skeletons.lookup("count a"))
+        self.assertEqual(skeletons.lookup("count c"), "SELECT count(*) FROM c")
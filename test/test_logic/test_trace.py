@@ -0,0 +1,92 @@
+import importlib.util
+import unittest
+from unittest.mock import Mock
+
+import openai
+
+from pg_text_query import trace
+from pg_text_query.db_schema import get_db_schema
+from pg_text_query.gen_query import QueryGenerator
+from pg_text_query.ratelimit import RateLimitedTransport, RetryPolicy
+from pg_text_query.trace import RequestTrace, Tracer, set_tracer
+from pg_text_query.transport import Transport
+
+
+class TraceTestCase(unittest.TestCase):
+    def test_noop_without_tracers(self) -> None:
+        with trace.span("generate") as span:
+            span.set(backend="completion")
+        self.assertIs(span, trace._NOOP_SPAN)
+
+    def test_generate_records_stages_and_usage(self) -> None:
+        transport = Mock(spec=Transport)
+        transport.create.side_effect = [
+            openai.error.ServiceUnavailableError("overloaded", http_status=503),
+            {
+                "choices": [{"text": "SELECT COUNT(*) FROM penguins"}],
+                "usage": {"prompt_tokens": 12, "completion_tokens": 8, "total_tokens": 20},
+            },
+        ]
+        limited = RateLimitedTransport(transport, retry_policy=RetryPolicy(seed=0), sleep=Mock())
+        generator = QueryGenerator(limited)
+
+        with RequestTrace() as request_trace:
+            generator.generate("-- how many penguins?", validate_sql=True, completion_type="single")
+
+        spans = {span.name: span for span in request_trace.spans}
+        self.assertEqual(
+            [span.name for span in request_trace.spans],
+            ["queue_wait", "queue_wait", "request", "validation", "generate"],
+        )
+        self.assertIs(spans["request"].parent, spans["generate"])
+        self.assertIs(spans["queue_wait"].parent, spans["request"])
+        self.assertEqual(spans["validation"].attributes["valid"], True)
+        self.assertEqual(request_trace.usage, {"prompt_tokens": 12, "completion_tokens": 8, "total_tokens": 20})
+        self.assertEqual(request_trace.count("retry"), 1)
+        self.assertEqual(request_trace.events[0][1]["error"], "ServiceUnavailableError")
+        self.assertGreaterEqual(request_trace.durations()["generate"], request_trace.durations()["request"])
+
+        # Spans outside the block are not collected
+        with trace.span("generate"):
+            pass
+        self.assertEqual(len(request_trace.spans), 5)
+
+    def test_schema_fetch_and_global_tracer(self) -> None:
+        tracer = Mock(spec=Tracer)
+        set_tracer(tracer)
+        self.addCleanup(set_tracer, None)
+        cur = Mock()
+        cur.description = [Mock() for _ in range(3)]
+        for column, name in zip(cur.description, ["name", "schemata.name", "schemata.tables.name"]):
+            column.name = name
+        cur.fetchall.return_value = []
+
+        get_db_schema(cur, "penguins")
+
+        span = tracer.on_end.call_args.args[0]
+        self.assertEqual(span.name, "schema_fetch")
+        self.assertEqual(span.attributes, {"db_name": "penguins", "rows": 0})
+        tracer.on_start.assert_called_once_with(span)
+
+    def test_failed_span_records_error(self) -> None:
+        with RequestTrace() as request_trace:
+            with self.assertRaises(ValueError):
+                with trace.span("validation"):
+                    raise ValueError("bad")
+        self.assertEqual(request_trace.spans[0].attributes["error"], "ValueError")
+        self.assertIsNotNone(request_trace.spans[0].duration)
+
+    @unittest.skipUnless(importlib.util.find_spec("prometheus_client"), "prometheus_client is not installed")
+    def test_prometheus_tracer(self) -> None:
+        import prometheus_client
+
+        registry = prometheus_client.CollectorRegistry()
+        set_tracer(trace.PrometheusTracer(registry))
+        self.addCleanup(set_tracer, None)
+        with trace.span("request") as span:
+            span.set(prompt_tokens=12, completion_tokens=8)
+        trace.event("cache_hit")
+
+        self.assertEqual(registry.get_sample_value("pgtq_stage_seconds_count", {"stage": "request"}), 1)
+        self.assertEqual(registry.get_sample_value("pgtq_tokens_total", {"kind": "prompt"}), 12)
+        self.assertEqual(registry.get_sample_value("pgtq_events_total", {"event": "cache_hit"}), 1)
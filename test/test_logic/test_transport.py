@@ -0,0 +1,132 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+import openai
+
+from pg_text_query.errors import EnvVarError, QueryGenError
+from pg_text_query.gen_query import generate_query
+from pg_text_query.transport import (
+    OpenAITransport, RecordingTransport, ReplayTransport, Transport, set_transport
+)
+
+
+class TransportTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        fd, self.path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+        self.inner = Mock(spec=Transport)
+        self.inner.create.return_value = {
+            "id": "cmpl-1",
+            "choices": [{"text": "SELECT COUNT(*) FROM penguins", "index": 0}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 7, "total_tokens": 17},
+        }
+
+    def tearDown(self) -> None:
+        set_transport(None)
+        os.remove(self.path)
+
+    def test_record_then_replay(self) -> None:
+        set_transport(RecordingTransport(self.path, self.inner))
+        recorded = generate_query("-- how many penguins?", temperature=0.5)
+        self.inner.create.assert_called_once()
+
+        set_transport(ReplayTransport(self.path))
+        replayed = generate_query("-- how many penguins?", temperature=0.5)
+        self.assertEqual(replayed, recorded)
+        self.inner.create.assert_called_once()
+
+    def test_replay_miss(self) -> None:
+        set_transport(ReplayTransport(self.path))
+        with self.assertRaises(QueryGenError):
+            generate_query("-- never recorded")
+
+    def test_replay_injects_errors_and_latency(self) -> None:
+        RecordingTransport(self.path, self.inner).create("completion", {"prompt": "x"})
+        transport = ReplayTransport(self.path, latency=0.25, error_rate=1.0, seed=0)
+        with patch("pg_text_query.transport.time.sleep") as mock_sleep:
+            with self.assertRaises((openai.error.RateLimitError, openai.error.ServiceUnavailableError)):
+                transport.create("completion", {"prompt": "x"})
+        mock_sleep.assert_called_once_with(0.25)
+
+
+def _mock_response(status: int, body: dict) -> Mock:
+    response = Mock(ok=status < 400, status_code=status, text=str(body), headers={})
+    response.json.return_value = body
+    return response
+
+
+class OpenAITransportTestCase(unittest.TestCase):
+    def test_requires_api_key(self) -> None:
+        with patch.dict(os.environ, {}, clear=True), patch.multiple(openai, api_key=None, api_key_path=None):
+            with self.assertRaises(EnvVarError):
+                OpenAITransport()
+
+    def test_falls_back_to_openai_module_settings(self) -> None:
+        with patch.multiple(openai, api_key="MODULE_KEY", api_base="http://localhost:8080/v1/", organization="org"):
+            transport = OpenAITransport()
+        self.assertEqual(transport.session.headers["Authorization"], "Bearer MODULE_KEY")
+        self.assertEqual(transport.session.headers["OpenAI-Organization"], "org")
+        self.assertEqual(
+            transport.url("completion", {"prompt": "a"}), ("http://localhost:8080/v1/completions", {"prompt": "a"})
+        )
+
+    def test_azure_deployment_urls(self) -> None:
+        settings = {"api_type": "azure", "api_version": "2022-12-01", "api_base": "https://pgtq.openai.azure.com"}
+        with patch.multiple(openai, **settings):
+            transport = OpenAITransport(api_key="AZURE_KEY")
+        self.assertEqual(transport.session.headers["api-key"], "AZURE_KEY")
+        self.assertNotIn("Authorization", transport.session.headers)
+
+        body = {"choices": [{"text": "SELECT 1"}]}
+        with patch.object(transport.session, "post", return_value=_mock_response(200, body)) as mock_post:
+            transport.create("completion", {"engine": "sql-model", "prompt": "a"})
+        self.assertEqual(
+            mock_post.call_args.args,
+            ("https://pgtq.openai.azure.com/openai/deployments/sql-model/completions?api-version=2022-12-01",),
+        )
+        self.assertEqual(mock_post.call_args.kwargs["json"], {"prompt": "a"})
+        with self.assertRaises(openai.error.InvalidRequestError):
+            transport.url("completion", {"prompt": "no deployment"})
+
+    def test_reuses_pooled_session(self) -> None:
+        transport = OpenAITransport(api_key="FAKE_KEY", pool_maxsize=4, timeout=3.0)
+        adapter = transport.session.get_adapter("https://api.openai.com")
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertTrue(adapter._pool_block)
+
+        body = {"choices": [{"text": "SELECT 1"}]}
+        with patch.object(transport.session, "post", return_value=_mock_response(200, body)) as mock_post:
+            transport.create("completion", {"prompt": "a"})
+            transport.create("completion", {"prompt": "b"})
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(mock_post.call_args.args, ("https://api.openai.com/v1/completions",))
+        self.assertEqual(mock_post.call_args.kwargs["timeout"], 3.0)
+        self.assertEqual(transport.session.headers["Authorization"], "Bearer FAKE_KEY")
+
+    def test_maps_error_status(self) -> None:
+        transport = OpenAITransport(api_key="FAKE_KEY")
+        body = {"error": {"message": "Rate limit reached"}}
+        with patch.object(transport.session, "post", return_value=_mock_response(429, body)):
+            with self.assertRaises(openai.error.RateLimitError) as ctx:
+                transport.create("chat_completion", {"messages": []})
+        self.assertEqual(ctx.exception.http_status, 429)
+        self.assertIn("Rate limit reached", str(ctx.exception))
+
+    def test_streams_server_sent_events(self) -> None:
+        transport = OpenAITransport(api_key="FAKE_KEY")
+        response = _mock_response(200, {})
+        response.iter_lines.return_value = [
+            b'data: {"choices": [{"delta": {"role": "assistant"}}]}',
+            b"",
+            b'data: {"choices": [{"delta": {"content": "SELECT"}}]}',
+            b'data: {"choices": [{"delta": {"content": " 1"}}]}',
+            b"data: [DONE]",
+        ]
+        with patch.object(transport.session, "post", return_value=response) as mock_post:
+            pieces = list(transport.stream("chat_completion", {"messages": []}))
+        self.assertEqual(pieces, ["SELECT", " 1"])
+        self.assertTrue(mock_post.call_args.kwargs["json"]["stream"])
+        self.assertTrue(mock_post.call_args.kwargs["stream"])
+        response.close.assert_called_once()
@@ -1,23 +1,47 @@
-"""Early example of testing query generation on a live db.
+"""Execution-based testing of query generation against a local Postgres db.
 
-Minimal start - not the most usable but demonstrates the idea.
+For each test suite, a throwaway database is created on a local server and
+loaded from the suite's schema file (one of test/test_prompts/test_schemas),
+then seeded from the CSV files its seed_data maps tables to (in
+test/test_model/test_data, with NA for NULL) and any optional setup_sql
+statements. Test cases then run in parallel across a connection pool: each
+generated query is streamed back through a server-side cursor and compared
+to the expected records by hashing rows as they arrive, so neither side is
+materialized as a full result list.
+
+Generation goes through an on-disk cache keyed on the prompt and completion
+config, so repeated runs never call the API for a prompt seen before. With
+PGTQ_OFFLINE set, cache misses are recorded as failures instead of calling the
+API, which makes full-suite runs take seconds.
 
 Assumes the following env vars are set:
-    - BITIO_KEY -> a bit.io API key with appropriate access to any dbs in the test suite
-    - OPENAI_API_KEY -> an OpenAI API key for calling the completions endpoint
+    - PGTQ_TEST_DSN -> a libpq connection string for a local Postgres role
+      allowed to create databases, e.g. "host=localhost user=postgres"
+    - OPENAI_API_KEY -> an OpenAI API key (only needed on cache misses)
+
+Optional env vars:
+    - PGTQ_TEST_WORKERS -> number of test cases run in parallel (default 8)
+    - PGTQ_GENERATION_CACHE -> path of the generation cache file
+    - PGTQ_OFFLINE -> if set, never call the API
 """
 import csv
+import datetime
+import decimal
+import hashlib
 import json
 import os
+import threading
 import typing as t
 import uuid
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
-import bitdotio
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 import structlog
 
 from pg_text_query import (
-    get_db_schema, get_default_prompt, generate_query, is_valid_query, QueryGenError
+    get_db_schema, get_default_prompt, generate_query, is_valid_query, iter_query_rows
 )
 from pg_text_query.gen_query import DEFAULT_COMPLETION_CONFIG
 
@@ -26,88 +50,288 @@ logger = structlog.getLogger()
 
 TEST_PATH = "test/test_model"
 TEST_SUITES_PATH = os.path.join(TEST_PATH, "test_suites")
+TEST_SCHEMAS_PATH = "test/test_prompts/test_schemas"
+TEST_DATA_PATH = os.path.join(TEST_PATH, "test_data")
 RESULTS_PATH = os.path.join(TEST_PATH, "test_results")
 RESULT_HEADER = ["timestamp", "test_suite", "test_id", "db_name", "text", "prompt", "query", "valid", "success"]
 
-b = bitdotio.bitdotio(os.getenv("BITIO_KEY"))
+TEST_DSN = os.getenv("PGTQ_TEST_DSN", "")
+WORKERS = int(os.getenv("PGTQ_TEST_WORKERS", "8"))
+GENERATION_CACHE_PATH = os.getenv(
+    "PGTQ_GENERATION_CACHE", os.path.join(TEST_PATH, "generation_cache.json")
+)
+OFFLINE = bool(os.getenv("PGTQ_OFFLINE"))
 
+# information_schema data_types that cannot be used verbatim in DDL
+FIXTURE_TYPE_OVERRIDES = {"USER-DEFINED": "text", "ARRAY": "text[]"}
+_HASH_MODULUS = 2 ** 64
 
-def run_suite(suite: t.Dict[str, t.Any], filename: str, results_writer: t.Any) -> None:
-    suite_results = []
 
-    db_name = suite["db_name"]
+class GenerationCache:
+    """A thread-safe, JSON-file backed cache of generated queries."""
+
+    def __init__(self, path: str, offline: bool = False) -> None:
+        self.path = path
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            with open(path) as f:
+                self._entries: t.Dict[str, str] = json.load(f)
+        except FileNotFoundError:
+            self._entries = {}
 
-    # Extract a structured db schema from Postgres
-    with b.pooled_cursor(db_name) as cur:
-        db_schema = get_db_schema(cur, suite["db_name"])
-
-    success_count = 0
-    for test_case in suite["test_cases"]:
-        test_id = test_case["id"]
-        text = test_case["text"]
-        
-        # Generate prompt
-        prompt = get_default_prompt(test_case["text"], db_schema)
-        log_args = {"test_id": test_id, "db_name": db_name, "text": text, "prompt": prompt}
-        logger.info("generated test prompt", **log_args)
-
-        # Generate query w/o validation
+    @staticmethod
+    def key(prompt: str) -> str:
+        payload = json.dumps([prompt, DEFAULT_COMPLETION_CONFIG], sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def generate(self, prompt: str) -> t.Optional[str]:
+        key = self.key(prompt)
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+        if self.offline:
+            return None
         query = generate_query(prompt)
-        log_args["query"] = query
-        logger.info("generated test query", **log_args)
-
-        # Validate query
-        valid = is_valid_query(query)
-        log_args["valid"] = valid
-        logger.info("validated query", **log_args)
-
-        success = False
-        if valid:
-            try:
-                with b.pooled_cursor(db_name) as cur:
-                    cur.execute(query)
-                    result = [list(record) for record in cur.fetchall()]
-                    result = result if test_case["ordered"] else sorted(result)
-                    expected = test_case["expected_records"] if test_case["ordered"] else sorted(test_case["expected_records"])
-                    success = result == expected
-                    if not success:
-                        log_args["expected_records"] = expected
-                        log_args["actual_records"] = result
-            except Exception:
-                logger.exception("error when executing generated query", **log_args)
-        
-        log_args["success"] = success
-        logger.info("executed query", **log_args)
-
-        # Record result
-        results_writer.writerow([
-            str(datetime.now()),
-            filename,
-            test_id,
-            db_name,
-            text,
-            prompt,
-            query,
-            valid,
-            success,
-        ])
-        success_count += int(success)
-    logger.info(f"finished test suite with {success_count} of {len(suite['test_cases'])} successful", **log_args)
+        with self._lock:
+            self._entries[key] = query
+            self._dirty = True
+        return query
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            with open(self.path, "w") as f:
+                json.dump(self._entries, f, indent=2, sort_keys=True)
+            self._dirty = False
+
+
+def _quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def fixture_ddl(db_schema: t.Dict[str, t.Any]) -> t.List[str]:
+    """Build statements recreating the tables (and comments) of a db_schema."""
+    statements = []
+    for schema in db_schema["schemata"]:
+        schema_ident = _quote_ident(schema["name"])
+        if schema["name"] != "public":
+            statements.append(f"CREATE SCHEMA IF NOT EXISTS {schema_ident}")
+        for table in schema["tables"]:
+            table_ident = f"{schema_ident}.{_quote_ident(table['name'])}"
+            columns = sorted(table["columns"], key=lambda c: c["ordinal_position"])
+            column_defs = ", ".join(
+                f"{_quote_ident(c['name'])} {FIXTURE_TYPE_OVERRIDES.get(c['data_type'], c['data_type'])}"
+                for c in columns
+            )
+            statements.append(f"CREATE TABLE {table_ident} ({column_defs})")
+            if table.get("description"):
+                statements.append(
+                    f"COMMENT ON TABLE {table_ident} IS {_quote_literal(table['description'])}"
+                )
+            for c in columns:
+                if c.get("description"):
+                    statements.append(
+                        f"COMMENT ON COLUMN {table_ident}.{_quote_ident(c['name'])} "
+                        f"IS {_quote_literal(c['description'])}"
+                    )
+    return statements
+
+
+def load_seed_data(cur: t.Any, seed_data: t.Dict[str, str]) -> None:
+    """COPY each CSV file (with a header row) in seed_data into its "schema.table"."""
+    for table, filename in seed_data.items():
+        with open(os.path.join(TEST_DATA_PATH, filename), newline="") as f:
+            header = next(csv.reader(f))
+            f.seek(0)
+            table_ident = ".".join(_quote_ident(part) for part in table.split("."))
+            columns = ", ".join(_quote_ident(name) for name in header)
+            cur.copy_expert(
+                f"COPY {table_ident} ({columns}) FROM STDIN WITH (FORMAT csv, HEADER true, NULL 'NA')", f
+            )
+
+
+def _canonical_value(value: t.Any) -> t.Any:
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.time, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return [_canonical_value(v) for v in value]
+    return value
+
+
+def _row_hash(row: t.Iterable[t.Any]) -> bytes:
+    canonical = json.dumps([_canonical_value(v) for v in row], default=str)
+    return hashlib.sha256(canonical.encode()).digest()
+
+
+def result_digest(rows: t.Iterable[t.Iterable[t.Any]], ordered: bool) -> t.Tuple[int, str]:
+    """Return (row count, digest) for rows, consuming them one at a time.
+
+    Unordered digests add up per-row hashes modulo 2**64, which is insensitive
+    to row order but (unlike XOR) still distinguishes duplicate rows. Ordered
+    digests chain every row hash through a single running hash.
+    """
+    count = 0
+    if ordered:
+        running = hashlib.sha256()
+        for row in rows:
+            running.update(_row_hash(row))
+            count += 1
+        return count, running.hexdigest()
+
+    total = 0
+    for row in rows:
+        total = (total + int.from_bytes(_row_hash(row)[:8], "big")) % _HASH_MODULUS
+        count += 1
+    return count, format(total, "016x")
+
+
+class LocalFixture:
+    """A throwaway database loaded from a suite's schema file, seed data and setup SQL."""
+
+    def __init__(self, suite: t.Dict[str, t.Any], workers: int) -> None:
+        self.db_name = f"pgtq_test_{uuid.uuid4().hex[:12]}"
+        admin = psycopg2.connect(TEST_DSN)
+        admin.autocommit = True
+        try:
+            with admin.cursor() as cur:
+                cur.execute(f"CREATE DATABASE {self.db_name}")
+        finally:
+            admin.close()
+
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            1, workers, psycopg2.extensions.make_dsn(TEST_DSN, dbname=self.db_name)
+        )
+        with open(os.path.join(TEST_SCHEMAS_PATH, suite["schema"])) as f:
+            source_schema = json.load(f)
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                for statement in fixture_ddl(source_schema):
+                    cur.execute(statement)
+                load_seed_data(cur, suite.get("seed_data", {}))
+                for statement in suite.get("setup_sql", []):
+                    cur.execute(statement)
+            conn.commit()
+            # Read back through the real extraction path, as a live db would be
+            with conn.cursor() as cur:
+                self.db_schema = get_db_schema(cur, self.db_name)
+            conn.rollback()
+        finally:
+            self.pool.putconn(conn)
+
+    def close(self) -> None:
+        self.pool.closeall()
+        admin = psycopg2.connect(TEST_DSN)
+        admin.autocommit = True
+        try:
+            with admin.cursor() as cur:
+                cur.execute(f"DROP DATABASE IF EXISTS {self.db_name}")
+        finally:
+            admin.close()
+
+
+def run_case(
+    fixture: LocalFixture,
+    cache: GenerationCache,
+    test_case: t.Dict[str, t.Any],
+    log_args: t.Dict[str, t.Any],
+) -> t.Tuple[str, str, bool, bool]:
+    """Generate, validate and execute one test case; return its result."""
+    prompt = get_default_prompt(test_case["text"], fixture.db_schema)
+    query = cache.generate(prompt)
+    if query is None:
+        logger.warning("generation cache miss in offline mode", **log_args)
+        return prompt, "", False, False
+
+    valid = bool(is_valid_query(query))
+    success = False
+    if valid:
+        expected = test_case["expected_records"]
+        ordered = test_case["ordered"]
+        conn = fixture.pool.getconn()
+        try:
+            # Fetch one row more than expected, so oversized results fail fast
+            rows = iter_query_rows(conn, query, max_rows=len(expected) + 1)
+            success = result_digest(rows, ordered) == result_digest(expected, ordered)
+        except Exception:
+            logger.exception("error when executing generated query", query=query, **log_args)
+        finally:
+            conn.rollback()
+            fixture.pool.putconn(conn)
+
+    logger.info("executed query", query=query, valid=valid, success=success, **log_args)
+    return prompt, query, valid, success
+
+
+def run_suite(
+    suite: t.Dict[str, t.Any], filename: str, results_writer: t.Any, cache: GenerationCache
+) -> None:
+    db_name = suite["db_name"]
+    fixture = LocalFixture(suite, WORKERS)
+    try:
+        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            futures = [
+                (
+                    test_case,
+                    executor.submit(
+                        run_case,
+                        fixture,
+                        cache,
+                        test_case,
+                        {"test_id": test_case["id"], "db_name": db_name, "text": test_case["text"]},
+                    ),
+                )
+                for test_case in suite["test_cases"]
+            ]
+            success_count = 0
+            for test_case, future in futures:
+                prompt, query, valid, success = future.result()
+                results_writer.writerow([
+                    str(datetime.datetime.now()),
+                    filename,
+                    test_case["id"],
+                    db_name,
+                    test_case["text"],
+                    prompt,
+                    query,
+                    valid,
+                    success,
+                ])
+                success_count += int(success)
+    finally:
+        fixture.close()
+    logger.info(
+        f"finished test suite with {success_count} of {len(suite['test_cases'])} successful",
+        test_suite=filename,
+    )
 
 
 def main() -> None:
     # Create a results directory for this run
-    RESULTS_PATH = os.path.join(TEST_PATH, "test_results", f"{str(datetime.now())}-{uuid.uuid4()}")
+    RESULTS_PATH = os.path.join(TEST_PATH, "test_results", f"{str(datetime.datetime.now())}-{uuid.uuid4()}")
     os.makedirs(RESULTS_PATH)
     # Stash model config for run
     with open(os.path.join(RESULTS_PATH, "model_config.json"), "w") as f:
         json.dump(DEFAULT_COMPLETION_CONFIG, f)
 
-    with open(os.path.join(RESULTS_PATH, "test_results.csv"), "w") as f:
-        result_writer = csv.writer(f, quoting=csv.QUOTE_ALL)
-        result_writer.writerow(RESULT_HEADER)
-        for filename in os.listdir(os.path.join(TEST_PATH, "test_suites")):
-            with open(os.path.join(TEST_PATH, "test_suites", filename)) as f:
-                # Should add error handling/validation
-                suite = json.load(f)
-            run_suite(suite, filename, result_writer)
+    cache = GenerationCache(GENERATION_CACHE_PATH, offline=OFFLINE)
+    try:
+        with open(os.path.join(RESULTS_PATH, "test_results.csv"), "w") as f:
+            result_writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+            result_writer.writerow(RESULT_HEADER)
+            for filename in sorted(os.listdir(TEST_SUITES_PATH)):
+                with open(os.path.join(TEST_SUITES_PATH, filename)) as suite_file:
+                    # Should add error handling/validation
+                    suite = json.load(suite_file)
+                run_suite(suite, filename, result_writer, cache)
+    finally:
+        cache.save()
@@ -1,8 +1,8 @@
+import functools
 import json
 import os
-import re
 import sys
-import subprocess
+import time
 import yaml
 from datetime import datetime
 from openai.error import InvalidRequestError
@@ -17,9 +17,11 @@ pg_text_query_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".
 sys.path.append(pg_text_query_path)
 
 from pg_text_query import (
-    generate_query,
+    QueryGenerator,
     describe_database,
 )
+from pg_text_query.normalize import parse_statements, statements_match
+from pg_text_query.transport import RecordingTransport, ReplayTransport, set_transport
 
 load_dotenv()
 
@@ -43,22 +45,26 @@ def load_schema(schema_path):
     return schema
 
 
-def format_sql(sql_code):
+@functools.lru_cache(maxsize=None)
+def get_expected_statements(category="easy", filename="test_prompts.json"):
     """
-    Formats SQL code using the pg_format command-line tool.
+    Parses the expected outputs of every test case in a category once per test file.
 
     Parameters:
-        sql_code (str): The SQL code to format.
+        category (str): The category of test prompts to parse. Defaults to "easy".
+        filename (str): The name of the JSON file containing the test prompts. Defaults to "test_prompts.json".
 
     Returns:
-        str: The formatted SQL code.
+        dict: A mapping of test case ID to a tuple of parsed expected outputs. An expected
+        output that fails to parse is kept as None and never matches.
     """
-    cmd = ["pg_format", "-s2", "-g", "-n"]
-    p = subprocess.Popen(
-        cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-    )
-    stdout, stderr = p.communicate(input=sql_code.encode())
-    return stdout.decode().strip()
+    return {
+        test_case["id"]: tuple(
+            parse_statements(expected_output)
+            for expected_output in test_case["expected_outputs"]
+        )
+        for test_case in get_test_data(category, filename)
+    }
 
 
 def get_test_data(category="easy", filename="test_prompts.json"):
@@ -128,7 +134,7 @@ def results_table(results):
     return table
 
 def test_prompts(prompt_template, test_case_file, category="easy",
-                 verbose=False, type="single", model_params: dict={}):
+                 verbose=False, type="single", model_params: dict={}, generator=None):
     """
     Executes SQL query test cases using the provided prompt template and test data.
     The function generates SQL queries using the prompt template and compares the
@@ -139,9 +145,12 @@ def test_prompts(prompt_template, test_case_file, category="easy",
     test_case_file (str): The name of the test case file to use.
     category (str): The difficulty category of the test cases. Default is "easy".
     verbose (bool): A flag indicating whether to print the log results. Default is False.
-    type (str): The type of completion method to use. Default is "single".
+    type (str): The type of completion method to use: "single", "chat", or "local"
+    to use the generator's own backend. Default is "single".
     model_params (dict): A dictionary containing additional model parameters for
     generating SQL queries. Default is an empty dictionary.
+    generator (QueryGenerator): The generator to use. Defaults to one using the
+    package-wide transport and config.
 
     Returns:
     log_results (dict): A dictionary containing the log results of the test cases.
@@ -153,6 +162,8 @@ def test_prompts(prompt_template, test_case_file, category="easy",
                    "model_params":model_params,
                    "results": []}
 
+    generator = generator or QueryGenerator()
+    completion_type = None if type == "local" else type
     counter = 0
     n_success = 0
     
@@ -167,20 +178,20 @@ def test_prompts(prompt_template, test_case_file, category="easy",
         prompt = prompt_template.format(schema=describe_database(db_schema), user_prompt=user_prompt)
 
         
+        start = time.perf_counter()
         try:
-            sql_output = generate_query(prompt, completion_type=type, **model_params)
+            sql_output = generator.generate(prompt, completion_type=completion_type, **model_params)
         except InvalidRequestError as e:
             raise e
+        latency = time.perf_counter() - start
            
         assert sql_output is not None, f"Generated SQL code is None: prompt={prompt}"
 
-        success = False
-        for expected_output in expected_outputs:
-            escaped_output = re.escape(format_sql(expected_output)).rstrip(";")
-            regex_pattern = f"^{escaped_output}(?=;)?"
-            if re.match(regex_pattern, format_sql(sql_output).strip(), re.IGNORECASE):
-                success = True
-                break
+        output_statements = parse_statements(sql_output)
+        success = any(
+            statements_match(output_statements, expected)
+            for expected in get_expected_statements(category, test_case_file)[id]
+        )
         
         if success:
             n_success += 1
@@ -196,11 +207,17 @@ def test_prompts(prompt_template, test_case_file, category="easy",
             "expected_outputs": expected_outputs,
             "sql_output": sql_output,
             "success": success,
+            "latency": latency,
         }
 
         log_results["results"].append(result)
         
-    log_results.update({"total": counter, "successful": n_success})
+    latencies = sorted(result["latency"] for result in log_results["results"])
+    log_results.update({
+        "total": counter,
+        "successful": n_success,
+        "median_latency": latencies[len(latencies) // 2] if latencies else None,
+    })
     if verbose:
         pprint(log_results)
     return log_results
@@ -235,7 +252,49 @@ if __name__ == "__main__":
         dest="verbose",
         help="whether to print log output to terminal")
 
+    parser.add_argument(
+        "--record",
+        dest="record_file",
+        type=str,
+        default=None,
+        help="Record OpenAI requests and responses to this file for later replay."
+    )
+
+    parser.add_argument(
+        "--replay",
+        dest="replay_file",
+        type=str,
+        default=None,
+        help="Serve responses recorded with --record from this file instead of calling OpenAI."
+    )
+
+    parser.add_argument(
+        "--replay-latency",
+        dest="replay_latency",
+        type=float,
+        default=0.0,
+        help="Seconds of latency to inject per replayed request."
+    )
+
+    parser.add_argument(
+        "--replay-error-rate",
+        dest="replay_error_rate",
+        type=float,
+        default=0.0,
+        help="Fraction of replayed requests that raise a retryable API error."
+    )
+
     args = parser.parse_args()
+    if args.record_file and args.replay_file:
+        parser.error("--record and --replay are mutually exclusive")
+    if args.record_file:
+        set_transport(RecordingTransport(args.record_file))
+    elif args.replay_file:
+        set_transport(ReplayTransport(
+            args.replay_file,
+            latency=args.replay_latency,
+            error_rate=args.replay_error_rate,
+        ))
     config = load_config(args.config_file)
     prompt_template = config.get("prompt", {}).get("template",
                     "A PostgreSQL Query to SELECT 1 and a PostgreSQL query to {user_prompt}")
@@ -244,6 +303,10 @@ if __name__ == "__main__":
     log_file = config.get("log", {}).get("path", None)
     model_type = config.get("model", {}).get("type", "chat")
     model_params = config.get("model", {}).get("params", {})
+    generator = None
+    if model_type == "local":
+        # model.path is a GGUF model file, run on CPU with llama-cpp-python
+        generator = QueryGenerator.from_local(config["model"]["path"])
 
     results = test_prompts(
         prompt_template=prompt_template,
@@ -252,6 +315,7 @@ if __name__ == "__main__":
         verbose=args.verbose,
         type=model_type,
         model_params = model_params,
+        generator=generator,
     )
 
     results.update({